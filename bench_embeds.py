@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Замер сборки embed: create_embed против заранее собранных шаблонов
+
+Для справки и типовых ответов об ошибках сравнивает время и объем выделенной
+памяти на один ответ: сборку через create_embed (как раньше) и выдачу
+из EmbedTemplate.
+
+Запуск: python bench_embeds.py [количество_повторов]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from casino_bot import (
+    create_embed, HELP_EMBEDS, ROULETTE_HELP_EMBED, ACCESS_DENIED_EMBED, INSUFFICIENT_FUNDS_EMBED,
+)
+
+def create_embed_args(template) -> dict:
+    """Параметры create_embed, из которых собран шаблон"""
+    embed = template.embed
+    return {
+        "title": embed.title,
+        "description": template.description or embed.description,
+        "color": embed.color.value,
+        "fields": [{"name": field.name, "value": field.value, "inline": field.inline} for field in embed.fields],
+        "footer": embed.footer.text,
+    }
+
+def measure(build, count: int):
+    """Вернуть время (мкс) и выделенную память (байт) на один вызов"""
+    started = time.perf_counter()
+    for _ in range(count):
+        build()
+    elapsed = (time.perf_counter() - started) / count * 1e6
+
+    tracemalloc.start()
+    embeds = [build() for _ in range(min(count, 1000))]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del embeds
+    return elapsed, size / min(count, 1000)
+
+def report(name: str, before, after):
+    """Вывести результат сравнения"""
+    print(f"{name:<22} было {before[0]:6.1f} мкс {before[1]:7.0f} Б, "
+          f"стало {after[0]:6.1f} мкс {after[1]:7.0f} Б")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    for name, template in [("/help games", HELP_EMBEDS["games"]), ("/roulette help", ROULETTE_HELP_EMBED),
+                           ("Доступ запрещен", ACCESS_DENIED_EMBED)]:
+        args = create_embed_args(template)
+        report(name, measure(lambda: create_embed(**args), count), measure(template.render, count))
+
+    args = create_embed_args(INSUFFICIENT_FUNDS_EMBED)
+    description = args.pop("description")
+    report(
+        "Недостаточно средств",
+        measure(lambda: create_embed(description=description.format(balance="1,000", amount="5,000"), **args), count),
+        measure(lambda: INSUFFICIENT_FUNDS_EMBED.render(balance="1,000", amount="5,000"), count),
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Замер памяти записей User и GameHistory
+
+Сравнивает компактные записи из casino_bot (с __slots__ и временем в виде
+Unix timestamp) с прежним представлением (словарь атрибутов и datetime).
+
+Запуск: python bench_memory.py [количество_записей]
+"""
+
+import sys
+import random
+import datetime
+import tracemalloc
+
+from casino_bot import User, GameHistory, GameType, GameOutcome
+
+class LegacyUser:
+    """Прежнее представление пользователя (со словарем атрибутов)"""
+    def __init__(self, user_id, username, discriminator="", balance=10000, is_admin=False):
+        self.id = random.randint(1, 1000000)
+        self.user_id = user_id
+        self.username = username
+        self.discriminator = discriminator
+        self.balance = balance
+        self.is_admin = is_admin
+        self.last_daily = None
+        self.games_played = 0
+        self.games_won = 0
+
+class LegacyGameHistory:
+    """Прежнее представление записи истории (словарь атрибутов и datetime)"""
+    def __init__(self, user_id, game_type, bet_amount, outcome, win_amount=0):
+        self.id = random.randint(1, 1000000)
+        self.user_id = user_id
+        self.game_type = game_type
+        self.bet_amount = bet_amount
+        self.outcome = outcome
+        self.win_amount = win_amount
+        self.timestamp = datetime.datetime.now()
+
+def measure(factory, count: int) -> int:
+    """Вернуть объем памяти (в байтах), занятый count записями"""
+    tracemalloc.start()
+    records = [factory(i) for i in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return size
+
+def report(name: str, legacy_bytes: int, compact_bytes: int, count: int):
+    """Вывести результат сравнения"""
+    saved = 1 - compact_bytes / legacy_bytes
+    print(f"{name:<12} было {legacy_bytes / count:7.1f} Б/запись, "
+          f"стало {compact_bytes / count:7.1f} Б/запись, экономия {saved:.0%}")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    user_ids = [str(100000000000000000 + i) for i in range(count)]
+
+    legacy = measure(lambda i: LegacyUser(user_ids[i], "player"), count)
+    compact = measure(lambda i: User(user_ids[i], "player"), count)
+    report("User", legacy, compact, count)
+
+    legacy = measure(lambda i: LegacyGameHistory(user_ids[i], GameType.SLOTS, 100, GameOutcome.LOSS), count)
+    compact = measure(lambda i: GameHistory(user_ids[i], GameType.SLOTS, 100, GameOutcome.LOSS), count)
+    report("GameHistory", legacy, compact, count)
+
+if __name__ == "__main__":
+    main()
@@ -15,14 +15,28 @@ PutinZov Casino Bot - Discord бот с казино-играми и эконо
 """
 
 import os
+import glob
+import gzip
 import json
+import hmac
+import math
+import time
 import random
+import heapq
+import hashlib
+import secrets
 import asyncio
+import sqlite3
 import datetime
+import threading
 from typing import Dict, List, Optional, Union, Any, Tuple
 from enum import Enum
+from bisect import bisect_left
+from itertools import chain, count, islice, product
 from collections import deque
+from aiohttp import web
 from dotenv import load_dotenv
+from sortedcontainers import SortedList
 
 import discord
 from discord import app_commands
@@ -31,6 +45,14 @@ from discord.ext import commands, tasks
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'casino.db')                       # Путь к файлу SQLite
+STORAGE_FLUSH_INTERVAL = float(os.getenv('STORAGE_FLUSH_INTERVAL', '0.5'))  # Интервал группового коммита (сек)
+HISTORY_HOT_SIZE = int(os.getenv('HISTORY_HOT_SIZE', '100000'))               # Сколько последних игр держать в памяти
+HISTORY_ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', 'history_archive')     # Каталог сегментов архива истории
+RNG_MODE = os.getenv('RNG_MODE', 'secure')                                     # Режим генератора: secure, seeded, fair
+RNG_SEED = os.getenv('RNG_SEED')                                               # Сид для режима seeded
+HTTP_PORT = int(os.getenv('PORT', '8080'))                                     # Порт /healthz и /metrics (0 - выключить)
+COMMAND_SYNC_GUILD = os.getenv('COMMAND_SYNC_GUILD')                           # Сервер для быстрой синхронизации команд (для разработки)
 
 # Настройка интентов Discord
 intents = discord.Intents.default()
@@ -38,8 +60,177 @@ intents.message_content = True
 intents.members = True
 intents.guilds = True
 
+class CasinoCommandTree(app_commands.CommandTree):
+    """Дерево команд, отмечающее начало и ошибки вызовов для метрик"""
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.type is discord.InteractionType.application_command:
+            command_metrics.start(interaction)
+        return True
+    
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        if interaction.command:
+            command_metrics.finish(interaction, interaction.command.qualified_name, failed=True)
+        await super().on_error(interaction, error)
+
 # Создание экземпляра бота
-bot = commands.Bot(command_prefix='/', intents=intents)
+bot = commands.Bot(command_prefix='/', intents=intents, tree_cls=CasinoCommandTree)
+started_at = time.perf_counter()              # Момент запуска процесса
+startup_seconds = None                        # Время от запуска до первого on_ready
+
+#########################
+# ГЕНЕРАТОР СЛУЧАЙНЫХ ЧИСЕЛ
+#########################
+
+RNG_BATCH_BLOCKS = 128                        # Блоков по 32 байта в одной заранее вычисленной пачке
+
+class ByteStreamRandom(random.Random):
+    """Генератор поверх буферизованного потока байтов
+    
+    Байты берутся пачками из source(), поэтому криптографический источник
+    вызывается редко. Все методы random.Random (randint, shuffle, choice)
+    работают через getrandbits() и random().
+    """
+    def __init__(self, source):
+        self.source = source                  # Функция, возвращающая следующую пачку байтов
+        self.buffer = b""
+        self.offset = 0
+        self.consumed = 0                     # Сколько байтов потока уже использовано
+        super().__init__()
+    
+    def seed(self, *args, **kwargs):
+        """Поток байтов не переинициализируется"""
+        pass
+    
+    def getstate(self):
+        """Состояние потока не сериализуется: источник байтов нельзя сохранить"""
+        raise TypeError("ByteStreamRandom state cannot be saved or pickled")
+    
+    def setstate(self, state):
+        """Состояние потока не восстанавливается"""
+        raise TypeError("ByteStreamRandom state cannot be restored")
+    
+    def take(self, count: int) -> bytes:
+        """Взять count байтов из буфера, дополняя его пачками"""
+        while self.offset + count > len(self.buffer):
+            self.buffer = self.buffer[self.offset:] + self.source()
+            self.offset = 0
+        data = self.buffer[self.offset:self.offset + count]
+        self.offset += count
+        self.consumed += count
+        return data
+    
+    def getrandbits(self, k: int) -> int:
+        if k <= 0:
+            return 0
+        size = (k + 7) // 8
+        return int.from_bytes(self.take(size), "big") >> (size * 8 - k)
+    
+    def random(self) -> float:
+        return self.getrandbits(53) * 2 ** -53
+
+class FairSeed:
+    """Пара сидов для режима доказуемой честности (commit-reveal)
+    
+    Хеш серверного сида публикуется заранее, байты потока считаются как
+    HMAC-SHA256(server_seed, "client_seed:номер_блока"). После раскрытия
+    серверного сида любой может воспроизвести поток через fair_random().
+    """
+    def __init__(self, client_seed: str):
+        self.server_seed = secrets.token_bytes(32)
+        self.server_seed_hash = hashlib.sha256(self.server_seed).hexdigest()
+        self.client_seed = client_seed
+        self.block = 0                        # Номер следующего блока HMAC
+    
+    def next_batch(self) -> bytes:
+        """Вычислить следующую пачку блоков потока"""
+        blocks = range(self.block, self.block + RNG_BATCH_BLOCKS)
+        self.block += RNG_BATCH_BLOCKS
+        return b"".join(fair_block(self.server_seed, self.client_seed, block) for block in blocks)
+
+def fair_block(server_seed: bytes, client_seed: str, block: int) -> bytes:
+    """Блок потока доказуемо честного генератора"""
+    return hmac.new(server_seed, f"{client_seed}:{block}".encode(), hashlib.sha256).digest()
+
+def fair_random(server_seed: bytes, client_seed: str) -> ByteStreamRandom:
+    """Воспроизвести поток по раскрытому серверному сиду (для проверки игр)"""
+    blocks = count()
+    return ByteStreamRandom(lambda: b"".join(
+        fair_block(server_seed, client_seed, next(blocks)) for _ in range(RNG_BATCH_BLOCKS)
+    ))
+
+class RandomService:
+    """Сервис случайных чисел с отдельными потоками для каждой игры
+    
+    Режимы:
+    - secure: криптографический источник secrets, байты читаются пачками;
+    - seeded: воспроизводимые потоки random.Random от общего сида (для тестов);
+    - fair: доказуемо честные потоки на паре серверного и клиентского сида.
+    """
+    MODES = ("secure", "seeded", "fair")
+    
+    def __init__(self, mode: str = "secure", seed: Optional[str] = None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown RNG mode: {mode}")
+        self.mode = mode
+        self.seed = seed if seed is not None else secrets.token_hex(16)
+        self.streams = {}                     # Потоки: {имя: random.Random}
+        self.fair_seeds = {}                  # Сиды честного режима: {имя: FairSeed}
+        self.on_new_seed = None               # Вызывается (имя, FairSeed) для каждого нового сида
+    
+    def stream(self, name: str) -> random.Random:
+        """Поток случайных чисел с данным именем"""
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = self.streams[name] = self._create_stream(name)
+        return stream
+    
+    def _create_stream(self, name: str, client_seed: Optional[str] = None) -> random.Random:
+        """Создать поток в соответствии с режимом"""
+        if self.mode == "seeded":
+            return random.Random(f"{self.seed}:{name}")
+        if self.mode == "fair":
+            fair_seed = self.fair_seeds[name] = FairSeed(client_seed or secrets.token_hex(8))
+            if self.on_new_seed:
+                self.on_new_seed(name, fair_seed)
+            return ByteStreamRandom(fair_seed.next_batch)
+        return ByteStreamRandom(lambda: secrets.token_bytes(RNG_BATCH_BLOCKS * 32))
+    
+    def commitment(self, name: str) -> Optional[Tuple[str, str, int]]:
+        """Опубликованные данные потока: (хеш серверного сида, клиентский сид, использовано байтов)"""
+        if self.mode != "fair":
+            return None
+        stream = self.stream(name)
+        fair_seed = self.fair_seeds[name]
+        return fair_seed.server_seed_hash, fair_seed.client_seed, stream.consumed
+    
+    def position(self, name: str) -> Optional[str]:
+        """Позиция в потоке для записи с игрой: "начало хеша серверного сида:использовано байтов"
+        
+        По раскрытому сиду игрок воспроизводит поток и находит в нем свою игру.
+        """
+        if self.mode != "fair":
+            return None
+        stream = self.stream(name)
+        return f"{self.fair_seeds[name].server_seed_hash[:16]}:{stream.consumed}"
+    
+    def rotate(self, name: str, client_seed: Optional[str] = None) -> Optional[Tuple[str, str, int]]:
+        """Раскрыть серверный сид потока и начать новую пару сидов
+        
+        Возвращает (серверный сид в hex, клиентский сид, использовано байтов).
+        """
+        if self.mode != "fair":
+            return None
+        stream = self.stream(name)
+        fair_seed = self.fair_seeds[name]
+        revealed = (fair_seed.server_seed.hex(), fair_seed.client_seed, stream.consumed)
+        self.streams[name] = self._create_stream(name, client_seed)
+        return revealed
+
+rng = RandomService(RNG_MODE, RNG_SEED)
+
+def random_id() -> int:
+    """Случайный ID записи"""
+    return rng.stream("ids").randint(1, 2 ** 53)
 
 #########################
 # СИСТЕМА ХРАНЕНИЯ ДАННЫХ
@@ -58,16 +249,40 @@ class GameOutcome(Enum):
     PUSH = "push"
     BLACKJACK = "blackjack"
     NO_MATCH = "no_match"
+    PARTIAL_RETURN = "partial_return"         # Выплата меньше ставки: не считается победой
     SMALL_WIN = "small_win"
     MEDIUM_WIN = "medium_win"
     BIG_WIN = "big_win"
     JACKPOT = "jackpot"
 
+class LedgerEntryType(Enum):
+    """Типы записей журнала изменений баланса"""
+    ACCOUNT_OPEN = "account_open"   # Открытие счета с начальным балансом
+    BET = "bet"                     # Списание ставки
+    PAYOUT = "payout"               # Выплата выигрыша
+    REFUND = "refund"               # Возврат ставки
+    TRANSFER_OUT = "transfer_out"   # Исходящий перевод
+    TRANSFER_IN = "transfer_in"     # Входящий перевод
+    DAILY = "daily"                 # Ежедневный бонус
+    ADMIN_GIVE = "admin_give"       # Выдача администратором
+    ADMIN_TAKE = "admin_take"       # Изъятие администратором
+    ADMIN_RESET = "admin_reset"     # Сброс баланса администратором
+
+# Отображаемые названия игр
+GAME_TYPE_NAMES = {
+    GameType.ROULETTE: "Рулетка",
+    GameType.BLACKJACK: "Блэкджек",
+    GameType.SLOTS: "Слоты",
+}
+
 class User:
     """Класс пользователя с балансом и статистикой"""
+    __slots__ = ("id", "user_id", "username", "discriminator", "balance",
+                 "is_admin", "last_daily", "games_played", "games_won")
+    
     def __init__(self, user_id: str, username: str, discriminator: str = "", 
                 balance: int = 10000, is_admin: bool = False):
-        self.id = random.randint(1, 1000000)  # Уникальный ID в системе
+        self.id = random_id()                 # Уникальный ID в системе
         self.user_id = user_id                # Discord ID
         self.username = username              # Имя пользователя
         self.discriminator = discriminator    # Дискриминатор
@@ -78,22 +293,700 @@ class User:
         self.games_won = 0                    # Выигранные игры
 
 class GameHistory:
-    """Запись истории игры"""
+    """Запись истории игры
+    
+    Время хранится как Unix timestamp (float) вместо объекта datetime,
+    а __slots__ убирает словарь атрибутов у каждой записи.
+    """
+    __slots__ = ("id", "user_id", "game_type", "bet_amount", "outcome", "win_amount", "ts", "nonce")
+    
     def __init__(self, user_id: str, game_type: GameType, bet_amount: int, 
-                outcome: GameOutcome, win_amount: int = 0):
-        self.id = random.randint(1, 1000000)  # Уникальный ID
+                outcome: GameOutcome, win_amount: int = 0, nonce: Optional[str] = None):
+        self.id = random_id()                 # Уникальный ID
         self.user_id = user_id                # Discord ID пользователя
         self.game_type = game_type            # Тип игры
         self.bet_amount = bet_amount          # Сумма ставки
         self.outcome = outcome                # Результат
         self.win_amount = win_amount          # Сумма выигрыша
-        self.timestamp = datetime.datetime.now()  # Время игры
+        self.ts = time.time()                 # Время игры (Unix timestamp)
+        self.nonce = nonce                    # Позиция в потоке честного режима (None вне его)
+    
+    @property
+    def timestamp(self) -> datetime.datetime:
+        """Время игры"""
+        return datetime.datetime.fromtimestamp(self.ts)
+    
+    @timestamp.setter
+    def timestamp(self, value: datetime.datetime):
+        self.ts = value.timestamp()
+
+# Минимальный размер пачки записей, переносимой из базы в архив
+HISTORY_ROLL_BATCH = 1000
+
+# Через сколько записей журнала делать снимок балансов
+LEDGER_SNAPSHOT_EVERY = 10000
+
+# Поиск значений перечислений по строке без накладных расходов Enum.__call__
+GAME_TYPES_BY_VALUE = {game_type.value: game_type for game_type in GameType}
+GAME_OUTCOMES_BY_VALUE = {outcome.value: outcome for outcome in GameOutcome}
+
+def history_to_row(history: GameHistory) -> tuple:
+    """Преобразовать запись истории в компактную строку для хранения"""
+    return (history.id, history.user_id, history.game_type.value, history.bet_amount,
+            history.outcome.value, history.win_amount, history.ts, history.nonce)
+
+def history_from_row(row) -> GameHistory:
+    """Восстановить запись истории из компактной строки
+    
+    Запись собирается без конструктора: он тратит на новый ID
+    криптостойкий поток, а ID все равно берется из строки.
+    """
+    record = GameHistory.__new__(GameHistory)
+    (record.id, record.user_id, game_type, record.bet_amount,
+     outcome, record.win_amount, record.ts) = row[:7]
+    record.nonce = row[7] if len(row) > 7 else None  # В старых сегментах архива позиции нет
+    record.game_type = GAME_TYPES_BY_VALUE[game_type]
+    record.outcome = GAME_OUTCOMES_BY_VALUE[outcome]
+    return record
+
+def user_from_row(row) -> User:
+    """Восстановить пользователя из строки таблицы users (без генерации нового ID)"""
+    user = User.__new__(User)
+    (user.user_id, user.id, user.username, user.discriminator, user.balance,
+     is_admin, last_daily, user.games_played, user.games_won) = row
+    user.is_admin = bool(is_admin)
+    user.last_daily = datetime.datetime.fromtimestamp(last_daily) if last_daily is not None else None
+    return user
+
+class HistoryArchive:
+    """Холодный архив истории игр: сжатые JSONL-сегменты по дням
+    
+    Каждый сегмент - файл YYYY-MM-DD.jsonl.gz, в который записи только
+    дописываются (новым gzip-блоком на каждую пачку). Рядом лежит индекс
+    YYYY-MM-DD.users со списком пользователей сегмента, поэтому при поиске
+    истории распаковываются только сегменты, где пользователь есть.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.user_index = {}                  # Пользователи сегментов: {путь сегмента: set(user_id)}
+        self.lock = threading.Lock()          # Дозапись и чтение сегментов из разных потоков
+        os.makedirs(directory, exist_ok=True)
+    
+    def segment_path(self, day: datetime.date) -> str:
+        """Путь к сегменту за указанный день"""
+        return os.path.join(self.directory, f"{day.isoformat()}.jsonl.gz")
+    
+    def segment_users(self, path: str) -> set:
+        """Пользователи сегмента (индекс строится при первом обращении, если его нет)"""
+        users = self.user_index.get(path)
+        if users is None:
+            users_path = path[:-len(".jsonl.gz")] + ".users"
+            if os.path.exists(users_path):
+                with open(users_path, encoding="utf-8") as index:
+                    users = set(index.read().split())
+            else:
+                users = set()
+                if os.path.exists(path):
+                    with gzip.open(path, "rt", encoding="utf-8") as segment:
+                        users = {json.loads(line)[1] for line in segment}
+                with open(users_path, "w", encoding="utf-8") as index:
+                    index.write("".join(f"{user_id}\n" for user_id in users))
+            self.user_index[path] = users
+        return users
+    
+    def append(self, rows: List[tuple]):
+        """Дописать строки истории в сегменты соответствующих дней"""
+        by_day = {}
+        for row in rows:
+            day = datetime.date.fromtimestamp(row[6])
+            by_day.setdefault(day, []).append(row)
+        
+        with self.lock:
+            for day, day_rows in by_day.items():
+                path = self.segment_path(day)
+                users = self.segment_users(path)
+                
+                # Индекс дописывается до сегмента: после сбоя между записями в нем может
+                # остаться лишний пользователь (безопасно), но не пропасть нужный
+                new_users = {row[1] for row in day_rows} - users
+                if new_users:
+                    with open(path[:-len(".jsonl.gz")] + ".users", "a", encoding="utf-8") as index:
+                        index.write("".join(f"{user_id}\n" for user_id in new_users))
+                        index.flush()
+                        os.fsync(index.fileno())
+                    users.update(new_users)
+                
+                data = "".join(json.dumps(row, ensure_ascii=False, separators=(',', ':')) + "\n" for row in day_rows)
+                with open(path, "ab") as raw:
+                    with gzip.GzipFile(fileobj=raw, mode="ab") as segment:
+                        segment.write(data.encode("utf-8"))
+                    raw.flush()
+                    os.fsync(raw.fileno())
+    
+    def iter_user_rows(self, user_id: str, before: float = math.inf):
+        """Потоково выдать строки пользователя старше before, от новых к старым
+        
+        Сегменты за дни, начавшиеся не раньше before, и сегменты без
+        пользователя в индексе пропускаются без распаковки.
+        """
+        needle = json.dumps(user_id)
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.jsonl.gz")), reverse=True):
+            day = datetime.date.fromisoformat(os.path.basename(path)[:-len(".jsonl.gz")])
+            if datetime.datetime.combine(day, datetime.time()).timestamp() >= before:
+                continue
+            
+            matches = []
+            with self.lock:
+                if user_id not in self.segment_users(path):
+                    continue
+                with gzip.open(path, "rt", encoding="utf-8") as segment:
+                    for line in segment:
+                        # Быстрый отсев строк до разбора JSON
+                        if needle not in line:
+                            continue
+                        row = json.loads(line)
+                        if row[1] == user_id and row[6] < before:
+                            matches.append(row)
+            yield from reversed(matches)
+
+class StorageBackend:
+    """Базовый бэкенд хранения (только память, ничего не сохраняет)"""
+    last_flush_seconds = 0.0                  # Длительность последнего коммита
+    
+    def load(self) -> Tuple[List[User], List[GameHistory]]:
+        """Загрузить сохраненных пользователей и историю игр"""
+        return [], []
+    
+    def load_stats(self) -> List[tuple]:
+        """Загрузить агрегаты игр: строки (день, тип игры, игр, поставлено, выплачено)"""
+        return []
+    
+    def load_guild_members(self) -> List[Tuple[str, str]]:
+        """Загрузить членство пользователей в серверах: пары (guild_id, user_id)"""
+        return []
+    
+    def save_user(self, user: User):
+        """Поставить пользователя в очередь на сохранение"""
+        pass
+    
+    def save_ledger_entry(self, user: User, entry_type: LedgerEntryType, delta: int):
+        """Поставить изменение баланса (запись журнала и пользователя) в очередь"""
+        self.save_user(user)
+    
+    def save_guild_member(self, guild_id: str, user_id: str, is_member: bool):
+        """Поставить изменение членства в очередь на сохранение"""
+        pass
+    
+    def save_game(self, history: GameHistory, payout: int):
+        """Поставить запись истории и выплату по ней в очередь на сохранение"""
+        pass
+    
+    def iter_history(self, user_id: str, before: float):
+        """Потоково выдать сохраненные игры пользователя старше before, от новых к старым"""
+        return iter(())
+    
+    def balance_at(self, user_id: str, timestamp: float) -> Optional[int]:
+        """Восстановить баланс пользователя на указанный момент"""
+        return None
+    
+    def load_sessions(self) -> List[tuple]:
+        """Загрузить сохраненные игровые сессии блэкджека"""
+        return []
+    
+    def save_session(self, user_id: str, row: Optional[tuple]):
+        """Поставить сессию в очередь на сохранение (None - удалить)"""
+        pass
+    
+    def load_roulette_bets(self) -> List[tuple]:
+        """Загрузить ставки открытых столов рулетки: строки (канал, время вращения, user_id, сумма)"""
+        return []
+    
+    def save_roulette_bet(self, row: tuple):
+        """Поставить ставку стола рулетки в очередь на сохранение"""
+        pass
+    
+    def delete_roulette_bets(self, channel_id: int, spin_at: float):
+        """Поставить в очередь удаление ставок рассчитанного стола"""
+        pass
+    
+    def load_setting(self, key: str) -> Optional[str]:
+        """Прочитать служебную настройку"""
+        return None
+    
+    def save_setting(self, key: str, value: str):
+        """Сохранить служебную настройку"""
+        pass
+    
+    def flush(self):
+        """Записать накопленные изменения"""
+        pass
+    
+    def close(self):
+        """Закрыть бэкенд, записав все изменения"""
+        pass
+
+class SQLiteStorageBackend(StorageBackend):
+    """Бэкенд на встроенной SQLite в режиме WAL с групповыми коммитами
+    
+    Изменения накапливаются в памяти и записываются одной транзакцией
+    при вызове flush(), поэтому серия ставок стоит одного fsync на пакет.
+    В базе остаются только последние hot_size игр, более старые
+    переносятся в архив сегментов (если он указан).
+    
+    Каждое изменение баланса дописывается в журнал ledger, а раз в
+    LEDGER_SNAPSHOT_EVERY записей сохраняется снимок балансов изменившихся
+    пользователей. Балансы при запуске восстанавливаются из последних
+    снимков и хвоста журнала после них.
+    """
+    def __init__(self, path: str, archive_dir: Optional[str] = None,
+                 hot_size: int = HISTORY_HOT_SIZE):
+        self.path = path
+        self.hot_size = hot_size
+        self.archive = HistoryArchive(archive_dir) if archive_dir else None
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY,
+                id INTEGER NOT NULL,
+                username TEXT NOT NULL,
+                discriminator TEXT NOT NULL,
+                balance INTEGER NOT NULL,
+                is_admin INTEGER NOT NULL,
+                last_daily REAL,
+                games_played INTEGER NOT NULL,
+                games_won INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS game_history (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                game_type TEXT NOT NULL,
+                bet_amount INTEGER NOT NULL,
+                outcome TEXT NOT NULL,
+                win_amount INTEGER NOT NULL,
+                timestamp REAL NOT NULL,
+                nonce TEXT
+            );
+            CREATE INDEX IF NOT EXISTS game_history_user ON game_history (user_id, seq);
+            CREATE TABLE IF NOT EXISTS game_stats (
+                day TEXT NOT NULL,
+                game_type TEXT NOT NULL,
+                games INTEGER NOT NULL,
+                wagered INTEGER NOT NULL,
+                paid_out INTEGER NOT NULL,
+                PRIMARY KEY (day, game_type)
+            );
+            CREATE TABLE IF NOT EXISTS guild_members (
+                guild_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                PRIMARY KEY (guild_id, user_id)
+            );
+            CREATE TABLE IF NOT EXISTS ledger (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                entry_type TEXT NOT NULL,
+                delta INTEGER NOT NULL,
+                timestamp REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ledger_user ON ledger (user_id, seq);
+            CREATE TABLE IF NOT EXISTS ledger_snapshots (
+                ledger_seq INTEGER PRIMARY KEY,
+                timestamp REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS snapshot_balances (
+                user_id TEXT NOT NULL,
+                ledger_seq INTEGER NOT NULL,
+                balance INTEGER NOT NULL,
+                PRIMARY KEY (user_id, ledger_seq)
+            );
+            CREATE TABLE IF NOT EXISTS blackjack_sessions (
+                user_id TEXT PRIMARY KEY,
+                bet_amount INTEGER NOT NULL,
+                shoe BLOB NOT NULL,
+                shoe_position INTEGER NOT NULL,
+                player BLOB NOT NULL,
+                dealer BLOB NOT NULL,
+                flags INTEGER NOT NULL,
+                channel_id INTEGER,
+                message_id INTEGER,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS roulette_bets (
+                channel_id INTEGER NOT NULL,
+                spin_at REAL NOT NULL,
+                user_id TEXT NOT NULL,
+                amount INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        # Базы, созданные до записи позиций честного режима, получают новый столбец
+        if "nonce" not in {column[1] for column in self.conn.execute("PRAGMA table_info(game_history)")}:
+            self.conn.execute("ALTER TABLE game_history ADD COLUMN nonce TEXT")
+        self.conn.commit()
+        self.history_rows = self.conn.execute("SELECT COUNT(*) FROM game_history").fetchone()[0]
+        self.ledger_seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM ledger").fetchone()[0]
+        self.snapshot_seq = self.conn.execute("SELECT MAX(ledger_seq) FROM ledger_snapshots").fetchone()[0]
+        if self.snapshot_seq is None:
+            # Первый запуск с журналом: текущие балансы становятся начальным снимком
+            self.snapshot_seq = self.ledger_seq
+            self._snapshot_balances(None)
+        self.snapshot_dirty = {row[0] for row in self.conn.execute(
+            "SELECT DISTINCT user_id FROM ledger WHERE seq > ?", (self.snapshot_seq,))}
+        self.pending_users = {}               # Ожидающие записи пользователи: {user_id: строка}
+        self.pending_games = []               # Ожидающие записи строки истории
+        self.pending_stats = {}               # Приращения агрегатов: {(день, тип игры): [игр, поставлено, выплачено]}
+        self.pending_members = {}             # Изменения членства: {(guild_id, user_id): состоит ли}
+        self.pending_ledger = []              # Ожидающие записи строки журнала балансов
+        self.pending_sessions = {}            # Изменения сессий блэкджека: {user_id: строка или None}
+        self.pending_roulette = []            # Изменения ставок столов по порядку: (строка, None) или (None, стол)
+        self.pending_lock = threading.Lock()  # Защита очередей
+        self.db_lock = threading.Lock()       # Сериализация доступа к соединению
+        self.last_flush_seconds = 0.0         # Длительность последнего коммита
+    
+    def load(self) -> Tuple[List[User], List[GameHistory]]:
+        """Загрузить сохраненных пользователей и историю игр"""
+        users = [user_from_row(row) for row in self.conn.execute(
+            "SELECT user_id, id, username, discriminator, balance, is_admin, "
+            "last_daily, games_played, games_won FROM users")]
+        
+        # Восстанавливаем балансы: последний снимок каждого пользователя + хвост журнала
+        balances = dict(self.conn.execute(
+            "SELECT b.user_id, b.balance FROM snapshot_balances b JOIN "
+            "(SELECT user_id, MAX(ledger_seq) AS ledger_seq FROM snapshot_balances GROUP BY user_id) l "
+            "ON b.user_id = l.user_id AND b.ledger_seq = l.ledger_seq"
+        ))
+        for user_id, delta in self.conn.execute(
+                "SELECT user_id, SUM(delta) FROM ledger WHERE seq > ? GROUP BY user_id", (self.snapshot_seq,)):
+            balances[user_id] = balances.get(user_id, 0) + delta
+        for user in users:
+            balance = balances.get(user.user_id, 0)
+            if balance != user.balance:
+                print(f"Ledger balance mismatch for user {user.user_id}: {user.balance} != {balance}")
+                user.balance = balance
+        
+        # Загружаем только горячее окно последних игр
+        rows = self.conn.execute(
+            "SELECT id, user_id, game_type, bet_amount, outcome, win_amount, timestamp, nonce "
+            "FROM game_history ORDER BY seq DESC LIMIT ?", (self.hot_size,)
+        ).fetchall()
+        history = [history_from_row(row) for row in reversed(rows)]
+        
+        return users, history
+    
+    def load_stats(self) -> List[tuple]:
+        """Загрузить агрегаты игр: строки (день, тип игры, игр, поставлено, выплачено)"""
+        return [
+            (datetime.date.fromisoformat(row[0]), GameType(row[1]), row[2], row[3], row[4])
+            for row in self.conn.execute("SELECT day, game_type, games, wagered, paid_out FROM game_stats")
+        ]
+    
+    def load_guild_members(self) -> List[Tuple[str, str]]:
+        """Загрузить членство пользователей в серверах: пары (guild_id, user_id)"""
+        return self.conn.execute("SELECT guild_id, user_id FROM guild_members").fetchall()
+    
+    def save_user(self, user: User):
+        """Поставить пользователя в очередь на сохранение"""
+        row = (user.user_id, user.id, user.username, user.discriminator, user.balance,
+               int(user.is_admin), user.last_daily.timestamp() if user.last_daily else None,
+               user.games_played, user.games_won)
+        with self.pending_lock:
+            self.pending_users[user.user_id] = row
+    
+    def save_ledger_entry(self, user: User, entry_type: LedgerEntryType, delta: int):
+        """Поставить изменение баланса (запись журнала и пользователя) в очередь"""
+        row = (user.user_id, user.id, user.username, user.discriminator, user.balance,
+               int(user.is_admin), user.last_daily.timestamp() if user.last_daily else None,
+               user.games_played, user.games_won)
+        entry = (user.user_id, entry_type.value, delta, time.time())
+        
+        # Обе записи ставятся под одной блокировкой, чтобы попасть в один коммит
+        with self.pending_lock:
+            self.pending_users[user.user_id] = row
+            self.pending_ledger.append(entry)
+    
+    def save_guild_member(self, guild_id: str, user_id: str, is_member: bool):
+        """Поставить изменение членства в очередь на сохранение"""
+        with self.pending_lock:
+            self.pending_members[(guild_id, user_id)] = is_member
+    
+    def save_game(self, history: GameHistory, payout: int):
+        """Поставить запись истории и выплату по ней в очередь на сохранение"""
+        row = history_to_row(history)
+        key = (datetime.date.fromtimestamp(history.ts).isoformat(), row[2])
+        with self.pending_lock:
+            self.pending_games.append(row)
+            stats = self.pending_stats.get(key)
+            if stats is None:
+                stats = self.pending_stats[key] = [0, 0, 0]
+            stats[0] += 1
+            stats[1] += history.bet_amount
+            stats[2] += payout
+    
+    def iter_history(self, user_id: str, before: float):
+        """Потоково выдать сохраненные игры пользователя старше before, от новых к старым"""
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT id, user_id, game_type, bet_amount, outcome, win_amount, timestamp, nonce "
+                "FROM game_history WHERE user_id = ? AND timestamp < ? ORDER BY seq DESC",
+                (user_id, before)
+            ).fetchall()
+        for row in rows:
+            yield history_from_row(row)
+        
+        if self.archive:
+            for row in self.archive.iter_user_rows(user_id, before):
+                yield history_from_row(row)
+    
+    def balance_at(self, user_id: str, timestamp: float) -> Optional[int]:
+        """Восстановить баланс пользователя на указанный момент
+        
+        Берется последний снимок пользователя не позже timestamp, и к нему
+        прибавляются только записи журнала этого пользователя после снимка.
+        """
+        with self.db_lock:
+            snapshot = self.conn.execute(
+                "SELECT b.ledger_seq, b.balance FROM snapshot_balances b "
+                "JOIN ledger_snapshots s ON s.ledger_seq = b.ledger_seq "
+                "WHERE b.user_id = ? AND s.timestamp <= ? ORDER BY b.ledger_seq DESC LIMIT 1",
+                (user_id, timestamp)
+            ).fetchone()
+            ledger_seq, balance = snapshot or (0, 0)
+            delta, entries = self.conn.execute(
+                "SELECT COALESCE(SUM(delta), 0), COUNT(*) FROM ledger "
+                "WHERE user_id = ? AND seq > ? AND timestamp <= ?",
+                (user_id, ledger_seq, timestamp)
+            ).fetchone()
+        
+        if snapshot is None and entries == 0:
+            return None
+        return balance + delta
+    
+    def load_sessions(self) -> List[tuple]:
+        """Загрузить сохраненные игровые сессии блэкджека"""
+        with self.db_lock:
+            return self.conn.execute(
+                "SELECT user_id, bet_amount, shoe, shoe_position, player, dealer, flags, channel_id, message_id, expires_at "
+                "FROM blackjack_sessions"
+            ).fetchall()
+    
+    def save_session(self, user_id: str, row: Optional[tuple]):
+        """Поставить сессию в очередь на сохранение (None - удалить)"""
+        with self.pending_lock:
+            self.pending_sessions[user_id] = row
+    
+    def load_roulette_bets(self) -> List[tuple]:
+        """Загрузить ставки открытых столов рулетки: строки (канал, время вращения, user_id, сумма)"""
+        with self.db_lock:
+            return self.conn.execute("SELECT channel_id, spin_at, user_id, amount FROM roulette_bets").fetchall()
+    
+    def save_roulette_bet(self, row: tuple):
+        """Поставить ставку стола рулетки в очередь на сохранение"""
+        with self.pending_lock:
+            self.pending_roulette.append((row, None))
+    
+    def delete_roulette_bets(self, channel_id: int, spin_at: float):
+        """Поставить в очередь удаление ставок рассчитанного стола"""
+        with self.pending_lock:
+            self.pending_roulette.append((None, (channel_id, spin_at)))
+    
+    def load_setting(self, key: str) -> Optional[str]:
+        """Прочитать служебную настройку"""
+        with self.db_lock:
+            row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def save_setting(self, key: str, value: str):
+        """Сохранить служебную настройку сразу, вне группового коммита"""
+        with self.db_lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+    
+    def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        with self.pending_lock:
+            if not (self.pending_users or self.pending_games or self.pending_members or self.pending_sessions
+                    or self.pending_roulette):
+                return
+            roulette, self.pending_roulette = self.pending_roulette, []
+            ledger, self.pending_ledger = self.pending_ledger, []
+            sessions, self.pending_sessions = self.pending_sessions, {}
+            users, self.pending_users = self.pending_users, {}
+            games, self.pending_games = self.pending_games, []
+            stats, self.pending_stats = self.pending_stats, {}
+            members, self.pending_members = self.pending_members, {}
+        
+        with self.db_lock:
+            started = time.perf_counter()
+            try:
+                self._write_batch(users, games, stats, members, ledger, sessions, roulette)
+            except BaseException:
+                # Транзакция откачена: возвращаем пачку в очереди, следующий flush повторит ее
+                self._requeue(users, games, stats, members, ledger, sessions, roulette)
+                raise
+            self.history_rows += len(games)
+            
+            # Делаем снимок балансов, если журнал достаточно вырос
+            if ledger:
+                self.ledger_seq = self.conn.execute("SELECT MAX(seq) FROM ledger").fetchone()[0]
+                self.snapshot_dirty.update(entry[0] for entry in ledger)
+                if self.ledger_seq - self.snapshot_seq >= LEDGER_SNAPSHOT_EVERY:
+                    self._snapshot_balances(self.snapshot_dirty)
+            
+            # Переносим вышедшие из горячего окна игры в архив
+            if self.archive and self.history_rows > self.hot_size + HISTORY_ROLL_BATCH:
+                self._roll_history()
+            self.last_flush_seconds = time.perf_counter() - started
+    
+    def _write_batch(self, users: dict, games: list, stats: dict, members: dict,
+                     ledger: list, sessions: dict, roulette: list):
+        """Записать пачку изменений одной транзакцией (при ошибке она откатывается целиком)"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, id, username, discriminator, balance, "
+                "is_admin, last_daily, games_played, games_won) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                users.values()
+            )
+            self.conn.executemany(
+                "INSERT INTO game_history (id, user_id, game_type, bet_amount, outcome, "
+                "win_amount, timestamp, nonce) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                games
+            )
+            self.conn.executemany(
+                "INSERT INTO game_stats (day, game_type, games, wagered, paid_out) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, game_type) DO UPDATE SET games = games + excluded.games, "
+                "wagered = wagered + excluded.wagered, paid_out = paid_out + excluded.paid_out",
+                [(day, game_type, *values) for (day, game_type), values in stats.items()]
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO guild_members (guild_id, user_id) VALUES (?, ?)",
+                [key for key, is_member in members.items() if is_member]
+            )
+            self.conn.executemany(
+                "DELETE FROM guild_members WHERE guild_id = ? AND user_id = ?",
+                [key for key, is_member in members.items() if not is_member]
+            )
+            self.conn.executemany(
+                "INSERT INTO ledger (user_id, entry_type, delta, timestamp) VALUES (?, ?, ?, ?)",
+                ledger
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO blackjack_sessions (user_id, bet_amount, shoe, shoe_position, player, "
+                "dealer, flags, channel_id, message_id, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in sessions.values() if row is not None]
+            )
+            self.conn.executemany(
+                "DELETE FROM blackjack_sessions WHERE user_id = ?",
+                [(user_id,) for user_id, row in sessions.items() if row is None]
+            )
+            # Ставки и удаления столов применяются в порядке поступления
+            for row, table in roulette:
+                if row is not None:
+                    self.conn.execute(
+                        "INSERT INTO roulette_bets (channel_id, spin_at, user_id, amount) VALUES (?, ?, ?, ?)", row
+                    )
+                else:
+                    self.conn.execute("DELETE FROM roulette_bets WHERE channel_id = ? AND spin_at = ?", table)
+    
+    def _requeue(self, users: dict, games: list, stats: dict, members: dict,
+                 ledger: list, sessions: dict, roulette: list):
+        """Вернуть незаписанную пачку в начало очередей
+        
+        Изменения, поставленные в очередь во время неудачного коммита,
+        новее пачки: они идут после нее и перекрывают ее значения.
+        """
+        with self.pending_lock:
+            self.pending_users = {**users, **self.pending_users}
+            self.pending_games = games + self.pending_games
+            for key, values in self.pending_stats.items():
+                if key in stats:
+                    stats[key] = [old + new for old, new in zip(stats[key], values)]
+                else:
+                    stats[key] = values
+            self.pending_stats = stats
+            self.pending_members = {**members, **self.pending_members}
+            self.pending_ledger = ledger + self.pending_ledger
+            self.pending_sessions = {**sessions, **self.pending_sessions}
+            self.pending_roulette = roulette + self.pending_roulette
+    
+    def _snapshot_balances(self, user_ids: Optional[set]):
+        """Сохранить снимок балансов пользователей (None - всех) на текущую позицию журнала"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO ledger_snapshots (ledger_seq, timestamp) VALUES (?, ?)",
+                (self.ledger_seq, time.time())
+            )
+            if user_ids is None:
+                self.conn.execute(
+                    "INSERT INTO snapshot_balances (user_id, ledger_seq, balance) "
+                    "SELECT user_id, ?, balance FROM users", (self.ledger_seq,)
+                )
+            else:
+                self.conn.executemany(
+                    "INSERT INTO snapshot_balances (user_id, ledger_seq, balance) "
+                    "SELECT user_id, ?, balance FROM users WHERE user_id = ?",
+                    [(self.ledger_seq, user_id) for user_id in user_ids]
+                )
+        self.snapshot_seq = self.ledger_seq
+        self.snapshot_dirty = set()
+    
+    def _roll_history(self):
+        """Перенести самые старые игры из базы в сегменты архива"""
+        rows = self.conn.execute(
+            "SELECT seq, id, user_id, game_type, bet_amount, outcome, win_amount, timestamp, nonce "
+            "FROM game_history ORDER BY seq LIMIT ?", (self.history_rows - self.hot_size,)
+        ).fetchall()
+        if not rows:
+            return
+        
+        # Сначала пишем архив, затем удаляем из базы: при сбое запись
+        # может продублироваться, но не потеряться
+        self.archive.append([row[1:] for row in rows])
+        with self.conn:
+            self.conn.execute("DELETE FROM game_history WHERE seq <= ?", (rows[-1][0],))
+        self.history_rows -= len(rows)
+    
+    def close(self):
+        """Закрыть базу, записав все изменения"""
+        self.flush()
+        with self.db_lock:
+            self.conn.close()
 
 class Storage:
-    """Класс хранения данных в памяти"""
-    def __init__(self):
+    """Класс хранения данных в памяти с подключаемым бэкендом сохранения"""
+    def __init__(self, backend: Optional[StorageBackend] = None):
+        self.backend = backend or StorageBackend()
         self.users = {}                       # Словарь пользователей: {user_id: User}
-        self.game_history = []                # Список истории игр
+        self.hot_order = deque()              # Порядок вытеснения горячего окна: user_id по времени игр
+        self.user_history = {}                # Горячее окно по пользователям: {user_id: deque(GameHistory)}
+        self.balance_index = SortedList()     # Рейтинг по балансу: (-balance, user_id)
+        self.guild_members = {}               # Участники серверов: {guild_id: set(user_id)}
+        self.user_guilds = {}                 # Серверы пользователя: {user_id: set(guild_id)}
+        self.guild_balance_index = {}         # Рейтинг по серверам: {guild_id: SortedList}
+        
+        # Текущие агрегаты для статистики
+        self.total_coins = 0                  # Всего монет у пользователей
+        self.games_by_day = {}                # Игр по дням: {date: количество}
+        self.wagered = {game_type: 0 for game_type in GameType}   # Поставлено по играм
+        self.paid_out = {game_type: 0 for game_type in GameType}  # Выплачено по играм (со ставками)
+        
+        # Восстанавливаем состояние из бэкенда
+        users, history = self.backend.load()
+        for user in users:
+            self.users[user.user_id] = user
+            self.total_coins += user.balance
+        self.balance_index.update((-user.balance, user.user_id) for user in users)
+        for day, game_type, games, wagered, paid_out in self.backend.load_stats():
+            self.games_by_day[day] = self.games_by_day.get(day, 0) + games
+            self.wagered[game_type] += wagered
+            self.paid_out[game_type] += paid_out
+        for guild_id, user_id in self.backend.load_guild_members():
+            self._add_membership(guild_id, user_id)
+        for record in history:
+            self._index_game(record)
     
     # Методы для работы с пользователями
     def get_user(self, user_id: str) -> Optional[User]:
@@ -105,27 +998,144 @@ class Storage:
         """Создать нового пользователя"""
         user = User(user_id, username, discriminator, balance, is_admin)
         self.users[user_id] = user
+        self.balance_index.add((-balance, user_id))
+        for guild_id in self.user_guilds.get(user_id, ()):
+            self.guild_balance_index[guild_id].add((-balance, user_id))
+        self.total_coins += balance
+        self.backend.save_ledger_entry(user, LedgerEntryType.ACCOUNT_OPEN, balance)
         return user
     
-    def update_user_balance(self, user_id: str, new_balance: int) -> Optional[User]:
+    def _set_balance(self, user: User, new_balance: int, entry_type: LedgerEntryType):
+        """Изменить баланс пользователя, поддерживая индекс рейтинга и журнал"""
+        delta = new_balance - user.balance
+        self.balance_index.remove((-user.balance, user.user_id))
+        for guild_id in self.user_guilds.get(user.user_id, ()):
+            guild_index = self.guild_balance_index[guild_id]
+            guild_index.remove((-user.balance, user.user_id))
+            guild_index.add((-new_balance, user.user_id))
+        self.total_coins += delta
+        user.balance = new_balance
+        self.balance_index.add((-new_balance, user.user_id))
+        self.backend.save_ledger_entry(user, entry_type, delta)
+    
+    def update_user_balance(self, user_id: str, new_balance: int,
+                            entry_type: LedgerEntryType = LedgerEntryType.ADMIN_RESET) -> Optional[User]:
         """Обновить баланс пользователя"""
         user = self.get_user(user_id)
         if user:
-            user.balance = new_balance
+            self._set_balance(user, new_balance, entry_type)
+            return user
+        return None
+    
+    def debit_user_balance(self, user_id: str, amount: int,
+                           entry_type: LedgerEntryType = LedgerEntryType.BET) -> Optional[User]:
+        """Атомарно списать сумму, если на балансе достаточно средств
+        
+        Проверка и списание выполняются без await между ними, поэтому
+        параллельные команды одного пользователя не могут уйти в минус.
+        """
+        user = self.get_user(user_id)
+        if user and user.balance >= amount:
+            self._set_balance(user, user.balance - amount, entry_type)
+            return user
+        return None
+    
+    def credit_user_balance(self, user_id: str, amount: int,
+                            entry_type: LedgerEntryType = LedgerEntryType.PAYOUT) -> Optional[User]:
+        """Атомарно зачислить сумму на баланс"""
+        user = self.get_user(user_id)
+        if user:
+            self._set_balance(user, user.balance + amount, entry_type)
+            return user
+        return None
+    
+    def set_user_last_daily(self, user_id: str, when: datetime.datetime) -> Optional[User]:
+        """Установить время получения ежедневного бонуса"""
+        user = self.get_user(user_id)
+        if user:
+            user.last_daily = when
+            self.backend.save_user(user)
             return user
         return None
     
     def get_users_by_balance_desc(self, limit: int = 10) -> List[User]:
         """Получить пользователей по убыванию баланса"""
-        sorted_users = sorted(self.users.values(), key=lambda u: u.balance, reverse=True)
-        return sorted_users[:limit]
+        return [self.users[user_id] for _, user_id in self.balance_index.islice(0, limit)]
+    
+    def get_guild_users_by_balance_desc(self, guild_id: str, limit: int = 10) -> List[User]:
+        """Получить участников сервера по убыванию баланса"""
+        guild_index = self.guild_balance_index.get(guild_id)
+        if not guild_index:
+            return []
+        return [self.users[user_id] for _, user_id in guild_index.islice(0, limit)]
+    
+    def get_user_rank(self, user_id: str) -> Optional[int]:
+        """Получить место пользователя в рейтинге по балансу (с 1)"""
+        user = self.get_user(user_id)
+        if not user:
+            return None
+        return self.balance_index.bisect_left((-user.balance, user_id)) + 1
+    
+    # Методы для работы с серверами
+    def _add_membership(self, guild_id: str, user_id: str) -> bool:
+        """Добавить членство в индексы, вернуть False если оно уже было"""
+        members = self.guild_members.get(guild_id)
+        if members is None:
+            members = self.guild_members[guild_id] = set()
+            self.guild_balance_index[guild_id] = SortedList()
+        if user_id in members:
+            return False
+        
+        members.add(user_id)
+        self.user_guilds.setdefault(user_id, set()).add(guild_id)
+        user = self.get_user(user_id)
+        if user:
+            self.guild_balance_index[guild_id].add((-user.balance, user_id))
+        return True
+    
+    def add_guild_member(self, guild_id: str, user_id: str):
+        """Отметить пользователя участником сервера"""
+        if self._add_membership(guild_id, user_id):
+            self.backend.save_guild_member(guild_id, user_id, True)
+    
+    def remove_guild_member(self, guild_id: str, user_id: str):
+        """Убрать пользователя из участников сервера"""
+        members = self.guild_members.get(guild_id)
+        if not members or user_id not in members:
+            return
+        
+        members.discard(user_id)
+        self.user_guilds[user_id].discard(guild_id)
+        user = self.get_user(user_id)
+        if user:
+            self.guild_balance_index[guild_id].discard((-user.balance, user_id))
+        self.backend.save_guild_member(guild_id, user_id, False)
+    
+    def remove_guild(self, guild_id: str):
+        """Забыть всех участников сервера (бот покинул сервер)"""
+        for user_id in list(self.guild_members.get(guild_id, ())):
+            self.remove_guild_member(guild_id, user_id)
+        self.guild_members.pop(guild_id, None)
+        self.guild_balance_index.pop(guild_id, None)
     
     # Методы для работы с историей игр
     def add_game_history(self, user_id: str, game_type: GameType, bet_amount: int,
-                         outcome: GameOutcome, win_amount: int = 0) -> GameHistory:
-        """Добавить запись в историю игр"""
-        history = GameHistory(user_id, game_type, bet_amount, outcome, win_amount)
-        self.game_history.append(history)
+                         outcome: GameOutcome, payout: int = 0, nonce: Optional[str] = None) -> GameHistory:
+        """Добавить запись в историю игр
+        
+        payout - вся сумма, зачисленная игроку (с возвращенной ставкой); в историю
+        пишется чистый выигрыш, в статистику игр - полная выплата.
+        nonce - позиция игры в потоке честного режима.
+        """
+        history = GameHistory(user_id, game_type, bet_amount, outcome, max(payout - bet_amount, 0), nonce)
+        self._index_game(history)
+        self.backend.save_game(history, payout)
+        
+        # Обновление агрегатов
+        day = datetime.date.fromtimestamp(history.ts)
+        self.games_by_day[day] = self.games_by_day.get(day, 0) + 1
+        self.wagered[game_type] += bet_amount
+        self.paid_out[game_type] += payout
         
         # Обновление статистики пользователя
         user = self.get_user(user_id)
@@ -135,20 +1145,105 @@ class Storage:
                          GameOutcome.SMALL_WIN, GameOutcome.MEDIUM_WIN, 
                          GameOutcome.BIG_WIN, GameOutcome.JACKPOT]:
                 user.games_won += 1
+            self.backend.save_user(user)
         
         return history
     
-    def get_game_history_by_user_id(self, user_id: str, limit: int = 10) -> List[GameHistory]:
-        """Получить историю игр пользователя"""
-        user_history = [h for h in self.game_history if h.user_id == user_id]
-        return sorted(user_history, key=lambda h: h.timestamp, reverse=True)[:limit]
+    def _index_game(self, history: GameHistory):
+        """Добавить запись в горячее окно (в порядке времени)
+        
+        Окно общее на всех пользователей: при переполнении вытесняется самая
+        старая игра, поэтому в памяти не больше HISTORY_HOT_SIZE записей.
+        """
+        user_history = self.user_history.get(history.user_id)
+        if user_history is None:
+            user_history = self.user_history[history.user_id] = deque()
+        user_history.append(history)
+        self.hot_order.append(history.user_id)
+        
+        if len(self.hot_order) > HISTORY_HOT_SIZE:
+            oldest_user_id = self.hot_order.popleft()
+            oldest = self.user_history[oldest_user_id]
+            oldest.popleft()
+            if not oldest:
+                del self.user_history[oldest_user_id]
+    
+    async def get_game_history_by_user_id(self, user_id: str, limit: int = 10) -> List[GameHistory]:
+        """Получить историю игр пользователя (новые первыми)"""
+        user_history = self.user_history.get(user_id, ())
+        user = self.get_user(user_id)
+        
+        # Быстрый путь: запрос укладывается в индекс или индекс содержит все игры
+        if len(user_history) >= limit or not user or len(user_history) >= user.games_played:
+            return list(islice(reversed(user_history), limit))
+        
+        # Чтение базы и распаковка архива идут в отдельном потоке, не блокируя бота
+        history = self.iter_game_history(user_id)
+        return await asyncio.to_thread(lambda: list(islice(history, limit)))
+    
+    def iter_game_history(self, user_id: str):
+        """Потоково выдать всю историю пользователя, от новых игр к старым
+        
+        Горячие записи копируются при вызове, поэтому итератор можно читать
+        из другого потока, пока бот дописывает новые игры.
+        """
+        user_history = list(self.user_history.get(user_id, ()))
+        
+        # Все, что старше горячего окна, читаем из бэкенда и архива
+        before = user_history[0].ts if user_history else math.inf
+        return chain(reversed(user_history), self.backend.iter_history(user_id, before))
+    
+    async def get_balance_at(self, user_id: str, when: datetime.datetime) -> Optional[int]:
+        """Восстановить баланс пользователя на указанный момент по журналу"""
+        def query():
+            # Сначала записываем ожидающие записи журнала, затем читаем его
+            self.backend.flush()
+            return self.backend.balance_at(user_id, when.timestamp())
+        
+        # Коммит с fsync и запрос к базе выполняются в отдельном потоке
+        return await asyncio.to_thread(query)
+    
+    # Служебные настройки
+    def get_setting(self, key: str) -> Optional[str]:
+        """Получить служебную настройку"""
+        return self.backend.load_setting(key)
+    
+    def set_setting(self, key: str, value: str):
+        """Сохранить служебную настройку"""
+        self.backend.save_setting(key, value)
+    
+    # Методы для работы с сессиями блэкджека
+    def load_blackjack_sessions(self) -> List["BlackjackGame"]:
+        """Загрузить незавершенные игры в блэкджек"""
+        return [BlackjackGame.from_row(row) for row in self.backend.load_sessions()]
+    
+    def save_blackjack_session(self, game: "BlackjackGame"):
+        """Сохранить состояние незавершенной игры"""
+        self.backend.save_session(game.user_id, game.to_row())
+    
+    def delete_blackjack_session(self, user_id: str):
+        """Удалить сохраненное состояние игры"""
+        self.backend.save_session(user_id, None)
+    
+    # Методы для работы со ставками столов рулетки
+    def load_roulette_bets(self) -> List[tuple]:
+        """Загрузить ставки столов, не рассчитанных до остановки бота"""
+        return self.backend.load_roulette_bets()
+    
+    def save_roulette_bet(self, channel_id: int, spin_at: float, user_id: str, amount: int):
+        """Сохранить принятую ставку стола (в одном коммите со списанием)"""
+        self.backend.save_roulette_bet((channel_id, spin_at, user_id, amount))
+    
+    def delete_roulette_bets(self, channel_id: int, spin_at: float):
+        """Удалить сохраненные ставки рассчитанного стола"""
+        self.backend.delete_roulette_bets(channel_id, spin_at)
     
     # Админские методы
     def reset_user_balance(self, user_id: str, amount: int = 10000) -> Optional[User]:
         """Сбросить баланс пользователя"""
         user = self.get_user(user_id)
         if user:
-            user.balance = amount
+            self._set_balance(user, amount, LedgerEntryType.ADMIN_RESET)
             return user
         return None
     
@@ -157,9 +1252,19 @@ class Storage:
         user = self.get_user(user_id)
         if user:
             user.is_admin = is_admin
+            self.backend.save_user(user)
             return user
         return None
     
+    # Сохранение
+    def flush(self):
+        """Записать накопленные изменения в бэкенд"""
+        self.backend.flush()
+    
+    def close(self):
+        """Закрыть бэкенд хранения"""
+        self.backend.close()
+    
     # Статистика
     def get_total_users(self) -> int:
         """Получить общее количество пользователей"""
@@ -167,16 +1272,34 @@ class Storage:
     
     def get_total_coins(self) -> int:
         """Получить общее количество монет"""
-        return sum(user.balance for user in self.users.values())
+        return self.total_coins
     
     def get_games_played_today(self) -> int:
         """Получить количество игр за сегодня"""
-        today = datetime.datetime.now().date()
-        return sum(1 for h in self.game_history 
-                 if h.timestamp.date() == today)
+        return self.games_by_day.get(datetime.datetime.now().date(), 0)
+    
+    def get_game_type_totals(self) -> Dict[GameType, Tuple[int, int]]:
+        """Получить суммы ставок и выплат по типам игр"""
+        return {game_type: (self.wagered[game_type], self.paid_out[game_type]) for game_type in GameType}
+
+# Глобальный экземпляр хранилища; создается при запуске бота, а не при импорте,
+# чтобы игровую логику можно было импортировать без файлов базы и архива
+storage: Optional[Storage] = None
 
-# Создаем глобальный экземпляр хранилища
-storage = Storage()
+def open_storage() -> Storage:
+    """Открыть хранилище бота (один раз за запуск)"""
+    global storage
+    if storage is None:
+        storage = Storage(SQLiteStorageBackend(DATABASE_PATH, HISTORY_ARCHIVE_DIR))
+    return storage
+
+@tasks.loop(seconds=STORAGE_FLUSH_INTERVAL)
+async def flush_storage():
+    """Периодический групповой коммит изменений хранилища"""
+    try:
+        await asyncio.to_thread(storage.flush)
+    except Exception as e:
+        print(f"Error flushing storage: {e}")
 
 #########################
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
@@ -207,16 +1330,153 @@ def create_embed(title: str = None, description: str = None, color: int = 0xFFD7
     
     return embed
 
-def get_random_int(min_val: int, max_val: int) -> int:
-    """Получить случайное целое число от min до max включительно"""
-    return random.randint(min_val, max_val)
+def fair_footer(footer: str, nonce: Optional[str]) -> str:
+    """Подпись результата игры с позицией в потоке честного режима"""
+    return f"{footer} | Поток: {nonce}" if nonce else footer
+
+class EmbedTemplate:
+    """Заранее собранный embed
+    
+    Статический шаблон создается один раз и отдается как есть. В динамическом
+    {поля} допускаются в заголовке, описании и подвале: render() копирует
+    готовый embed и подставляет только эти строки, не пересобирая поля.
+    """
+    def __init__(self, **kwargs):
+        self.embed = create_embed(**kwargs)
+        self.slots = [slot for slot in discord.Embed.__slots__ if hasattr(self.embed, slot)]
+        self.title = kwargs.get("title") if "{" in (kwargs.get("title") or "") else None
+        self.description = kwargs.get("description") if "{" in (kwargs.get("description") or "") else None
+        self.footer = kwargs.get("footer") if "{" in (kwargs.get("footer") or "") else None
+        self.dynamic = bool(self.title or self.description or self.footer)
+        if any("{" in str(field.get("name", "")) + str(field.get("value", "")) for field in kwargs.get("fields") or []):
+            raise ValueError("Embed template fields must be static")
+    
+    def render(self, **values) -> discord.Embed:
+        """Получить embed с подставленными значениями"""
+        if not self.dynamic:
+            return self.embed
+        
+        # Копируем готовый embed без повторной сборки
+        embed = discord.Embed.__new__(discord.Embed)
+        for slot in self.slots:
+            setattr(embed, slot, getattr(self.embed, slot))
+        
+        if self.title:
+            embed.title = self.title.format_map(values)
+        if self.description:
+            embed.description = self.description.format_map(values)
+        if self.footer:
+            embed.set_footer(text=self.footer.format_map(values))
+        return embed
+
+# Часто используемые ответы
+ACCESS_DENIED_EMBED = EmbedTemplate(
+    title="Доступ запрещен",
+    description="Для использования этой команды необходимы права администратора.",
+    color=0xED4245  # Красный
+)
+INSUFFICIENT_FUNDS_EMBED = EmbedTemplate(
+    title="Недостаточно средств",
+    description="У вас только **{balance}** монет, но вы ставите **{amount}** монет.",
+    color=0xED4245  # Красный
+)
+INSUFFICIENT_FUNDS_TRANSFER_EMBED = EmbedTemplate(
+    title="Недостаточно средств",
+    description="У вас только **{balance}** монет, но вы пытаетесь перевести **{amount}** монет.",
+    color=0xED4245,  # Красный
+    footer="PutinZov Casino | Перевод"
+)
+INSUFFICIENT_FUNDS_ACTION_EMBED = EmbedTemplate(
+    title="Недостаточно средств",
+    description="У вас только **{balance}** монет, а для этого хода нужно **{amount}** монет.",
+    color=0xED4245  # Красный
+)
+INSUFFICIENT_FUNDS_TAKE_EMBED = EmbedTemplate(
+    title="Недостаточно средств",
+    description="У **{name}** только **{balance}** монет, но вы пытаетесь забрать **{amount}** монет.",
+    color=0xED4245,  # Красный
+    footer="PutinZov Casino | Админ-команда"
+)
+
+def get_random_int(min_val: int, max_val: int, stream: str = "default") -> int:
+    """Получить случайное целое число от min до max включительно из потока stream"""
+    return rng.stream(stream).randint(min_val, max_val)
 
-def shuffle(array: List[Any]) -> List[Any]:
+def shuffle(array: List[Any], stream: str = "default") -> List[Any]:
     """Перемешать массив с использованием алгоритма Фишера-Йейтса"""
     result = array.copy()
-    random.shuffle(result)
+    rng.stream(stream).shuffle(result)
     return result
 
+class TimerWheel:
+    """Хешированное колесо таймеров
+    
+    Сроки раскладываются по слотам колеса, и один периодический вызов
+    advance() собирает истекшие ключи. Ожидающие таймеры не требуют
+    отдельной задачи или корутины каждый.
+    """
+    def __init__(self, tick: float = 1.0, size: int = 64):
+        self.tick = tick
+        self.slots = [set() for _ in range(size)]
+        self.deadlines = {}                   # Актуальные сроки: {ключ: (время, тик слота)}
+        self.current = int(time.time() // tick)
+    
+    def __len__(self) -> int:
+        return len(self.deadlines)
+    
+    def schedule(self, key, deadline: float):
+        """Запланировать (или перенести) срок для ключа
+        
+        Уже прошедший срок кладется в текущий слот, а не в пройденный:
+        иначе он сработал бы только через полный оборот колеса.
+        """
+        tick = max(int(deadline // self.tick), self.current)
+        self.deadlines[key] = (deadline, tick)
+        self.slots[tick % len(self.slots)].add(key)
+    
+    def cancel(self, key):
+        """Отменить таймер (устаревшая запись в слоте удалится при обходе)"""
+        self.deadlines.pop(key, None)
+    
+    def advance(self, now: float) -> list:
+        """Продвинуть колесо до момента now и вернуть истекшие ключи"""
+        expired = []
+        size = len(self.slots)
+        target = int(now // self.tick)
+        
+        for tick in range(max(self.current, target - size + 1), target + 1):
+            slot = self.slots[tick % size]
+            for key in list(slot):
+                deadline, deadline_tick = self.deadlines.get(key, (None, None))
+                if deadline is None or deadline_tick % size != tick % size:
+                    # Таймер отменен или перенесен в другой слот
+                    slot.discard(key)
+                elif deadline <= now:
+                    slot.discard(key)
+                    del self.deadlines[key]
+                    expired.append(key)
+        
+        self.current = target
+        return expired
+
+# Отложенные правки ответов: анимация без ожидания внутри обработчика команды
+scheduled_edits = {}                          # Ожидающие правки: {ключ: (interaction, embed)}
+scheduled_edit_timers = TimerWheel(tick=0.25)
+scheduled_edit_keys = count()
+
+def schedule_response_edit(interaction: discord.Interaction, embed: discord.Embed, delay: float):
+    """Заменить ответ на взаимодействие через delay секунд"""
+    key = next(scheduled_edit_keys)
+    scheduled_edits[key] = (interaction, embed)
+    scheduled_edit_timers.schedule(key, time.time() + delay)
+
+@tasks.loop(seconds=0.25)
+async def run_scheduled_edits():
+    """Выполнить правки ответов, срок которых наступил"""
+    for key in scheduled_edit_timers.advance(time.time()):
+        interaction, embed = scheduled_edits.pop(key)
+        queue_response_edit(interaction, embed=embed, view=None)
+
 def format_number(num: int) -> str:
     """Форматировать число с разделителями тысяч"""
     return "{:,}".format(num)
@@ -227,21 +1487,599 @@ def calculate_win_rate(wins: int, total: int) -> str:
         return "0%"
     return f"{(wins / total * 100):.1f}%"
 
+#########################
+# МЕТРИКИ КОМАНД
+#########################
+
+# Границы корзин гистограммы задержек (секунд): от 0.1 мс до ~50 с с шагом 25%
+LATENCY_BUCKETS = tuple(0.0001 * 1.25 ** i for i in range(60))
+
+# Окно (секунд) для подсчета частоты вызовов команд
+COMMAND_RATE_WINDOW = 60
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными логарифмическими корзинами"""
+    __slots__ = ("counts", "total")
+    
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0                      # Суммарное время (сек)
+    
+    def add(self, seconds: float):
+        """Учесть одно измерение"""
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+    
+    def percentile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q"""
+        rank = q * sum(self.counts)
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if bucket_count and seen >= rank:
+                return LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+        return 0.0
+
+class CommandStats:
+    """Счетчики и задержки одной команды"""
+    __slots__ = ("calls", "errors", "latency", "own", "api")
+    
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()     # Полное время обработки
+        self.own = LatencyHistogram()         # Время в нашем коде
+        self.api = LatencyHistogram()         # Время ожидания Discord API
+
+class CommandSample:
+    """Измерение текущего вызова команды"""
+    __slots__ = ("started", "api_seconds", "failed")
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.api_seconds = 0.0
+        self.failed = False
+
+# Сколько незавершенных измерений хранить, прежде чем удалять зависшие
+COMMAND_SAMPLE_LIMIT = 1024
+
+class CommandMetrics:
+    """Метрики вызовов команд приложения
+    
+    Измерение начинается в CasinoCommandTree.interaction_check и завершается
+    событием on_app_command_completion или обработчиком ошибок дерева. Ответы
+    через send_response()/edit_response() суммируются в измерение вызова,
+    поэтому время делится на свой код и ожидание Discord API.
+    """
+    def __init__(self):
+        self.commands = {}                    # {полное имя команды: CommandStats}
+        self.samples = {}                     # Незавершенные вызовы: {interaction.id: CommandSample}
+        self.started = time.time()
+        self.second_calls = [0] * COMMAND_RATE_WINDOW   # Вызовов за каждую секунду окна
+        self.second_marks = [0] * COMMAND_RATE_WINDOW   # Какой секунде принадлежит ячейка
+    
+    def start(self, interaction: discord.Interaction):
+        """Начать измерение вызова команды"""
+        if len(self.samples) >= COMMAND_SAMPLE_LIMIT:
+            # Вызовы, не завершившиеся за 15 минут (срок жизни взаимодействия), уже не завершатся
+            expired = time.perf_counter() - 900
+            self.samples = {key: sample for key, sample in self.samples.items() if sample.started > expired}
+        self.samples[interaction.id] = CommandSample()
+    
+    def finish(self, interaction: discord.Interaction, name: str, failed: bool = False):
+        """Завершить измерение вызова и сохранить его"""
+        sample = self.samples.pop(interaction.id, None)
+        if sample is None:
+            return
+        seconds = time.perf_counter() - sample.started
+        
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        stats.calls += 1
+        stats.errors += failed or sample.failed
+        stats.latency.add(seconds)
+        stats.own.add(max(seconds - sample.api_seconds, 0.0))
+        stats.api.add(sample.api_seconds)
+        
+        second = int(time.time())
+        slot = second % COMMAND_RATE_WINDOW
+        if self.second_marks[slot] != second:
+            self.second_marks[slot] = second
+            self.second_calls[slot] = 0
+        self.second_calls[slot] += 1
+    
+    def add_api_time(self, interaction: discord.Interaction, seconds: float):
+        """Учесть запрос к Discord, сделанный при обработке команды"""
+        sample = self.samples.get(interaction.id)
+        if sample is not None:
+            sample.api_seconds += seconds
+    
+    def record_error(self, interaction: discord.Interaction):
+        """Отметить вызов как завершившийся ошибкой (обработчик перехватил исключение сам)"""
+        sample = self.samples.get(interaction.id)
+        if sample is not None:
+            sample.failed = True
+    
+    def calls_per_second(self) -> float:
+        """Средняя частота вызовов за последние COMMAND_RATE_WINDOW секунд"""
+        oldest = int(time.time()) - COMMAND_RATE_WINDOW
+        return sum(calls for calls, mark in zip(self.second_calls, self.second_marks) if mark > oldest) / COMMAND_RATE_WINDOW
+    
+    def hot_commands(self, limit: int = 10) -> List[Tuple[str, CommandStats]]:
+        """Команды с наибольшим суммарным временем обработки"""
+        return sorted(self.commands.items(), key=lambda item: item[1].latency.total, reverse=True)[:limit]
+
+command_metrics = CommandMetrics()
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    """Команда выполнена: завершаем ее измерение"""
+    command_metrics.finish(interaction, command.qualified_name)
+
+async def send_response(interaction: discord.Interaction, **kwargs):
+    """Ответить на взаимодействие, учитывая время запроса в метриках команды"""
+    started = time.perf_counter()
+    try:
+        callback = await interaction.response.send_message(**kwargs)
+        remember_response_message(interaction, callback.message_id if callback else None)
+    finally:
+        command_metrics.add_api_time(interaction, time.perf_counter() - started)
+
+async def edit_response(interaction: discord.Interaction, **kwargs):
+    """Изменить сообщение с кнопками в ответ на нажатие, учитывая время запроса"""
+    started = time.perf_counter()
+    try:
+        await interaction.response.edit_message(**kwargs)
+    finally:
+        command_metrics.add_api_time(interaction, time.perf_counter() - started)
+
+async def fetch_response(interaction: discord.Interaction) -> discord.InteractionMessage:
+    """Получить отправленный ответ на взаимодействие, учитывая время запроса"""
+    started = time.perf_counter()
+    try:
+        return await interaction.original_response()
+    finally:
+        command_metrics.add_api_time(interaction, time.perf_counter() - started)
+
+def format_latency(histogram: LatencyHistogram) -> str:
+    """p50/p95/p99 в миллисекундах"""
+    return " / ".join(f"{histogram.percentile(q) * 1000:.1f}" for q in (0.5, 0.95, 0.99))
+
+#########################
+# ОЧЕРЕДЬ ИСХОДЯЩИХ СООБЩЕНИЙ
+#########################
+
+# Приоритеты отправки (меньше - раньше)
+PRIORITY_RESPONSE = 0                         # Правки и дополнения ответов на взаимодействия
+PRIORITY_MESSAGE = 1                          # Правки обычных сообщений бота
+PRIORITY_ANNOUNCEMENT = 2                     # Объявления в каналах
+
+# Корзины токенов: маршрут Discord (канал или токен взаимодействия) и общий лимит бота
+ROUTE_BUCKET_CAPACITY = 5                     # Запросов подряд на один маршрут
+ROUTE_BUCKET_RATE = 1.0                       # Восполнение токенов маршрута в секунду
+GLOBAL_BUCKET_CAPACITY = 50                   # Запросов подряд на всего бота
+GLOBAL_BUCKET_RATE = 50.0                     # Восполнение общих токенов в секунду
+ROUTE_BUCKET_LIMIT = 1024                     # Сколько корзин маршрутов хранить до очистки
+
+class TokenBucket:
+    """Корзина токенов для ограничения частоты запросов"""
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+    
+    def __init__(self, capacity: int, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+    
+    def refill(self, now: float):
+        """Начислить токены за прошедшее время"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд появится токен (0 - уже есть)"""
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class OutboundMessage:
+    """Запрос к Discord, ожидающий отправки"""
+    __slots__ = ("priority", "seq", "route", "key", "send", "future", "enqueued")
+    
+    def __init__(self, priority: int, seq: int, route: str, key, send, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.route = route
+        self.key = key                        # Ключ объединения правок (None - не объединять)
+        self.send = send                      # Функция без аргументов, возвращающая корутину запроса
+        self.future = future
+        self.enqueued = time.monotonic()
+    
+    def __lt__(self, other: "OutboundMessage") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class OutboundQueue:
+    """Очередь исходящих запросов к Discord
+    
+    Запросы отправляются по приоритету, если на их маршруте и в общем лимите
+    есть токены, иначе ждут, не занимая обработчик команды. Новая правка
+    сообщения заменяет еще не отправленную правку того же сообщения, поэтому
+    уходит только последнее состояние. Первичные ответы на взаимодействия
+    отправляются обработчиками напрямую: их нужно дать в течение 3 секунд.
+    """
+    def __init__(self):
+        self.heap = []                        # Ожидающие запросы (куча по приоритету)
+        self.pending = {}                     # Ожидающие правки: {ключ: OutboundMessage}
+        self.buckets = {}                     # Корзины маршрутов: {маршрут: TokenBucket}
+        self.global_bucket = TokenBucket(GLOBAL_BUCKET_CAPACITY, GLOBAL_BUCKET_RATE)
+        self.seq = count()
+        self.wake = asyncio.Event()
+        self.task = None
+        self.deliveries = set()               # Задачи отправки в полете (ссылки держатся до завершения)
+        self.in_flight = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.send_latency = LatencyHistogram()  # От постановки в очередь до ответа Discord
+    
+    def __len__(self) -> int:
+        return len(self.heap)
+    
+    def start(self):
+        """Запустить отправку в текущем цикле событий"""
+        self.task = asyncio.create_task(self.run())
+    
+    def submit(self, route: str, send, priority: int = PRIORITY_RESPONSE, key=None) -> asyncio.Future:
+        """Поставить запрос в очередь и вернуть future с его результатом"""
+        queued = self.pending.get(key) if key is not None else None
+        if queued is not None:
+            # Заменяем неотправленную правку того же сообщения
+            queued.send = send
+            self.coalesced += 1
+            return queued.future
+        
+        message = OutboundMessage(priority, next(self.seq), route, key, send,
+                                  asyncio.get_running_loop().create_future())
+        heapq.heappush(self.heap, message)
+        if key is not None:
+            self.pending[key] = message
+        self.wake.set()
+        return message.future
+    
+    def dispatch_ready(self, now: float) -> Optional[float]:
+        """Отправить запросы, для которых есть токены; вернуть время до следующей попытки"""
+        deferred = []
+        delay = None
+        while self.heap:
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait:
+                delay = global_wait
+                break
+            
+            message = heapq.heappop(self.heap)
+            bucket = self.buckets.get(message.route)
+            if bucket is None:
+                bucket = self.buckets[message.route] = TokenBucket(ROUTE_BUCKET_CAPACITY, ROUTE_BUCKET_RATE)
+            route_wait = bucket.wait_time(now)
+            if route_wait:
+                # Маршрут исчерпан: запрос ждет, остальные маршруты продолжают отправку
+                deferred.append(message)
+                delay = route_wait if delay is None else min(delay, route_wait)
+                continue
+            
+            bucket.tokens -= 1
+            self.global_bucket.tokens -= 1
+            if message.key is not None:
+                del self.pending[message.key]
+            self.in_flight += 1
+            task = asyncio.create_task(self.deliver(message))
+            self.deliveries.add(task)
+            task.add_done_callback(self.deliveries.discard)
+        
+        for message in deferred:
+            heapq.heappush(self.heap, message)
+        
+        # Забываем восполненные корзины, чтобы не копить маршруты старых взаимодействий
+        if len(self.buckets) > ROUTE_BUCKET_LIMIT:
+            for route, bucket in list(self.buckets.items()):
+                bucket.refill(now)
+                if bucket.tokens >= bucket.capacity:
+                    del self.buckets[route]
+        return delay
+    
+    async def deliver(self, message: OutboundMessage):
+        """Выполнить запрос и передать результат ожидающим"""
+        try:
+            result = await message.send()
+            self.sent += 1
+        except Exception as e:
+            # Любая ошибка (HTTP, сеть, таймаут) не должна терять остальные запросы
+            print(f"Error sending queued request: {e}")
+            self.errors += 1
+            result = None
+        finally:
+            self.in_flight -= 1
+            self.send_latency.add(time.monotonic() - message.enqueued)
+        if not message.future.done():
+            message.future.set_result(result)
+    
+    async def run(self):
+        """Цикл отправки: ждет новых запросов или освобождения токенов"""
+        while True:
+            try:
+                delay = self.dispatch_ready(time.monotonic())
+            except Exception as e:
+                print(f"Error dispatching queued requests: {e}")
+                delay = 1.0
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+outbound = OutboundQueue()
+
+# ID сообщений, отправленных ответом на команду: {interaction.id: message_id}
+response_message_ids = {}
+RESPONSE_MESSAGE_IDS_LIMIT = 4096
+
+def remember_response_message(interaction: discord.Interaction, message_id: Optional[int]):
+    """Запомнить, каким сообщением ответили на взаимодействие"""
+    if message_id is None:
+        return
+    response_message_ids[interaction.id] = message_id
+    if len(response_message_ids) > RESPONSE_MESSAGE_IDS_LIMIT:
+        del response_message_ids[next(iter(response_message_ids))]
+
+def message_edit_key(message_id: int):
+    """Ключ объединения правок сообщения (один для всех путей правки)"""
+    return ("message", message_id)
+
+def interaction_edit_key(interaction: discord.Interaction):
+    """Ключ объединения правок ответа на взаимодействие"""
+    message_id = interaction.message.id if interaction.message else response_message_ids.get(interaction.id)
+    return message_edit_key(message_id) if message_id else ("interaction", interaction.id)
+
+def queue_response_edit(interaction: discord.Interaction, **kwargs) -> asyncio.Future:
+    """Изменить ответ на взаимодействие через очередь"""
+    return outbound.submit(f"interaction:{interaction.id}",
+                           lambda: interaction.edit_original_response(**kwargs),
+                           PRIORITY_RESPONSE, interaction_edit_key(interaction))
+
+def queue_followup(interaction: discord.Interaction, **kwargs) -> asyncio.Future:
+    """Отправить дополнительное сообщение к взаимодействию через очередь"""
+    return outbound.submit(f"interaction:{interaction.id}",
+                           lambda: interaction.followup.send(**kwargs),
+                           PRIORITY_RESPONSE)
+
+def queue_message_edit(channel_id: int, message_id: int, **kwargs) -> asyncio.Future:
+    """Изменить сообщение бота через очередь"""
+    message = bot.get_partial_messageable(channel_id).get_partial_message(message_id)
+    return outbound.submit(f"channel:{channel_id}", lambda: message.edit(**kwargs),
+                           PRIORITY_MESSAGE, message_edit_key(message_id))
+
+def queue_channel_message(channel_id: int, **kwargs) -> asyncio.Future:
+    """Отправить сообщение в канал через очередь"""
+    return outbound.submit(f"channel:{channel_id}",
+                           lambda: bot.get_partial_messageable(channel_id).send(**kwargs),
+                           PRIORITY_ANNOUNCEMENT)
+
+#########################
+# HTTP-СЕРВЕР МОНИТОРИНГА
+#########################
+
+# Задержка цикла событий, выше которой бот считается нездоровым (сек)
+HEALTH_MAX_LOOP_LAG = 1.0
+loop_lag_seconds = 0.0                        # Последняя измеренная задержка цикла событий
+
+@tasks.loop(seconds=1)
+async def measure_loop_lag():
+    """Измерить, сколько ждет готовая к запуску задача в цикле событий"""
+    global loop_lag_seconds
+    started = time.perf_counter()
+    await asyncio.sleep(0)
+    loop_lag_seconds = time.perf_counter() - started
+
+async def healthz(request: web.Request) -> web.Response:
+    """Проверка здоровья: подключение к шлюзу Discord и задержка цикла событий"""
+    connected = bot.is_ready() and not bot.is_closed()
+    healthy = connected and loop_lag_seconds < HEALTH_MAX_LOOP_LAG
+    return web.json_response({
+        "status": "ok" if healthy else "unhealthy",
+        "gateway_connected": connected,
+        "gateway_latency": bot.latency if math.isfinite(bot.latency) else None,
+        "loop_lag": loop_lag_seconds
+    }, status=200 if healthy else 503)
+
+def prometheus_metric(lines: List[str], name: str, metric_type: str, description: str, samples):
+    """Добавить метрику в текстовом формате Prometheus: samples - пары (метки, значение)"""
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} {metric_type}")
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+async def metrics(request: web.Request) -> web.Response:
+    """Метрики бота в текстовом формате Prometheus"""
+    commands = sorted(command_metrics.commands.items())
+    lines = []
+    prometheus_metric(lines, "casino_commands_per_second", "gauge",
+                      f"Command calls per second over the last {COMMAND_RATE_WINDOW} seconds",
+                      [({}, command_metrics.calls_per_second())])
+    prometheus_metric(lines, "casino_commands_total", "counter", "Command calls",
+                      [({"command": name}, stats.calls) for name, stats in commands])
+    prometheus_metric(lines, "casino_command_errors_total", "counter", "Command calls that failed",
+                      [({"command": name}, stats.errors) for name, stats in commands])
+    prometheus_metric(lines, "casino_command_duration_seconds", "summary", "Command handling time",
+                      [({"command": name, "quantile": str(q)}, stats.latency.percentile(q))
+                       for name, stats in commands for q in (0.5, 0.95, 0.99)])
+    for name, stats in commands:
+        lines.append(f'casino_command_duration_seconds_sum{{command="{name}"}} {stats.latency.total}')
+        lines.append(f'casino_command_duration_seconds_count{{command="{name}"}} {stats.calls}')
+    prometheus_metric(lines, "casino_outbound_queue_depth", "gauge", "Discord requests waiting in the outbound queue",
+                      [({}, len(outbound))])
+    prometheus_metric(lines, "casino_outbound_in_flight", "gauge", "Discord requests being sent",
+                      [({}, outbound.in_flight)])
+    prometheus_metric(lines, "casino_outbound_sent_total", "counter", "Queued Discord requests sent",
+                      [({}, outbound.sent)])
+    prometheus_metric(lines, "casino_outbound_coalesced_total", "counter", "Queued edits replaced by a newer edit",
+                      [({}, outbound.coalesced)])
+    prometheus_metric(lines, "casino_outbound_errors_total", "counter", "Queued Discord requests that failed",
+                      [({}, outbound.errors)])
+    prometheus_metric(lines, "casino_outbound_send_seconds", "summary", "Time from queueing to Discord response",
+                      [({"quantile": str(q)}, outbound.send_latency.percentile(q)) for q in (0.5, 0.95, 0.99)])
+    lines.append(f"casino_outbound_send_seconds_sum {outbound.send_latency.total}")
+    lines.append(f"casino_outbound_send_seconds_count {sum(outbound.send_latency.counts)}")
+    prometheus_metric(lines, "casino_active_blackjack_tables", "gauge", "Blackjack games in progress",
+                      [({}, len(active_blackjack_games))])
+    prometheus_metric(lines, "casino_active_roulette_tables", "gauge", "Open shared roulette tables",
+                      [({}, len(roulette_tables))])
+    prometheus_metric(lines, "casino_users", "gauge", "Registered users",
+                      [({}, storage.get_total_users())])
+    prometheus_metric(lines, "casino_coin_supply", "gauge", "Total coins on user balances",
+                      [({}, storage.get_total_coins())])
+    prometheus_metric(lines, "casino_storage_flush_seconds", "gauge", "Duration of the last storage commit",
+                      [({}, storage.backend.last_flush_seconds)])
+    prometheus_metric(lines, "casino_event_loop_lag_seconds", "gauge", "Event loop scheduling delay",
+                      [({}, loop_lag_seconds)])
+    prometheus_metric(lines, "casino_startup_seconds", "gauge", "Time from process start to the first on_ready",
+                      [({}, startup_seconds if startup_seconds is not None else "NaN")])
+    prometheus_metric(lines, "casino_gateway_latency_seconds", "gauge", "Discord gateway heartbeat latency",
+                      [({}, bot.latency if math.isfinite(bot.latency) else "NaN")])
+    return web.Response(text="\n".join(lines) + "\n",
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def start_http_server():
+    """Запустить HTTP-сервер мониторинга в цикле событий бота"""
+    if not HTTP_PORT:
+        return
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, port=HTTP_PORT).start()
+    print(f"Monitoring server listening on port {HTTP_PORT}")
+
 #########################
 # СЛУЖЕБНЫЕ ОБРАБОТЧИКИ
 #########################
 
+@bot.event
+async def setup_hook():
+    """Вызывается один раз перед подключением к Discord"""
+    # Открываем хранилище и запускаем его периодическую запись
+    open_storage()
+    flush_storage.start()
+    
+    # Раскрываем сиды честного режима прошлого запуска до первых игр
+    restore_fair_seeds()
+    
+    # Восстанавливаем незавершенные игры в блэкджек
+    restore_blackjack_sessions()
+    reap_blackjack_sessions.start()
+    
+    # Запускаем отложенные правки ответов (анимации игр)
+    run_scheduled_edits.start()
+    
+    # Возвращаем ставки столов, прерванных аварийной остановкой, и запускаем вращение
+    refund_saved_roulette_bets()
+    spin_roulette_tables.start()
+    
+    # Запускаем очередь исходящих сообщений
+    outbound.start()
+    
+    # Запускаем /healthz и /metrics
+    measure_loop_lag.start()
+    try:
+        await start_http_server()
+    except OSError as e:
+        print(f"Error starting monitoring server: {e}")
+
+def command_tree_hash(guild: Optional[discord.Object] = None) -> str:
+    """Стабильный хеш описания всех команд и места их регистрации"""
+    payload = {
+        "guild": guild.id if guild else None,
+        "commands": [command.to_dict(bot.tree) for command in sorted(bot.tree.get_commands(), key=lambda command: command.name)]
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+async def sync_command_tree():
+    """Синхронизировать команды с Discord, только если их описание изменилось
+    
+    С COMMAND_SYNC_GUILD команды регистрируются только на этом сервере, а
+    глобальные команды удаляются, чтобы на сервере не было дублей.
+    """
+    guild = discord.Object(id=int(COMMAND_SYNC_GUILD)) if COMMAND_SYNC_GUILD else None
+    setting = f"command_tree_hash:{guild.id}" if guild else "command_tree_hash"
+    tree_hash = command_tree_hash(guild)
+    if storage.get_setting(setting) == tree_hash:
+        print("Command tree unchanged, skipping sync")
+        return
+    
+    if guild:
+        # На сервере команды появляются сразу, глобальная синхронизация расходится дольше
+        bot.tree.copy_global_to(guild=guild)
+        synced = await bot.tree.sync(guild=guild)
+        bot.tree.clear_commands(guild=None)
+        await bot.tree.sync()
+        # Глобальные команды удалены: при возврате к обычному режиму их нужно синхронизировать заново
+        storage.set_setting("command_tree_hash", "")
+        storage.set_setting("command_sync_guild", str(guild.id))
+    else:
+        synced = await bot.tree.sync()
+        # Убираем копии команд с сервера, где раньше шла разработка
+        dev_guild = storage.get_setting("command_sync_guild")
+        if dev_guild:
+            await bot.tree.sync(guild=discord.Object(id=int(dev_guild)))
+            storage.set_setting(f"command_tree_hash:{dev_guild}", "")
+            storage.set_setting("command_sync_guild", "")
+    storage.set_setting(setting, tree_hash)
+    print(f"Synced {len(synced)} command(s)" + (f" to guild {guild.id}" if guild else ""))
+
 @bot.event
 async def on_ready():
-    """Вызывается при успешном подключении бота к Discord"""
+    """Вызывается при успешном подключении бота к Discord (в том числе после переподключения)"""
+    global startup_seconds
     print(f"Bot is ready! Logged in as {bot.user.display_name}")
     
-    # Синхронизация команд
-    try:
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} command(s)")
-    except Exception as e:
-        print(f"Failed to sync commands: {e}")
+    if startup_seconds is None:
+        startup_seconds = time.perf_counter() - started_at
+        print(f"Startup took {startup_seconds:.2f} s")
+        
+        # Синхронизация команд
+        try:
+            await sync_command_tree()
+        except Exception as e:
+            print(f"Failed to sync commands: {e}")
+    
+    # Сверяем членство известных пользователей в серверах
+    for guild in bot.guilds:
+        sync_guild_members(guild)
+
+def sync_guild_members(guild: discord.Guild):
+    """Отметить известных пользователей участниками сервера"""
+    guild_id = str(guild.id)
+    for member in guild.members:
+        user_id = str(member.id)
+        if storage.get_user(user_id):
+            storage.add_guild_member(guild_id, user_id)
+
+@bot.event
+async def on_guild_join(guild):
+    """Обработчик добавления бота на сервер"""
+    sync_guild_members(guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    """Обработчик удаления бота с сервера"""
+    storage.remove_guild(str(guild.id))
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    """Запоминаем сервер, с которого пользователь вызывает команды"""
+    if interaction.guild_id:
+        storage.add_guild_member(str(interaction.guild_id), str(interaction.user.id))
 
 @bot.event
 async def on_member_join(member):
@@ -261,9 +2099,16 @@ async def on_member_join(member):
                 is_admin=False
             )
             print(f"Created new user: {user.username} with initial balance: {user.balance}")
+        
+        storage.add_guild_member(str(member.guild.id), user_id)
     except Exception as e:
         print(f"Error creating user on guild join: {e}")
 
+@bot.event
+async def on_member_remove(member):
+    """Обработчик события выхода участника с сервера"""
+    storage.remove_guild_member(str(member.guild.id), str(member.id))
+
 #########################
 # ЭКОНОМИЧЕСКИЕ КОМАНДЫ
 #########################
@@ -279,7 +2124,8 @@ async def balance(interaction: discord.Interaction, user: Optional[discord.User]
         db_user = storage.get_user(user_id)
         
         if not db_user:
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Пользователь не найден",
                     description="Этот пользователь еще не играл в игры.",
@@ -291,7 +2137,8 @@ async def balance(interaction: discord.Interaction, user: Optional[discord.User]
             return
         
         # Отправляем информацию о балансе
-        await interaction.response.send_message(
+        await send_response(
+            interaction,
             embed=create_embed(
                 title=f"Баланс {target_user.display_name}",
                 description=f"Текущий баланс: **{format_number(db_user.balance)}** монет",
@@ -300,14 +2147,17 @@ async def balance(interaction: discord.Interaction, user: Optional[discord.User]
                 fields=[
                     {"name": "Игр сыграно", "value": str(db_user.games_played), "inline": True},
                     {"name": "Игр выиграно", "value": str(db_user.games_won), "inline": True},
-                    {"name": "Процент побед", "value": calculate_win_rate(db_user.games_won, db_user.games_played), "inline": True}
+                    {"name": "Процент побед", "value": calculate_win_rate(db_user.games_won, db_user.games_played), "inline": True},
+                    {"name": "Место в рейтинге", "value": f"#{storage.get_user_rank(user_id)} из {storage.get_total_users()}", "inline": True}
                 ],
                 footer="PutinZov Casino | Экономика"
             )
         )
     except Exception as e:
         print(f"Error executing balance command: {e}")
-        await interaction.response.send_message(
+        command_metrics.record_error(interaction)
+        await send_response(
+            interaction,
             content="Произошла ошибка при проверке баланса!",
             ephemeral=True
         )
@@ -322,7 +2172,8 @@ async def daily(interaction: discord.Interaction):
         user = storage.get_user(user_id)
         
         if not user:
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Пользователь не найден",
                     description="Вам нужно сыграть в игру, прежде чем получать ежедневные награды.",
@@ -341,7 +2192,8 @@ async def daily(interaction: discord.Interaction):
             next_reset = today + datetime.timedelta(days=1)
             hours_remaining = int((next_reset - now).total_seconds() / 3600)
             
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Бонус уже получен",
                     description=f"Вы уже получили ежедневный бонус сегодня.\nВозвращайтесь через **{hours_remaining}** часов.",
@@ -354,13 +2206,13 @@ async def daily(interaction: discord.Interaction):
         
         # Выдаем ежедневный бонус (1000 монет)
         DAILY_REWARD = 1000
-        new_balance = user.balance + DAILY_REWARD
-        storage.update_user_balance(user_id, new_balance)
+        new_balance = storage.credit_user_balance(user_id, DAILY_REWARD, LedgerEntryType.DAILY).balance
         
         # Обновляем время получения бонуса
-        user.last_daily = now
+        storage.set_user_last_daily(user_id, now)
         
-        await interaction.response.send_message(
+        await send_response(
+            interaction,
             embed=create_embed(
                 title="Ежедневный бонус получен!",
                 description=f"Вы получили **{format_number(DAILY_REWARD)}** монет!\nВаш новый баланс: **{format_number(new_balance)}** монет.",
@@ -371,7 +2223,9 @@ async def daily(interaction: discord.Interaction):
         )
     except Exception as e:
         print(f"Error executing daily command: {e}")
-        await interaction.response.send_message(
+        command_metrics.record_error(interaction)
+        await send_response(
+            interaction,
             content="Произошла ошибка при получении ежедневного бонуса!",
             ephemeral=True
         )
@@ -381,14 +2235,16 @@ async def transfer(interaction: discord.Interaction, user: discord.User, amount:
     """Команда для перевода монет другому пользователю"""
     try:
         if amount < 1:
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 content="Сумма перевода должна быть больше 0!",
                 ephemeral=True
             )
             return
         
         if user.id == interaction.user.id:
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Ошибка перевода",
                     description="Вы не можете перевести монеты самому себе!",
@@ -406,7 +2262,8 @@ async def transfer(interaction: discord.Interaction, user: discord.User, amount:
         sender = storage.get_user(sender_id)
         
         if not sender:
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Пользователь не найден",
                     description="Вам нужно сыграть в игру, прежде чем совершать переводы.",
@@ -417,14 +2274,13 @@ async def transfer(interaction: discord.Interaction, user: discord.User, amount:
             )
             return
         
-        # Проверяем, достаточно ли средств у отправителя
-        if sender.balance < amount:
-            await interaction.response.send_message(
-                embed=create_embed(
-                    title="Недостаточно средств",
-                    description=f"У вас только **{format_number(sender.balance)}** монет, но вы пытаетесь перевести **{format_number(amount)}** монет.",
-                    color=0xED4245,  # Красный
-                    footer="PutinZov Casino | Перевод"
+        # Атомарно списываем сумму у отправителя
+        if not storage.debit_user_balance(sender_id, amount, LedgerEntryType.TRANSFER_OUT):
+            await send_response(
+                interaction,
+                embed=INSUFFICIENT_FUNDS_TRANSFER_EMBED.render(
+                    balance=format_number(sender.balance),
+                    amount=format_number(amount)
                 ),
                 ephemeral=True
             )
@@ -443,14 +2299,12 @@ async def transfer(interaction: discord.Interaction, user: discord.User, amount:
                 is_admin=False
             )
         
-        # Обновляем балансы
-        sender_new_balance = sender.balance - amount
-        recipient_new_balance = recipient.balance + amount
+        # Зачисляем сумму получателю
+        storage.credit_user_balance(recipient_id, amount, LedgerEntryType.TRANSFER_IN)
+        sender_new_balance = sender.balance
         
-        storage.update_user_balance(sender_id, sender_new_balance)
-        storage.update_user_balance(recipient_id, recipient_new_balance)
-        
-        await interaction.response.send_message(
+        await send_response(
+            interaction,
             embed=create_embed(
                 title="Перевод выполнен",
                 description=f"Вы перевели **{format_number(amount)}** монет пользователю **{user.display_name}**!\nВаш новый баланс: **{format_number(sender_new_balance)}** монет.",
@@ -461,7 +2315,9 @@ async def transfer(interaction: discord.Interaction, user: discord.User, amount:
         )
     except Exception as e:
         print(f"Error executing transfer command: {e}")
-        await interaction.response.send_message(
+        command_metrics.record_error(interaction)
+        await send_response(
+            interaction,
             content="Произошла ошибка при переводе монет!",
             ephemeral=True
         )
@@ -485,6 +2341,9 @@ class RouletteBetType(Enum):
     FIRST_COLUMN = "1st column" # Первая колонка (1,4,7...)
     SECOND_COLUMN = "2nd column" # Вторая колонка (2,5,8...)
     THIRD_COLUMN = "3rd column" # Третья колонка (3,6,9...)
+    SPLIT = "split"           # Два соседних числа
+    STREET = "street"         # Ряд из трех чисел
+    CORNER = "corner"         # Четыре числа в углу
 
 # Константы рулетки
 RED_NUMBERS = [1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36]
@@ -505,8 +2364,342 @@ ROULETTE_PAYOUTS = {
     RouletteBetType.FIRST_COLUMN: 2,   # 2:1
     RouletteBetType.SECOND_COLUMN: 2,  # 2:1
     RouletteBetType.THIRD_COLUMN: 2,   # 2:1
+    RouletteBetType.SPLIT: 17,         # 17:1
+    RouletteBetType.STREET: 11,        # 11:1
+    RouletteBetType.CORNER: 8,         # 8:1
+}
+
+# Варианты ставок для команд рулетки
+ROULETTE_BET_CHOICES = [
+    app_commands.Choice(name="Красное", value="red"),
+    app_commands.Choice(name="Черное", value="black"),
+    app_commands.Choice(name="Четное", value="even"),
+    app_commands.Choice(name="Нечетное", value="odd"),
+    app_commands.Choice(name="1-18 (Низкие)", value="1-18"),
+    app_commands.Choice(name="19-36 (Высокие)", value="19-36"),
+    app_commands.Choice(name="1-я дюжина (1-12)", value="1st dozen"),
+    app_commands.Choice(name="2-я дюжина (13-24)", value="2nd dozen"),
+    app_commands.Choice(name="3-я дюжина (25-36)", value="3rd dozen"),
+    app_commands.Choice(name="1-я колонка (1,4,7,...)", value="1st column"),
+    app_commands.Choice(name="2-я колонка (2,5,8,...)", value="2nd column"),
+    app_commands.Choice(name="3-я колонка (3,6,9,...)", value="3rd column"),
+    app_commands.Choice(name="Число", value="number"),
+    app_commands.Choice(name="Сплит (два соседних числа)", value="split"),
+    app_commands.Choice(name="Улица (ряд из трех чисел)", value="street"),
+    app_commands.Choice(name="Угол (четыре числа)", value="corner"),
+]
+
+# Общий стол рулетки
+ROULETTE_TABLE_WINDOW = 30.0                  # Прием ставок до вращения (секунд)
+ROULETTE_TABLE_MAX_BETS = 10                  # Максимум ставок игрока за одно вращение
+ROULETTE_TABLE_RESULT_LINES = 25              # Строк с игроками в сообщении о результатах
+
+def pockets_mask(pockets) -> int:
+    """Битовая маска чисел колеса (бит N - выигрыш при выпадении N)"""
+    mask = 0
+    for pocket in pockets:
+        mask |= 1 << pocket
+    return mask
+
+# Цвет каждого числа колеса (индекс - число 0-36)
+ROULETTE_COLORS = tuple(
+    "red" if pocket in RED_NUMBERS else "black" if pocket in BLACK_NUMBERS else "green"
+    for pocket in range(37)
+)
+
+# Выигрышные числа для внешних ставок
+ROULETTE_WIN_MASKS = {
+    RouletteBetType.RED: pockets_mask(RED_NUMBERS),
+    RouletteBetType.BLACK: pockets_mask(BLACK_NUMBERS),
+    RouletteBetType.EVEN: pockets_mask(range(2, 37, 2)),
+    RouletteBetType.ODD: pockets_mask(range(1, 37, 2)),
+    RouletteBetType.LOW: pockets_mask(range(1, 19)),
+    RouletteBetType.HIGH: pockets_mask(range(19, 37)),
+    RouletteBetType.FIRST_DOZEN: pockets_mask(range(1, 13)),
+    RouletteBetType.SECOND_DOZEN: pockets_mask(range(13, 25)),
+    RouletteBetType.THIRD_DOZEN: pockets_mask(range(25, 37)),
+    RouletteBetType.FIRST_COLUMN: pockets_mask(range(1, 37, 3)),
+    RouletteBetType.SECOND_COLUMN: pockets_mask(range(2, 37, 3)),
+    RouletteBetType.THIRD_COLUMN: pockets_mask(range(3, 37, 3)),
 }
 
+def get_roulette_color(result_number: int) -> str:
+    """Цвет числа на колесе (0 - зеленый)"""
+    return ROULETTE_COLORS[result_number]
+
+def get_inside_bet_pockets(bet_type: RouletteBetType, number: Optional[int],
+                           second: Optional[int] = None) -> Optional[Tuple[int, ...]]:
+    """Числа внутренней ставки (сплит, улица, угол) или None, если ставка неверна"""
+    if number is None or not 0 <= number <= 36:
+        return None
+    
+    if bet_type == RouletteBetType.SPLIT:
+        # Соседние числа: по горизонтали в одном ряду, по вертикали или 0 с 1-3
+        if second is None or not 0 <= second <= 36:
+            return None
+        low, high = sorted((number, second))
+        if low == 0:
+            return (low, high) if high in (1, 2, 3) else None
+        if high - low == 3 or (high - low == 1 and low % 3 != 0):
+            return (low, high)
+        return None
+    
+    if bet_type == RouletteBetType.STREET:
+        # Любое число ряда задает весь ряд
+        if number == 0:
+            return None
+        first = (number - 1) // 3 * 3 + 1
+        return (first, first + 1, first + 2)
+    
+    if bet_type == RouletteBetType.CORNER:
+        # Число - левый верхний угол квадрата 2x2
+        if number == 0 or number % 3 == 0 or number > 32:
+            return None
+        return (number, number + 1, number + 3, number + 4)
+    
+    return None
+
+def roulette_win_mask(bet_type: RouletteBetType, number: Optional[int] = None,
+                      second: Optional[int] = None) -> int:
+    """Маска выигрышных чисел для ставки (0 - ставка неверна)"""
+    if bet_type == RouletteBetType.NUMBER:
+        return 1 << number if number is not None and 0 <= number <= 36 else 0
+    if bet_type in ROULETTE_WIN_MASKS:
+        return ROULETTE_WIN_MASKS[bet_type]
+    pockets = get_inside_bet_pockets(bet_type, number, second)
+    return pockets_mask(pockets) if pockets else 0
+
+def is_roulette_win(bet_type: RouletteBetType, result_number: int, number: Optional[int] = None,
+                    second: Optional[int] = None) -> bool:
+    """Проверить, выиграла ли ставка при выпавшем числе"""
+    return bool(roulette_win_mask(bet_type, number, second) >> result_number & 1)
+
+def format_roulette_bet(bet_type: RouletteBetType, number: Optional[int] = None,
+                        second: Optional[int] = None) -> str:
+    """Название ставки для отображения"""
+    if bet_type == RouletteBetType.NUMBER:
+        return f"Число {number}"
+    pockets = get_inside_bet_pockets(bet_type, number, second)
+    if pockets:
+        names = {RouletteBetType.SPLIT: "Сплит", RouletteBetType.STREET: "Улица", RouletteBetType.CORNER: "Угол"}
+        return f"{names[bet_type]} {'-'.join(str(pocket) for pocket in pockets)}"
+    return bet_type.value
+
+def format_roulette_result(result_number: int) -> str:
+    """Выпавшее число с цветом"""
+    result_color = get_roulette_color(result_number)
+    result_emoji = "🔴" if result_color == "red" else "⚫" if result_color == "black" else "🟢"
+    return f"{result_emoji} **{result_number}** {result_emoji}"
+
+async def reject_roulette_bet(interaction: discord.Interaction, amount: int, bet_type: RouletteBetType,
+                              number: Optional[int], second: Optional[int]) -> bool:
+    """Проверить ставку; при ошибке ответить игроку и вернуть True"""
+    if amount < 10:
+        await send_response(
+            interaction,
+            content="Минимальная ставка - 10 монет!",
+            ephemeral=True
+        )
+        return True
+    
+    if bet_type == RouletteBetType.NUMBER and number is None:
+        await send_response(
+            interaction,
+            embed=create_embed(
+                title="Неверная ставка",
+                description="При ставке на число вы должны указать номер.",
+                color=0xED4245  # Красный
+            ),
+            ephemeral=True
+        )
+        return True
+    
+    if number is not None and (number < 0 or number > 36):
+        await send_response(
+            interaction,
+            content="Номер должен быть от 0 до 36!",
+            ephemeral=True
+        )
+        return True
+    
+    if not roulette_win_mask(bet_type, number, second):
+        await send_response(
+            interaction,
+            embed=create_embed(
+                title="Неверная ставка",
+                description=
+                    "**Сплит**: укажите два соседних числа (`number` и `second`), например 17 и 20\n" +
+                    "**Улица**: укажите любое число ряда, например 13 (ряд 13-14-15)\n" +
+                    "**Угол**: укажите левое верхнее число квадрата, например 17 (17-18-20-21)",
+                color=0xED4245  # Красный
+            ),
+            ephemeral=True
+        )
+        return True
+    
+    return False
+
+class RouletteTable:
+    """Общий стол рулетки в канале
+    
+    Ставки всех игроков копятся до вращения и рассчитываются одним проходом:
+    на каждого игрока приходится одно зачисление и одна запись в истории.
+    """
+    def __init__(self, channel_id: int, spin_at: float):
+        self.channel_id = channel_id
+        self.spin_at = spin_at                # Время вращения
+        self.bets = []                        # Ставки: [(user_id, маска, множитель, сумма, название)]
+        self.settled = set()                  # Игроки, которым выплата уже зачислена
+    
+    def count_bets(self, user_id: str) -> int:
+        """Количество ставок игрока в этом вращении"""
+        return sum(1 for bet in self.bets if bet[0] == user_id)
+    
+    def settle(self, result_number: int) -> Dict[str, List[int]]:
+        """Рассчитать все ставки: {user_id: [сумма ставок, сумма выплат]}"""
+        totals = {}
+        for user_id, mask, multiplier, amount, _ in self.bets:
+            entry = totals.setdefault(user_id, [0, 0])
+            entry[0] += amount
+            if mask >> result_number & 1:
+                entry[1] += amount * (multiplier + 1)  # Выигрыш + первоначальная ставка
+        return totals
+
+# Открытые столы: {channel_id: RouletteTable}
+roulette_tables = {}
+roulette_timers = TimerWheel()                # Время вращения столов
+
+async def spin_roulette_table(table: RouletteTable):
+    """Вращение стола: общий результат и расчет всех ставок"""
+    nonce = rng.position(GameType.ROULETTE.value)
+    result_number = get_random_int(0, 36, GameType.ROULETTE.value)
+    lines = []
+    
+    for user_id, (bet_total, payout) in table.settle(result_number).items():
+        if payout:
+            storage.credit_user_balance(user_id, payout)
+        table.settled.add(user_id)
+        
+        if payout > bet_total:
+            outcome = GameOutcome.WIN
+        elif payout == bet_total:
+            outcome = GameOutcome.PUSH
+        else:
+            outcome = GameOutcome.LOSS
+        
+        storage.add_game_history(
+            user_id=user_id,
+            game_type=GameType.ROULETTE,
+            bet_amount=bet_total,
+            outcome=outcome,
+            payout=payout,
+            nonce=nonce
+        )
+        
+        net = payout - bet_total
+        lines.append(f"<@{user_id}>: ставки **{format_number(bet_total)}**, " +
+                     (f"выигрыш **+{format_number(net)}**" if net >= 0 else f"проигрыш **-{format_number(-net)}**"))
+    
+    if len(lines) > ROULETTE_TABLE_RESULT_LINES:
+        hidden = len(lines) - ROULETTE_TABLE_RESULT_LINES
+        lines = lines[:ROULETTE_TABLE_RESULT_LINES] + [f"...и еще {hidden} игрок(ов)"]
+    
+    storage.delete_roulette_bets(table.channel_id, table.spin_at)
+    queue_channel_message(
+        table.channel_id,
+        embed=create_embed(
+            title="Результаты стола рулетки",
+            description=f"Шарик остановился на: {format_roulette_result(result_number)}\n\n" + "\n".join(lines),
+            color=0xFFD700,  # Золотой
+            footer=fair_footer("PutinZov Casino | Рулетка", nonce)
+        )
+    )
+
+@tasks.loop(seconds=1)
+async def spin_roulette_tables():
+    """Вращать столы, у которых закончился прием ставок"""
+    for channel_id in roulette_timers.advance(time.time()):
+        table = roulette_tables.pop(channel_id, None)
+        if not table:
+            continue
+        try:
+            await spin_roulette_table(table)
+        except Exception as e:
+            # Ошибка одного стола не останавливает цикл: возвращаем нерассчитанные ставки
+            print(f"Error spinning roulette table: {e}")
+            try:
+                refund_roulette_table(table)
+            except Exception as e:
+                print(f"Error refunding roulette table: {e}")
+
+def refund_roulette_table(table: RouletteTable):
+    """Вернуть ставки стола игрокам, которым еще не зачислена выплата"""
+    refunds = {}
+    for user_id, _, _, amount, _ in table.bets:
+        if user_id not in table.settled:
+            refunds[user_id] = refunds.get(user_id, 0) + amount
+    for user_id, amount in refunds.items():
+        storage.credit_user_balance(user_id, amount, LedgerEntryType.REFUND)
+        table.settled.add(user_id)
+    storage.delete_roulette_bets(table.channel_id, table.spin_at)
+
+def refund_roulette_tables():
+    """Вернуть ставки с невращавшихся столов (при остановке бота)"""
+    for table in roulette_tables.values():
+        refund_roulette_table(table)
+    roulette_tables.clear()
+
+def refund_saved_roulette_bets():
+    """Вернуть ставки столов, сохраненные до аварийной остановки бота"""
+    refunds = {}
+    tables = set()
+    for channel_id, spin_at, user_id, amount in storage.load_roulette_bets():
+        refunds[user_id] = refunds.get(user_id, 0) + amount
+        tables.add((channel_id, spin_at))
+    for user_id, amount in refunds.items():
+        if storage.get_user(user_id):
+            storage.credit_user_balance(user_id, amount, LedgerEntryType.REFUND)
+    for channel_id, spin_at in tables:
+        storage.delete_roulette_bets(channel_id, spin_at)
+    if refunds:
+        print(f"Refunded roulette bets of {len(refunds)} player(s) from {len(tables)} unfinished table(s)")
+
+# Правила рулетки собираются один раз при запуске
+ROULETTE_HELP_EMBED = EmbedTemplate(
+    title="Рулетка - Правила игры",
+    description="Рулетка - это игра, где шарик вращается по колесу с пронумерованными ячейками от 0 до 36.",
+    color=0xFFD700,  # Золотой
+    fields=[
+        {
+            "name": "Варианты ставок",
+            "value": 
+                "**Число**: Ставка на конкретное число (0-36). Выплата 35:1\n" +
+                "**Красное/Черное**: Ставка на цвет. Выплата 1:1\n" +
+                "**Четное/Нечетное**: Ставка на четные или нечетные числа. Выплата 1:1\n" +
+                "**1-18/19-36**: Ставка на низкие или высокие числа. Выплата 1:1\n" +
+                "**Дюжины**: Ставка на 1-12, 13-24 или 25-36. Выплата 2:1\n" +
+                "**Колонки**: Ставка на колонку. Выплата 2:1\n" +
+                "**Сплит**: Два соседних числа. Выплата 17:1\n" +
+                "**Улица**: Ряд из трех чисел. Выплата 11:1\n" +
+                "**Угол**: Четыре числа в квадрате. Выплата 8:1"
+        },
+        {
+            "name": "Команды",
+            "value":
+                "`/roulette bet <сумма> <тип_ставки> [номер] [второе]` - Своя рулетка\n" +
+                f"`/roulette table <сумма> <тип_ставки> [номер] [второе]` - Общий стол канала, вращение раз в {int(ROULETTE_TABLE_WINDOW)} сек."
+        },
+        {
+            "name": "Примеры",
+            "value": 
+                "`/roulette bet 100 red` - Ставка 100 на красное\n" +
+                "`/roulette bet 500 1st dozen` - Ставка 500 на 1-ю дюжину (1-12)\n" +
+                "`/roulette table 200 split 17 20` - Ставка 200 на сплит 17-20 за общим столом"
+        }
+    ],
+    footer="PutinZov Casino | Рулетка"
+)
+
 class RouletteBet(discord.app_commands.Group):
     """Группа команд для игры в рулетку"""
     
@@ -514,52 +2707,17 @@ class RouletteBet(discord.app_commands.Group):
     @app_commands.describe(
         amount="Размер ставки (мин. 10)",
         bet_type="Тип ставки",
-        number="Если ставка на конкретное число (0-36)"
+        number="Число для ставки на число, сплита, улицы или угла (0-36)",
+        second="Второе число для сплита"
     )
-    @app_commands.choices(bet_type=[
-        app_commands.Choice(name="Красное", value="red"),
-        app_commands.Choice(name="Черное", value="black"),
-        app_commands.Choice(name="Четное", value="even"),
-        app_commands.Choice(name="Нечетное", value="odd"),
-        app_commands.Choice(name="1-18 (Низкие)", value="1-18"),
-        app_commands.Choice(name="19-36 (Высокие)", value="19-36"),
-        app_commands.Choice(name="1-я дюжина (1-12)", value="1st dozen"),
-        app_commands.Choice(name="2-я дюжина (13-24)", value="2nd dozen"),
-        app_commands.Choice(name="3-я дюжина (25-36)", value="3rd dozen"),
-        app_commands.Choice(name="1-я колонка (1,4,7,...)", value="1st column"),
-        app_commands.Choice(name="2-я колонка (2,5,8,...)", value="2nd column"),
-        app_commands.Choice(name="3-я колонка (3,6,9,...)", value="3rd column"),
-        app_commands.Choice(name="Число", value="number"),
-    ])
+    @app_commands.choices(bet_type=ROULETTE_BET_CHOICES)
     async def roulette_bet(self, interaction: discord.Interaction, amount: int, 
-                          bet_type: str, number: Optional[int] = None):
+                          bet_type: str, number: Optional[int] = None, second: Optional[int] = None):
         """Сделать ставку в рулетке"""
         try:
-            if amount < 10:
-                await interaction.response.send_message(
-                    content="Минимальная ставка - 10 монет!",
-                    ephemeral=True
-                )
-                return
-            
             # Проверяем валидность ставки
             bet_type_enum = RouletteBetType(bet_type)
-            if bet_type_enum == RouletteBetType.NUMBER and number is None:
-                await interaction.response.send_message(
-                    embed=create_embed(
-                        title="Неверная ставка",
-                        description="При ставке на число вы должны указать номер.",
-                        color=0xED4245  # Красный
-                    ),
-                    ephemeral=True
-                )
-                return
-            
-            if number is not None and (number < 0 or number > 36):
-                await interaction.response.send_message(
-                    content="Номер должен быть от 0 до 36!",
-                    ephemeral=True
-                )
+            if await reject_roulette_bet(interaction, amount, bet_type_enum, number, second):
                 return
             
             user_id = str(interaction.user.id)
@@ -577,69 +2735,34 @@ class RouletteBet(discord.app_commands.Group):
                     is_admin=False
                 )
             
-            # Проверяем, достаточно ли средств
-            if user.balance < amount:
-                await interaction.response.send_message(
-                    embed=create_embed(
-                        title="Недостаточно средств",
-                        description=f"У вас только **{format_number(user.balance)}** монет, но вы ставите **{format_number(amount)}** монет.",
-                        color=0xED4245  # Красный
+            # Атомарно списываем ставку
+            if not storage.debit_user_balance(user_id, amount):
+                await send_response(
+                    interaction,
+                    embed=INSUFFICIENT_FUNDS_EMBED.render(
+                        balance=format_number(user.balance),
+                        amount=format_number(amount)
                     ),
                     ephemeral=True
                 )
                 return
             
             # Вращаем рулетку (0-36)
-            result_number = get_random_int(0, 36)
-            
-            # Определяем цвет выпавшего числа (0 - зеленый)
-            result_color = "green"
-            if result_number in RED_NUMBERS:
-                result_color = "red"
-            elif result_number in BLACK_NUMBERS:
-                result_color = "black"
+            nonce = rng.position(GameType.ROULETTE.value)
+            result_number = get_random_int(0, 36, GameType.ROULETTE.value)
             
             # Проверяем выигрыш
-            is_win = False
-            
-            if bet_type_enum == RouletteBetType.NUMBER:
-                is_win = result_number == number
-            elif bet_type_enum == RouletteBetType.RED:
-                is_win = result_color == "red"
-            elif bet_type_enum == RouletteBetType.BLACK:
-                is_win = result_color == "black"
-            elif bet_type_enum == RouletteBetType.EVEN:
-                is_win = result_number != 0 and result_number % 2 == 0
-            elif bet_type_enum == RouletteBetType.ODD:
-                is_win = result_number % 2 == 1
-            elif bet_type_enum == RouletteBetType.LOW:
-                is_win = result_number >= 1 and result_number <= 18
-            elif bet_type_enum == RouletteBetType.HIGH:
-                is_win = result_number >= 19 and result_number <= 36
-            elif bet_type_enum == RouletteBetType.FIRST_DOZEN:
-                is_win = result_number >= 1 and result_number <= 12
-            elif bet_type_enum == RouletteBetType.SECOND_DOZEN:
-                is_win = result_number >= 13 and result_number <= 24
-            elif bet_type_enum == RouletteBetType.THIRD_DOZEN:
-                is_win = result_number >= 25 and result_number <= 36
-            elif bet_type_enum == RouletteBetType.FIRST_COLUMN:
-                is_win = result_number % 3 == 1
-            elif bet_type_enum == RouletteBetType.SECOND_COLUMN:
-                is_win = result_number % 3 == 2
-            elif bet_type_enum == RouletteBetType.THIRD_COLUMN:
-                is_win = result_number % 3 == 0 and result_number != 0
-            
-            # Рассчитываем выигрыш
+            is_win = is_roulette_win(bet_type_enum, result_number, number, second)
+            
+            # Рассчитываем выигрыш (ставка уже списана)
             win_amount = 0
-            new_balance = user.balance - amount  # Вычитаем ставку
             
             if is_win:
                 multiplier = ROULETTE_PAYOUTS[bet_type_enum]
                 win_amount = amount * multiplier + amount  # Выигрыш + первоначальная ставка
-                new_balance += win_amount
+                storage.credit_user_balance(user_id, win_amount)
             
-            # Обновляем баланс пользователя
-            storage.update_user_balance(user_id, new_balance)
+            new_balance = user.balance
             
             # Добавляем запись в историю игр
             storage.add_game_history(
@@ -647,18 +2770,16 @@ class RouletteBet(discord.app_commands.Group):
                 game_type=GameType.ROULETTE,
                 bet_amount=amount,
                 outcome=GameOutcome.WIN if is_win else GameOutcome.LOSS,
-                win_amount=win_amount - amount if is_win else 0  # Записываем только чистый выигрыш
+                payout=win_amount if is_win else 0,
+                nonce=nonce
             )
             
             # Создаем сообщение о результате
-            result_emoji = "🔴" if result_color == "red" else "⚫" if result_color == "black" else "🟢"
-            result_text = f"{result_emoji} **{result_number}** {result_emoji}"
+            result_text = format_roulette_result(result_number)
+            bet_display_name = format_roulette_bet(bet_type_enum, number, second)
             
-            bet_display_name = bet_type
-            if bet_type_enum == RouletteBetType.NUMBER:
-                bet_display_name = f"Число {number}"
-            
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Результаты рулетки",
                     description=f"Шарик остановился на: {result_text}",
@@ -668,12 +2789,106 @@ class RouletteBet(discord.app_commands.Group):
                         {"name": "Результат", "value": f"{'Выигрыш! +' if is_win else 'Проигрыш! -'}**{format_number(win_amount if is_win else amount)}** монет", "inline": True},
                         {"name": "Новый баланс", "value": f"**{format_number(new_balance)}** монет", "inline": False}
                     ],
-                    footer="PutinZov Casino | Рулетка"
+                    footer=fair_footer("PutinZov Casino | Рулетка", nonce)
                 )
             )
         except Exception as e:
             print(f"Error executing roulette bet command: {e}")
-            await interaction.response.send_message(
+            command_metrics.record_error(interaction)
+            await send_response(
+                interaction,
+                content="Произошла ошибка при обработке ставки!",
+                ephemeral=True
+            )
+    
+    @app_commands.command(name="table", description="Поставить на общий стол рулетки")
+    @app_commands.describe(
+        amount="Размер ставки (мин. 10)",
+        bet_type="Тип ставки",
+        number="Число для ставки на число, сплита, улицы или угла (0-36)",
+        second="Второе число для сплита"
+    )
+    @app_commands.choices(bet_type=ROULETTE_BET_CHOICES)
+    async def roulette_table(self, interaction: discord.Interaction, amount: int,
+                             bet_type: str, number: Optional[int] = None, second: Optional[int] = None):
+        """Сделать ставку на общем столе канала"""
+        try:
+            bet_type_enum = RouletteBetType(bet_type)
+            if await reject_roulette_bet(interaction, amount, bet_type_enum, number, second):
+                return
+            
+            user_id = str(interaction.user.id)
+            channel_id = interaction.channel_id
+            table = roulette_tables.get(channel_id)
+            
+            if table and table.count_bets(user_id) >= ROULETTE_TABLE_MAX_BETS:
+                await send_response(
+                    interaction,
+                    content=f"Можно сделать не больше {ROULETTE_TABLE_MAX_BETS} ставок за одно вращение!",
+                    ephemeral=True
+                )
+                return
+            
+            # Получаем пользователя из хранилища
+            user = storage.get_user(user_id)
+            
+            if not user:
+                # Создаем нового пользователя
+                user = storage.create_user(
+                    user_id=user_id,
+                    username=interaction.user.display_name,
+                    discriminator=interaction.user.discriminator or "",
+                    balance=10000,
+                    is_admin=False
+                )
+            
+            # Атомарно списываем ставку
+            if not storage.debit_user_balance(user_id, amount):
+                await send_response(
+                    interaction,
+                    embed=INSUFFICIENT_FUNDS_EMBED.render(
+                        balance=format_number(user.balance),
+                        amount=format_number(amount)
+                    ),
+                    ephemeral=True
+                )
+                return
+            
+            # Открываем стол, если в канале еще нет приема ставок
+            is_new_table = table is None
+            if is_new_table:
+                table = RouletteTable(channel_id, time.time() + ROULETTE_TABLE_WINDOW)
+                roulette_tables[channel_id] = table
+                roulette_timers.schedule(channel_id, table.spin_at)
+            
+            bet_display_name = format_roulette_bet(bet_type_enum, number, second)
+            table.bets.append((user_id, roulette_win_mask(bet_type_enum, number, second),
+                               ROULETTE_PAYOUTS[bet_type_enum], amount, bet_display_name))
+            storage.save_roulette_bet(channel_id, table.spin_at, user_id, amount)
+            seconds_left = max(int(table.spin_at - time.time()), 0)
+            
+            if is_new_table:
+                await send_response(
+                    interaction,
+                    embed=create_embed(
+                        title="Стол рулетки открыт",
+                        description=f"{interaction.user.mention} ставит **{format_number(amount)}** монет на **{bet_display_name}**.\n" +
+                                    f"Вращение через **{seconds_left}** сек. Делайте ставки: `/roulette table`",
+                        color=0xFFD700,  # Золотой
+                        footer="PutinZov Casino | Рулетка"
+                    )
+                )
+            else:
+                await send_response(
+                    interaction,
+                    content=f"Ставка **{format_number(amount)}** монет на **{bet_display_name}** принята. Вращение через {seconds_left} сек.",
+                    ephemeral=True
+                )
+        except Exception as e:
+            print(f"Error executing roulette table command: {e}")
+            command_metrics.record_error(interaction)
+            await send_response(
+                interaction,
                 content="Произошла ошибка при обработке ставки!",
                 ephemeral=True
             )
@@ -681,35 +2896,9 @@ class RouletteBet(discord.app_commands.Group):
     @app_commands.command(name="help", description="Узнать правила игры в рулетку")
     async def roulette_help(self, interaction: discord.Interaction):
         """Показать помощь по рулетке"""
-        await interaction.response.send_message(
-            embed=create_embed(
-                title="Рулетка - Правила игры",
-                description="Рулетка - это игра, где шарик вращается по колесу с пронумерованными ячейками от 0 до 36.",
-                color=0xFFD700,  # Золотой
-                fields=[
-                    {
-                        "name": "Варианты ставок",
-                        "value": 
-                            "**Число**: Ставка на конкретное число (0-36). Выплата 35:1\n" +
-                            "**Красное/Черное**: Ставка на цвет. Выплата 1:1\n" +
-                            "**Четное/Нечетное**: Ставка на четные или нечетные числа. Выплата 1:1\n" +
-                            "**1-18/19-36**: Ставка на низкие или высокие числа. Выплата 1:1\n" +
-                            "**Дюжины**: Ставка на 1-12, 13-24 или 25-36. Выплата 2:1\n" +
-                            "**Колонки**: Ставка на колонку. Выплата 2:1"
-                    },
-                    {
-                        "name": "Команда",
-                        "value": "`/roulette bet <сумма> <тип_ставки> [номер]`"
-                    },
-                    {
-                        "name": "Примеры",
-                        "value": 
-                            "`/roulette bet 100 red` - Ставка 100 на красное\n" +
-                            "`/roulette bet 500 1st dozen` - Ставка 500 на 1-ю дюжину (1-12)"
-                    }
-                ],
-                footer="PutinZov Casino | Рулетка"
-            )
+        await send_response(
+            interaction,
+            embed=ROULETTE_HELP_EMBED.render()
         )
 
 #########################
@@ -720,133 +2909,662 @@ class RouletteBet(discord.app_commands.Group):
 SUITS = ['♥', '♦', '♣', '♠']  # Масти
 CARD_VALUES = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K']  # Значения карт
 
-class Card:
-    """Класс карты"""
-    def __init__(self, suit, value):
-        self.suit = suit
-        self.value = value
-        # Определяем числовое значение карты
-        if value == 'A':
-            self.numeric_value = 11  # Туз изначально имеет значение 11
-        elif value in ['J', 'Q', 'K']:
-            self.numeric_value = 10  # Фигурные карты имеют значение 10
-        else:
-            self.numeric_value = int(value)  # Числовые карты имеют соответствующее значение
+# Время на ход в блэкджеке (секунд)
+BLACKJACK_TURN_TIMEOUT = 60.0
+BLACKJACK_DEALER_DELAY = 1.0                  # Пауза перед показом итога после хода дилера
+
+# Правила башмака
+BLACKJACK_DECKS = 6                           # Количество колод в башмаке
+BLACKJACK_PENETRATION = 0.75                  # Доля башмака до подрезной карты
+BLACKJACK_MAX_HANDS = 4                       # Максимум рук после разделений
+BLACKJACK_RESPLIT_ACES = False                # Можно ли повторно разделять тузов
+
+# Карта кодируется числом 0-51: масть * 13 + индекс значения.
+# Названия и очки карт берутся из заранее построенных таблиц.
+CARD_NAMES = tuple(f"[{value}{suit}]" for suit in SUITS for value in CARD_VALUES)
+CARD_POINTS = tuple(
+    11 if value == 'A' else 10 if value in ('J', 'Q', 'K') else int(value)  # Туз изначально 11
+    for suit in SUITS for value in CARD_VALUES
+)
+
+class Shoe:
+    """Башмак из нескольких колод с подрезной картой
+    
+    Карты хранятся в bytearray и выдаются по указателю, поэтому раздача
+    не создает новых объектов. Башмак перемешивается на месте, когда
+    раздача доходит до подрезной карты.
+    """
+    def __init__(self, decks: int = BLACKJACK_DECKS, penetration: float = BLACKJACK_PENETRATION,
+                 cards: Optional[bytes] = None, position: int = 0,
+                 random_source: Optional[random.Random] = None):
+        self.decks = decks
+        self.random_source = random_source    # Свой генератор (по умолчанию поток блэкджека)
+        self.cards = bytearray(cards) if cards is not None else bytearray(range(len(CARD_NAMES))) * decks
+        self.cut_position = int(len(self.cards) * penetration)
+        self.position = position
+        self.shuffle_nonce = None             # Позиция потока, с которой перемешан башмак (честный режим)
+        if cards is None:
+            self.shuffle()
+    
+    def shuffle(self):
+        """Перемешать башмак и начать раздачу сначала"""
+        self.shuffle_nonce = None if self.random_source else rng.position(GameType.BLACKJACK.value)
+        (self.random_source or rng.stream(GameType.BLACKJACK.value)).shuffle(self.cards)
+        self.position = 0
     
-    def __str__(self):
-        return f"[{self.value}{self.suit}]"
+    def shuffle_remaining(self):
+        """Перемешать еще не розданные карты (после смены сида генератора)"""
+        self.shuffle_nonce = None if self.random_source else rng.position(GameType.BLACKJACK.value)
+        remaining = self.cards[self.position:]
+        (self.random_source or rng.stream(GameType.BLACKJACK.value)).shuffle(remaining)
+        self.cards[self.position:] = remaining
+    
+    def deal_nonce(self) -> Optional[str]:
+        """Позиция раздачи для проверки: позиция перемешивания + номер следующей карты"""
+        return f"{self.shuffle_nonce}+{self.position}" if self.shuffle_nonce else None
+    
+    @property
+    def needs_shuffle(self) -> bool:
+        """Дошла ли раздача до подрезной карты"""
+        return self.position >= self.cut_position
+    
+    def draw(self) -> int:
+        """Выдать следующую карту"""
+        if self.position >= len(self.cards):
+            self.shuffle()
+        card = self.cards[self.position]
+        self.position += 1
+        return card
 
 class BlackjackHand:
-    """Рука в блэкджеке"""
+    """Рука в блэкджеке
+    
+    Хранит жесткую сумму (тузы по 1) и количество тузов, поэтому добавление
+    карты и чтение value/is_soft выполняются за O(1). Строка для отображения
+    кэшируется до следующего изменения руки.
+    """
+    __slots__ = ('cards', 'hard_total', 'aces', '_formatted')
+    
     def __init__(self, cards=None):
-        self.cards = cards or []
-        self.value = 0
-        self.is_soft = False  # True, если туз считается за 11
-        self.update_value()
+        self.cards = []
+        self.hard_total = 0                   # Сумма очков, где туз считается за 1
+        self.aces = 0                         # Количество тузов в руке
+        self._formatted = {}                  # Кэш format: {hide_first_card: строка}
+        for card in cards or ():
+            self.add_card(card)
     
     def add_card(self, card):
         """Добавить карту в руку"""
         self.cards.append(card)
-        self.update_value()
+        points = CARD_POINTS[card]
+        if points == 11:
+            self.aces += 1
+            self.hard_total += 1
+        else:
+            self.hard_total += points
+        self._formatted.clear()
     
-    def update_value(self):
-        """Обновить значение руки"""
-        value = 0
-        aces = 0
-        
-        # Подсчитываем значение всех карт
-        for card in self.cards:
-            value += card.numeric_value
-            if card.value == 'A':
-                aces += 1
-        
-        # Корректируем для тузов, если необходимо
-        while value > 21 and aces > 0:
-            value -= 10  # Меняем значение туза с 11 на 1
-            aces -= 1
-        
-        # Определяем, является ли рука "мягкой" (есть туз со значением 11)
-        self.is_soft = aces > 0 and value <= 21
-        
-        self.value = value
+    @property
+    def is_soft(self) -> bool:
+        """True, если туз считается за 11"""
+        return self.aces > 0 and self.hard_total <= 11
+    
+    @property
+    def value(self) -> int:
+        """Значение руки"""
+        return self.hard_total + 10 if self.is_soft else self.hard_total
     
     def format(self, hide_first_card=False):
         """Форматировать руку для отображения"""
-        if hide_first_card and len(self.cards) > 0:
-            return f"[?] {' '.join(str(card) for card in self.cards[1:])}"
+        formatted = self._formatted.get(hide_first_card)
+        if formatted is not None:
+            return formatted
         
-        cards_display = ' '.join(str(card) for card in self.cards)
-        value_display = f"{self.value} (Soft)" if self.is_soft else str(self.value)
+        if hide_first_card and len(self.cards) > 0:
+            formatted = f"[?] {' '.join(CARD_NAMES[card] for card in self.cards[1:])}"
+        else:
+            cards_display = ' '.join(CARD_NAMES[card] for card in self.cards)
+            value_display = f"{self.value} (Soft)" if self.is_soft else str(self.value)
+            formatted = f"{cards_display} = {value_display}"
         
-        return f"{cards_display} = {value_display}"
+        self._formatted[hide_first_card] = formatted
+        return formatted
+
+# Флаги руки игрока (хранятся в bytearray по одному байту на руку)
+HAND_DONE = 1                                 # Рука завершена
+HAND_BUST = 2                                 # Перебор
+HAND_DOUBLED = 4                              # Ставка удвоена
+HAND_SPLIT = 8                                # Рука получена разделением
+HAND_SPLIT_ACES = 16                          # Разделенные тузы (только одна карта)
+HAND_SURRENDERED = 32                         # Игрок сдался
+
+# Флаги игры
+GAME_INSURED = 1                              # Игрок взял страховку
+GAME_INSURANCE_OPEN = 2                       # Дилер показал туза, страховку еще можно взять
+
+def encode_hands(hands: List[BlackjackHand], flags: bytearray) -> bytes:
+    """Упаковать руки игрока: [флаги, число карт, карты...] на каждую руку"""
+    data = bytearray()
+    for hand, hand_flags in zip(hands, flags):
+        data.append(hand_flags)
+        data.append(len(hand.cards))
+        data.extend(hand.cards)
+    return bytes(data)
+
+def decode_hands(data: bytes) -> Tuple[List[BlackjackHand], bytearray]:
+    """Распаковать руки игрока, упакованные encode_hands"""
+    hands, flags = [], bytearray()
+    i = 0
+    while i < len(data):
+        count = data[i + 1]
+        flags.append(data[i])
+        hands.append(BlackjackHand(list(data[i + 2:i + 2 + count])))
+        i += 2 + count
+    return hands, flags
 
 class BlackjackGame:
-    """Игра в блэкджек"""
-    def __init__(self, user_id, bet_amount):
+    """Игра в блэкджек
+    
+    Руки игрока хранятся списком BlackjackHand и параллельным bytearray флагов;
+    ставка каждой руки равна исходной (или двойной, если рука удвоена), поэтому
+    отдельный список ставок не нужен. Движок не зависит от Discord и
+    используется как кнопками, так и симулятором.
+    """
+    def __init__(self, user_id, bet_amount, shoe: Optional[Shoe] = None):
         self.user_id = user_id
         self.bet_amount = bet_amount
-        self.deck = self.create_deck()
-        self.player = BlackjackHand()
+        self.shoe = shoe or Shoe()
+        # Между раздачами перемешиваем башмак, если вышла подрезная карта
+        if self.shoe.needs_shuffle:
+            self.shoe.shuffle()
+        self.nonce = self.shoe.deal_nonce()   # Позиция раздачи в потоке честного режима
+        self.hands = [BlackjackHand()]        # Руки игрока
+        self.hand_flags = bytearray(1)        # Флаги рук игрока
+        self.active = 0                       # Индекс руки, которой сейчас ходит игрок
+        self.flags = 0                        # Флаги игры (страховка)
         self.dealer = BlackjackHand()
         self.game_over = False
         self.outcome = None
+        self.payout = 0                       # Сумма к выплате после расчета
+        self.channel_id = None                # Канал сообщения с игрой
+        self.message_id = None                # Сообщение с кнопками
+        self.expires_at = 0.0                 # Срок ожидания хода
+    
+    def to_row(self) -> tuple:
+        """Сериализовать незавершенную игру в компактную строку"""
+        return (self.user_id, self.bet_amount, bytes(self.shoe.cards), self.shoe.position,
+                encode_hands(self.hands, self.hand_flags), bytes(self.dealer.cards), self.flags,
+                self.channel_id, self.message_id, self.expires_at)
+    
+    @classmethod
+    def from_row(cls, row) -> "BlackjackGame":
+        """Восстановить игру из компактной строки"""
+        game = cls.__new__(cls)
+        game.user_id = row[0]
+        game.bet_amount = row[1]
+        game.shoe = Shoe(len(row[2]) // len(CARD_NAMES), cards=row[2], position=row[3])
+        game.nonce = None
+        game.hands, game.hand_flags = decode_hands(row[4])
+        game.active = 0
+        game.dealer = BlackjackHand(list(row[5]))
+        game.flags = row[6]
+        game.game_over = False
+        game.outcome = None
+        game.payout = 0
+        game.channel_id = row[7]
+        game.message_id = row[8]
+        game.expires_at = row[9]
+        game._advance()
+        return game
+    
+    @property
+    def current_hand(self) -> BlackjackHand:
+        """Рука, которой сейчас ходит игрок (или последняя рука)"""
+        return self.hands[min(self.active, len(self.hands) - 1)]
+    
+    @property
+    def dealer_turn(self) -> bool:
+        """Все руки игрока завершены, очередь дилера"""
+        return not self.game_over and self.active >= len(self.hands)
+    
+    @property
+    def insurance_amount(self) -> int:
+        """Стоимость страховки"""
+        return self.bet_amount // 2
     
-    @staticmethod
-    def create_deck():
-        """Создать колоду карт"""
-        deck = [Card(suit, value) for suit in SUITS for value in CARD_VALUES]
-        random.shuffle(deck)
-        return deck
+    @property
+    def total_bet(self) -> int:
+        """Сумма всех списанных ставок (руки, удвоения и страховка)"""
+        total = sum(self.bet_amount * 2 if flags & HAND_DOUBLED else self.bet_amount for flags in self.hand_flags)
+        if self.flags & GAME_INSURED:
+            total += self.insurance_amount
+        return total
+    
+    def dealer_has_blackjack(self) -> bool:
+        """Натуральный блэкджек у дилера"""
+        return len(self.dealer.cards) == 2 and self.dealer.value == 21
+    
+    def is_natural(self, index: int) -> bool:
+        """Натуральный блэкджек у руки игрока (не после разделения)"""
+        hand = self.hands[index]
+        return len(hand.cards) == 2 and hand.value == 21 and not self.hand_flags[index] & HAND_SPLIT
     
     def deal_initial_cards(self):
         """Раздать начальные карты"""
-        self.player.add_card(self.deck.pop())
-        self.dealer.add_card(self.deck.pop())
-        self.player.add_card(self.deck.pop())
-        self.dealer.add_card(self.deck.pop())
+        player = self.hands[0]
+        player.add_card(self.shoe.draw())
+        self.dealer.add_card(self.shoe.draw())
+        player.add_card(self.shoe.draw())
+        self.dealer.add_card(self.shoe.draw())
+        
+        # Открытая карта дилера - вторая
+        upcard_points = CARD_POINTS[self.dealer.cards[1]]
         
         # Проверяем на натуральный блэкджек
-        if self.player.value == 21:
-            if self.dealer.value == 21:
-                self.game_over = True
-                self.outcome = GameOutcome.PUSH
-            else:
-                self.game_over = True
-                self.outcome = GameOutcome.BLACKJACK
+        if self.is_natural(0):
+            self.settle()
+        elif upcard_points == 11:
+            # Дилер показал туза: до заглядывания под карту предлагаем страховку
+            self.flags |= GAME_INSURANCE_OPEN
+        elif upcard_points == 10 and self.dealer_has_blackjack():
+            self.settle()
         
         return self.game_over
     
+    def _close_insurance(self) -> bool:
+        """Закрыть окно страховки; дилер проверяет блэкджек"""
+        if self.flags & GAME_INSURANCE_OPEN:
+            self.flags &= ~GAME_INSURANCE_OPEN
+            if self.dealer_has_blackjack():
+                self.settle()
+        return self.game_over
+    
+    def _advance(self):
+        """Перейти к следующей незавершенной руке"""
+        while self.active < len(self.hands) and self.hand_flags[self.active] & HAND_DONE:
+            self.active += 1
+    
+    def _can_act(self) -> bool:
+        """Игрок может ходить текущей рукой (вопрос страховки уже решен)"""
+        return not self.game_over and self.active < len(self.hands) and not self.flags & GAME_INSURANCE_OPEN
+    
+    def can_hit(self) -> bool:
+        """Можно ли взять карту или остановиться"""
+        return self._can_act()
+    
+    def can_double(self) -> bool:
+        """Можно ли удвоить ставку текущей руки"""
+        return (self._can_act() and len(self.current_hand.cards) == 2
+                and not self.hand_flags[self.active] & HAND_SPLIT_ACES)
+    
+    def can_split(self) -> bool:
+        """Можно ли разделить текущую руку"""
+        if not self._can_act() or len(self.hands) >= BLACKJACK_MAX_HANDS:
+            return False
+        cards = self.current_hand.cards
+        if len(cards) != 2 or cards[0] % 13 != cards[1] % 13:
+            return False
+        return BLACKJACK_RESPLIT_ACES or not self.hand_flags[self.active] & HAND_SPLIT_ACES
+    
+    def can_insure(self) -> bool:
+        """Можно ли взять страховку"""
+        return not self.game_over and bool(self.flags & GAME_INSURANCE_OPEN)
+    
+    def can_surrender(self) -> bool:
+        """Можно ли сдаться (только первым ходом, до разделения)"""
+        return self._can_act() and len(self.hands) == 1 and len(self.hands[0].cards) == 2
+    
+    def take_insurance(self):
+        """Взять страховку (стоимость - половина ставки, выплата 2:1)"""
+        self.flags |= GAME_INSURED
+        return self._close_insurance()
+    
+    def decline_insurance(self):
+        """Отказаться от страховки; дилер проверяет блэкджек"""
+        return self._close_insurance()
+    
     def player_hit(self):
         """Игрок берет еще карту"""
-        card = self.deck.pop()
-        self.player.add_card(card)
+        if self._close_insurance():
+            return True
         
-        if self.player.value > 21:
-            self.game_over = True
-            self.outcome = GameOutcome.LOSS
+        hand = self.current_hand
+        hand.add_card(self.shoe.draw())
+        
+        if hand.value > 21:
+            self.hand_flags[self.active] |= HAND_BUST | HAND_DONE
+            self._advance()
+        
+        return self.game_over
+    
+    def player_stand(self):
+        """Игрок останавливается на текущей руке"""
+        if self._close_insurance():
+            return True
+        
+        self.hand_flags[self.active] |= HAND_DONE
+        self._advance()
+        return self.game_over
+    
+    def player_double(self):
+        """Удвоить ставку, взять ровно одну карту и остановиться"""
+        if self._close_insurance():
+            return True
+        
+        hand = self.current_hand
+        hand.add_card(self.shoe.draw())
+        self.hand_flags[self.active] |= HAND_DOUBLED | HAND_DONE
+        if hand.value > 21:
+            self.hand_flags[self.active] |= HAND_BUST
+        self._advance()
+        return self.game_over
+    
+    def player_split(self):
+        """Разделить пару на две руки (каждая получает вторую карту)"""
+        if self._close_insurance():
+            return True
+        
+        first, second = self.current_hand.cards
+        flags = HAND_SPLIT
+        if CARD_POINTS[first] == 11:
+            # Разделенные тузы получают только по одной карте
+            flags |= HAND_SPLIT_ACES
+        
+        self.hands[self.active:self.active + 1] = [
+            BlackjackHand([first, self.shoe.draw()]),
+            BlackjackHand([second, self.shoe.draw()]),
+        ]
+        self.hand_flags[self.active:self.active + 1] = bytes((flags, flags))
         
+        if flags & HAND_SPLIT_ACES:
+            for index in (self.active, self.active + 1):
+                # Пару тузов можно разделить повторно, если это разрешено
+                if not (BLACKJACK_RESPLIT_ACES and self.hands[index].cards[1] % 13 == 0):
+                    self.hand_flags[index] |= HAND_DONE
+            self._advance()
+        return self.game_over
+    
+    def player_surrender(self):
+        """Поздняя сдача: игрок теряет половину ставки"""
+        if self._close_insurance():
+            return True
+        
+        self.hand_flags[self.active] |= HAND_SURRENDERED | HAND_DONE
+        self._advance()
         return self.game_over
     
     def dealer_play(self):
         """Ход дилера (берет карты до 17 или больше)"""
-        while self.dealer.value < 17:
-            self.dealer.add_card(self.deck.pop())
+        # Дилер добирает карты, только если у игрока осталась живая рука
+        if any(not flags & (HAND_BUST | HAND_SURRENDERED) for flags in self.hand_flags):
+            while self.dealer.value < 17:
+                self.dealer.add_card(self.shoe.draw())
         
-        # Определяем результат
-        if self.dealer.value > 21:
-            self.outcome = GameOutcome.WIN
-        elif self.dealer.value > self.player.value:
-            self.outcome = GameOutcome.LOSS
-        elif self.dealer.value < self.player.value:
+        return self.settle()
+    
+    def settle(self):
+        """Рассчитать все руки и страховку за один проход"""
+        dealer_value = self.dealer.value
+        dealer_blackjack = self.dealer_has_blackjack()
+        payout = 0
+        natural = False
+        
+        for index, flags in enumerate(self.hand_flags):
+            bet = self.bet_amount * 2 if flags & HAND_DOUBLED else self.bet_amount
+            value = self.hands[index].value
+            
+            if flags & HAND_SURRENDERED:
+                payout += bet // 2
+            elif flags & HAND_BUST:
+                continue
+            elif self.is_natural(index):
+                if dealer_blackjack:
+                    payout += bet  # Ничья
+                else:
+                    payout += bet * 5 // 2  # Ставка + 150% выигрыш
+                    natural = True
+            elif dealer_blackjack:
+                continue
+            elif dealer_value > 21 or value > dealer_value:
+                payout += bet * 2  # Ставка + 100% выигрыш
+            elif value == dealer_value:
+                payout += bet  # Возврат ставки
+        
+        if self.flags & GAME_INSURED and dealer_blackjack:
+            payout += self.insurance_amount * 3  # Страховка + выплата 2:1
+        
+        total_bet = self.total_bet
+        if natural:
+            self.outcome = GameOutcome.BLACKJACK
+        elif payout > total_bet:
             self.outcome = GameOutcome.WIN
-        else:
+        elif payout == total_bet:
             self.outcome = GameOutcome.PUSH
+        else:
+            self.outcome = GameOutcome.LOSS
         
+        self.payout = payout
+        self.flags &= ~GAME_INSURANCE_OPEN
         self.game_over = True
         return self.outcome
 
 # Хранение активных игр в блэкджек
 active_blackjack_games = {}
+blackjack_views = {}                          # Кнопки активных игр: {user_id: BlackjackView}
+blackjack_shoes = {}                          # Башмаки столов игроков: {user_id: Shoe}
+blackjack_timers = TimerWheel()               # Сроки ожидания хода
+blackjack_shoe_timers = TimerWheel(tick=10.0) # Сроки хранения башмаков без игры
+
+# Через сколько секунд без игры башмак игрока освобождается
+BLACKJACK_SHOE_IDLE = 600
+
+def get_blackjack_shoe(user_id: str) -> Shoe:
+    """Получить башмак стола игрока (используется между раздачами)"""
+    blackjack_shoe_timers.cancel(user_id)
+    shoe = blackjack_shoes.get(user_id)
+    if shoe is None:
+        shoe = blackjack_shoes[user_id] = Shoe()
+    return shoe
+
+def touch_blackjack_game(game: BlackjackGame):
+    """Продлить время на ход и сохранить состояние игры"""
+    game.expires_at = time.time() + BLACKJACK_TURN_TIMEOUT
+    blackjack_timers.schedule(game.user_id, game.expires_at)
+    storage.save_blackjack_session(game)
+
+def finish_blackjack_game(user_id: str) -> Optional[BlackjackGame]:
+    """Убрать игру из активных, удалить ее сессию и таймер"""
+    game = active_blackjack_games.pop(user_id, None)
+    if game is None:
+        return None
+    storage.delete_blackjack_session(user_id)
+    blackjack_timers.cancel(user_id)
+    blackjack_shoe_timers.schedule(user_id, time.time() + BLACKJACK_SHOE_IDLE)
+    view = blackjack_views.pop(user_id, None)
+    if view:
+        view.stop()
+    return game
+
+def cancel_blackjack_game(user_id: str) -> bool:
+    """Отменить активную игру и вернуть списанную ставку"""
+    game = finish_blackjack_game(user_id)
+    if game is None:
+        return False
+    storage.credit_user_balance(user_id, game.total_bet, LedgerEntryType.REFUND)
+    return True
+
+def reseed_blackjack_shoes():
+    """Убрать из башмаков порядок карт, вычисленный по раскрытому сиду
+    
+    Башмаки без активной игры удаляются (новые перемешаются уже новым сидом),
+    в активных играх перемешиваются еще не розданные карты.
+    """
+    for user_id in list(blackjack_shoes):
+        game = active_blackjack_games.get(user_id)
+        if game is None:
+            del blackjack_shoes[user_id]
+        else:
+            game.shoe.shuffle_remaining()
+            game.nonce = game.shoe.deal_nonce()
+            storage.save_blackjack_session(game)
+
+def restore_blackjack_sessions():
+    """Восстановить незавершенные игры после перезапуска бота"""
+    for game in storage.load_blackjack_sessions():
+        # Сид, которым перемешан сохраненный башмак, раскрывается при запуске
+        game.shoe.shuffle_remaining()
+        game.nonce = game.shoe.deal_nonce()
+        storage.save_blackjack_session(game)
+        active_blackjack_games[game.user_id] = game
+        blackjack_shoes[game.user_id] = game.shoe
+        blackjack_timers.schedule(game.user_id, game.expires_at)
+        if game.message_id:
+            view = BlackjackView(game)
+            blackjack_views[game.user_id] = view
+            bot.add_view(view, message_id=game.message_id)
+    print(f"Restored {len(active_blackjack_games)} blackjack session(s)")
+
+@tasks.loop(seconds=1)
+async def reap_blackjack_sessions():
+    """Отменить игры, в которых игрок не сделал ход вовремя, и освободить простаивающие башмаки"""
+    now = time.time()
+    for user_id in blackjack_shoe_timers.advance(now):
+        if user_id not in active_blackjack_games:
+            blackjack_shoes.pop(user_id, None)
+    
+    for user_id in blackjack_timers.advance(now):
+        game = active_blackjack_games.get(user_id)
+        if game is None or not cancel_blackjack_game(user_id) or not game.message_id:
+            continue
+        
+        queue_message_edit(
+            game.channel_id,
+            game.message_id,
+            embed=create_embed(
+                title="Время вышло",
+                description="Вы слишком долго думали над ходом. Игра отменена, ставка возвращена.",
+                color=0xED4245  # Красный
+            ),
+            view=None
+        )
+
+def blackjack_hand_fields(game: BlackjackGame, reveal_dealer: bool = False) -> List[Dict[str, Any]]:
+    """Поля embed с руками дилера и игрока"""
+    fields = [{"name": "Рука дилера", "value": game.dealer.format(hide_first_card=not reveal_dealer), "inline": False}]
+    
+    if len(game.hands) == 1:
+        value = game.hands[0].format()
+        if game.hand_flags[0] & HAND_DOUBLED:
+            value += " • x2"
+        elif game.hand_flags[0] & HAND_SURRENDERED:
+            value += " • сдача"
+        fields.append({"name": "Ваша рука", "value": value, "inline": False})
+        return fields
+    
+    for index, hand in enumerate(game.hands):
+        name = f"Рука {index + 1}"
+        if index == game.active and not game.game_over:
+            name += " ▶"
+        value = hand.format()
+        if game.hand_flags[index] & HAND_DOUBLED:
+            value += " • x2"
+        fields.append({"name": name, "value": value, "inline": False})
+    return fields
+
+def blackjack_turn_embed(game: BlackjackGame) -> discord.Embed:
+    """Embed с текущим состоянием игры, пока игрок делает ход"""
+    description = f"Вы поставили **{format_number(game.total_bet)}** монет."
+    if game.can_insure():
+        description += (f"\nДилер показывает туза. Возьмите страховку за **{format_number(game.insurance_amount)}** монет " +
+                        "или откажитесь от нее, прежде чем ходить дальше.")
+    
+    return create_embed(
+        title="Блэкджек",
+        description=description,
+        color=0xFFD700,  # Золотой
+        fields=blackjack_hand_fields(game),
+        footer="PutinZov Casino | Блэкджек - Еще карту или хватит?"
+    )
+
+class BlackjackView(discord.ui.View):
+    """Кнопки хода в блэкджеке
+    
+    discord.py находит представление по ID сообщения и custom_id кнопки,
+    поэтому нажатие обрабатывается без перебора всех активных игр.
+    Представление не имеет собственного таймаута: сроки ходов отслеживает
+    общее колесо таймеров, а после перезапуска кнопки регистрируются заново.
+    """
+    def __init__(self, game: BlackjackGame):
+        super().__init__(timeout=None)
+        self.game = game
+        self.refresh()
+    
+    def refresh(self):
+        """Отключить кнопки действий, недоступных в текущем состоянии"""
+        self.hit.disabled = not self.game.can_hit()
+        self.stand.disabled = not self.game.can_hit()
+        self.double.disabled = not self.game.can_double()
+        self.split.disabled = not self.game.can_split()
+        self.insurance.disabled = not self.game.can_insure()
+        self.no_insurance.disabled = not self.game.can_insure()
+        self.surrender.disabled = not self.game.can_surrender()
+    
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        """Кнопки доступны только игроку"""
+        if str(interaction.user.id) != self.game.user_id:
+            await send_response(
+                interaction,
+                content="Это не ваша игра!",
+                ephemeral=True
+            )
+            return False
+        if active_blackjack_games.get(self.game.user_id) is not self.game:
+            self.stop()
+            await send_response(
+                interaction,
+                content="Эта игра уже завершена!",
+                ephemeral=True
+            )
+            return False
+        return True
+    
+    @discord.ui.button(label="Еще карту", style=discord.ButtonStyle.primary, custom_id="blackjack:hit")
+    async def hit(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Игрок берет еще карту"""
+        await handle_blackjack_action(interaction, self, self.game.can_hit(), self.game.player_hit)
+    
+    @discord.ui.button(label="Хватит", style=discord.ButtonStyle.secondary, custom_id="blackjack:stand")
+    async def stand(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Игрок останавливается"""
+        await handle_blackjack_action(interaction, self, self.game.can_hit(), self.game.player_stand)
+    
+    @discord.ui.button(label="Удвоить", style=discord.ButtonStyle.success, custom_id="blackjack:double")
+    async def double(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Игрок удваивает ставку и берет одну карту"""
+        await handle_blackjack_action(interaction, self, self.game.can_double(), self.game.player_double,
+                                      self.game.bet_amount)
+    
+    @discord.ui.button(label="Разделить", style=discord.ButtonStyle.success, custom_id="blackjack:split")
+    async def split(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Игрок разделяет пару"""
+        await handle_blackjack_action(interaction, self, self.game.can_split(), self.game.player_split,
+                                      self.game.bet_amount)
+    
+    @discord.ui.button(label="Страховка", style=discord.ButtonStyle.secondary, custom_id="blackjack:insurance")
+    async def insurance(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Игрок страхуется от блэкджека дилера"""
+        await handle_blackjack_action(interaction, self, self.game.can_insure(), self.game.take_insurance,
+                                      self.game.insurance_amount)
+    
+    @discord.ui.button(label="Без страховки", style=discord.ButtonStyle.secondary, custom_id="blackjack:no_insurance")
+    async def no_insurance(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Игрок отказывается от страховки"""
+        await handle_blackjack_action(interaction, self, self.game.can_insure(), self.game.decline_insurance)
+    
+    @discord.ui.button(label="Сдаться", style=discord.ButtonStyle.danger, custom_id="blackjack:surrender")
+    async def surrender(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Игрок сдается и получает половину ставки"""
+        await handle_blackjack_action(interaction, self, self.game.can_surrender(), self.game.player_surrender)
 
 @bot.tree.command(name="blackjack", description="Сыграть в блэкджек")
 @app_commands.describe(amount="Размер ставки (мин. 10)")
@@ -854,7 +3572,8 @@ async def blackjack(interaction: discord.Interaction, amount: int):
     """Команда для игры в блэкджек"""
     try:
         if amount < 10:
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 content="Минимальная ставка - 10 монет!",
                 ephemeral=True
             )
@@ -864,7 +3583,8 @@ async def blackjack(interaction: discord.Interaction, amount: int):
         
         # Проверяем, не играет ли уже пользователь
         if user_id in active_blackjack_games:
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 content="У вас уже есть активная игра в блэкджек!",
                 ephemeral=True
             )
@@ -883,20 +3603,20 @@ async def blackjack(interaction: discord.Interaction, amount: int):
                 is_admin=False
             )
         
-        # Проверяем, достаточно ли средств
-        if user.balance < amount:
-            await interaction.response.send_message(
-                embed=create_embed(
-                    title="Недостаточно средств",
-                    description=f"У вас только **{format_number(user.balance)}** монет, но вы ставите **{format_number(amount)}** монет.",
-                    color=0xED4245  # Красный
+        # Атомарно списываем ставку
+        if not storage.debit_user_balance(user_id, amount):
+            await send_response(
+                interaction,
+                embed=INSUFFICIENT_FUNDS_EMBED.render(
+                    balance=format_number(user.balance),
+                    amount=format_number(amount)
                 ),
                 ephemeral=True
             )
             return
         
         # Создаем игру
-        game = BlackjackGame(user_id, amount)
+        game = BlackjackGame(user_id, amount, get_blackjack_shoe(user_id))
         active_blackjack_games[user_id] = game
         
         # Раздаем начальные карты
@@ -907,168 +3627,164 @@ async def blackjack(interaction: discord.Interaction, amount: int):
             await handle_blackjack_end(interaction, game)
             return
         
-        # Создаем кнопки для хода и стойки
-        hit_button = discord.ui.Button(style=discord.ButtonStyle.primary, label="Еще карту", custom_id="hit")
-        stand_button = discord.ui.Button(style=discord.ButtonStyle.secondary, label="Хватит", custom_id="stand")
+        # Сохраняем сессию и запускаем таймер сразу после списания ставки, до запросов
+        # к Discord: при перезапуске в этот момент ставка вернется вместе с сессией
+        game.channel_id = interaction.channel_id
+        touch_blackjack_game(game)
         
-        view = discord.ui.View()
-        view.add_item(hit_button)
-        view.add_item(stand_button)
+        # Создаем кнопки для хода
+        view = BlackjackView(game)
+        blackjack_views[user_id] = view
         
         # Отправляем начальное состояние игры
-        embed = create_embed(
-            title="Блэкджек",
-            description=f"Вы поставили **{format_number(amount)}** монет.",
-            color=0xFFD700,  # Золотой
-            fields=[
-                {"name": "Рука дилера", "value": game.dealer.format(hide_first_card=True), "inline": False},
-                {"name": "Ваша рука", "value": game.player.format(), "inline": False}
-            ],
-            footer="PutinZov Casino | Блэкджек - Еще карту или хватит?"
-        )
-        
-        await interaction.response.send_message(embed=embed, view=view)
+        await send_response(interaction, embed=blackjack_turn_embed(game), view=view)
+        message = await fetch_response(interaction)
         
-        # Ожидаем взаимодействия с кнопками
-        def check(interaction_check):
-            return interaction_check.user.id == interaction.user.id and \
-                   interaction_check.data.get("custom_id") in ["hit", "stand"]
-        
-        try:
-            # Ожидаем действие пользователя (60 секунд таймаут)
-            button_interaction = await bot.wait_for("interaction", check=check, timeout=60.0)
-            
-            # Обрабатываем ход
-            if button_interaction.data.get("custom_id") == "hit":
-                await handle_blackjack_hit(button_interaction, game, view)
-            elif button_interaction.data.get("custom_id") == "stand":
-                await handle_blackjack_stand(button_interaction, game)
-        
-        except asyncio.TimeoutError:
-            # Если пользователь не ответил вовремя
-            if user_id in active_blackjack_games:
-                del active_blackjack_games[user_id]
-                
-            await interaction.followup.send(
-                embed=create_embed(
-                    title="Время вышло",
-                    description="Вы слишком долго думали над ходом. Игра отменена, ставка возвращена.",
-                    color=0xED4245  # Красный
-                )
-            )
+        # Дописываем в сессию сообщение с кнопками
+        game.message_id = message.id
+        storage.save_blackjack_session(game)
     
     except Exception as e:
         print(f"Error executing blackjack command: {e}")
-        await interaction.response.send_message(
+        command_metrics.record_error(interaction)
+        cancel_blackjack_game(str(interaction.user.id))
+        await send_response(
+            interaction,
             content="Произошла ошибка при запуске игры в блэкджек!",
             ephemeral=True
         )
 
-async def handle_blackjack_hit(interaction: discord.Interaction, game: BlackjackGame, view: discord.ui.View):
-    """Обработчик нажатия кнопки 'Еще карту'"""
+async def handle_blackjack_action(interaction: discord.Interaction, view: BlackjackView, allowed: bool,
+                                  action, cost: int = 0):
+    """Обработчик хода игрока (еще карту, хватит, удвоение, разделение, страховка, сдача)"""
     try:
-        # Игрок берет еще карту
-        result = game.player_hit()
+        game = view.game
         
-        # Если игрок перебрал (bust)
-        if result:
-            await handle_blackjack_end(interaction, game)
+        if not allowed:
+            await send_response(
+                interaction,
+                content="Сейчас это действие недоступно!",
+                ephemeral=True
+            )
             return
         
-        # Обновляем информацию о игре
-        embed = create_embed(
-            title="Блэкджек",
-            description=f"Вы поставили **{format_number(game.bet_amount)}** монет.",
-            color=0xFFD700,  # Золотой
-            fields=[
-                {"name": "Рука дилера", "value": game.dealer.format(hide_first_card=True), "inline": False},
-                {"name": "Ваша рука", "value": game.player.format(), "inline": False}
-            ],
-            footer="PutinZov Casino | Блэкджек - Еще карту или хватит?"
-        )
+        # Удвоение, разделение и страховка требуют дополнительной ставки
+        if cost and not storage.debit_user_balance(game.user_id, cost):
+            user = storage.get_user(game.user_id)
+            await send_response(
+                interaction,
+                embed=INSUFFICIENT_FUNDS_ACTION_EMBED.render(
+                    balance=format_number(user.balance if user else 0),
+                    amount=format_number(cost)
+                ),
+                ephemeral=True
+            )
+            return
         
-        await interaction.response.edit_message(embed=embed, view=view)
+        action()
         
-        # Ожидаем следующее взаимодействие с кнопками
-        def check(interaction_check):
-            return interaction_check.user.id == interaction.user.id and \
-                   interaction_check.data.get("custom_id") in ["hit", "stand"]
+        # Игра закончилась или все руки сыграны
+        if game.game_over or game.dealer_turn:
+            view.stop()
+            blackjack_timers.cancel(game.user_id)
+            if game.game_over:
+                await handle_blackjack_end(interaction, game)
+            else:
+                await handle_blackjack_dealer_turn(interaction, game)
+            return
         
-        try:
-            # Ожидаем действие пользователя (60 секунд таймаут)
-            button_interaction = await bot.wait_for("interaction", check=check, timeout=60.0)
-            
-            # Обрабатываем ход
-            if button_interaction.data.get("custom_id") == "hit":
-                await handle_blackjack_hit(button_interaction, game, view)
-            elif button_interaction.data.get("custom_id") == "stand":
-                await handle_blackjack_stand(button_interaction, game)
-        
-        except asyncio.TimeoutError:
-            # Если пользователь не ответил вовремя
-            if game.user_id in active_blackjack_games:
-                del active_blackjack_games[game.user_id]
-                
-            await interaction.followup.send(
-                embed=create_embed(
-                    title="Время вышло",
-                    description="Вы слишком долго думали над ходом. Игра отменена, ставка возвращена.",
-                    color=0xED4245  # Красный
-                )
-            )
+        touch_blackjack_game(game)
+        
+        # Обновляем информацию о игре
+        view.refresh()
+        await edit_response(interaction, embed=blackjack_turn_embed(game), view=view)
     
     except Exception as e:
-        print(f"Error in handle_blackjack_hit: {e}")
-        await interaction.response.send_message(
+        print(f"Error in handle_blackjack_action: {e}")
+        await send_response(
+            interaction,
             content="Произошла ошибка при обработке хода!",
             ephemeral=True
         )
 
-async def handle_blackjack_stand(interaction: discord.Interaction, game: BlackjackGame):
-    """Обработчик нажатия кнопки 'Хватит'"""
+async def handle_blackjack_dealer_turn(interaction: discord.Interaction, game: BlackjackGame):
+    """Ход дилера после того, как игрок сыграл все руки"""
     try:
         # Отправляем сообщение о том, что игрок решил остановиться
         embed = create_embed(
             title="Блэкджек",
-            description=f"Вы поставили **{format_number(game.bet_amount)}** монет и решили остановиться.",
+            description=f"Вы поставили **{format_number(game.total_bet)}** монет и решили остановиться.",
             color=0xFFD700,  # Золотой
-            fields=[
-                {"name": "Рука дилера", "value": game.dealer.format(), "inline": False},
-                {"name": "Ваша рука", "value": game.player.format(), "inline": False}
-            ],
+            fields=blackjack_hand_fields(game, reveal_dealer=True),
             footer="PutinZov Casino | Блэкджек - Ход дилера"
         )
         
-        await interaction.response.edit_message(embed=embed, view=None)
-        
-        # Ход дилера
-        await asyncio.sleep(1)  # Пауза для драматического эффекта
+        # Ход дилера и расчет выполняются сразу, до любых запросов к Discord:
+        # ошибка отображения не должна оставить выплату незачисленной
         game.dealer_play()
+        user = settle_blackjack_game(game)
         
-        # Завершаем игру
-        await handle_blackjack_end(interaction, game)
+        await edit_response(interaction, embed=embed, view=None)
+        
+        # Итог покажется после паузы
+        await show_blackjack_result(interaction, game, user, delay=BLACKJACK_DEALER_DELAY)
     
     except Exception as e:
-        print(f"Error in handle_blackjack_stand: {e}")
-        await interaction.followup.send(
+        print(f"Error in handle_blackjack_dealer_turn: {e}")
+        queue_followup(
+            interaction,
             content="Произошла ошибка при обработке хода дилера!",
             ephemeral=True
         )
 
+def settle_blackjack_game(game: BlackjackGame) -> Optional[User]:
+    """Рассчитать завершенную игру: убрать из активных, зачислить выплату, записать историю"""
+    user_id = game.user_id
+    
+    # Удаляем игру из активных
+    finish_blackjack_game(user_id)
+    
+    # Получаем пользователя из хранилища
+    user = storage.get_user(user_id)
+    if not user:
+        return None
+    
+    # Ставки уже списаны по ходу игры, выплата рассчитана движком по всем рукам
+    if game.payout:
+        storage.credit_user_balance(user_id, game.payout)
+    
+    # Добавляем запись в историю игр
+    storage.add_game_history(
+        user_id=user_id,
+        game_type=GameType.BLACKJACK,
+        bet_amount=game.total_bet,
+        outcome=game.outcome,
+        payout=game.payout,
+        nonce=game.nonce
+    )
+    return user
+
 async def handle_blackjack_end(interaction: discord.Interaction, game: BlackjackGame):
     """Обработчик завершения игры в блэкджек"""
     try:
-        user_id = game.user_id
-        
-        # Удаляем игру из активных
-        if user_id in active_blackjack_games:
-            del active_blackjack_games[user_id]
-        
-        # Получаем пользователя из хранилища
-        user = storage.get_user(user_id)
-        
+        user = settle_blackjack_game(game)
+    except Exception as e:
+        print(f"Error in handle_blackjack_end: {e}")
+        queue_followup(
+            interaction,
+            content="Произошла ошибка при обработке результатов игры!",
+            ephemeral=True
+        )
+        return
+    await show_blackjack_result(interaction, game, user)
+
+async def show_blackjack_result(interaction: discord.Interaction, game: BlackjackGame,
+                                user: Optional[User], delay: float = 0):
+    """Показать итог рассчитанной игры (delay - через сколько)"""
+    try:
         if not user:
-            await interaction.followup.send(
+            queue_followup(
+                interaction,
                 content="Ошибка: пользователь не найден!",
                 ephemeral=True
             )
@@ -1078,71 +3794,53 @@ async def handle_blackjack_end(interaction: discord.Interaction, game: Blackjack
         result_title = ""
         result_description = ""
         result_color = 0
-        win_amount = 0
         
-        # Вычитаем ставку из баланса пользователя
-        new_balance = user.balance - game.bet_amount
+        total_bet = game.total_bet
+        win_amount = game.payout
         
-        # Рассчитываем выигрыш в зависимости от результата
         if game.outcome == GameOutcome.WIN:
-            win_amount = game.bet_amount * 2  # Ставка + 100% выигрыш
-            new_balance += win_amount
             result_title = "Вы выиграли!"
-            result_description = f"Вы выиграли **{format_number(game.bet_amount)}** монет!"
+            result_description = f"Вы выиграли **{format_number(win_amount - total_bet)}** монет!"
             result_color = 0x57F287  # Зеленый
         
         elif game.outcome == GameOutcome.BLACKJACK:
-            win_amount = int(game.bet_amount * 2.5)  # Ставка + 150% выигрыш
-            new_balance += win_amount
             result_title = "Блэкджек!"
-            result_description = f"У вас блэкджек! Вы выиграли **{format_number(win_amount - game.bet_amount)}** монет!"
+            result_description = f"У вас блэкджек! Вы выиграли **{format_number(win_amount - total_bet)}** монет!"
             result_color = 0x5865F2  # Синий Discord
         
         elif game.outcome == GameOutcome.PUSH:
-            win_amount = game.bet_amount  # Возврат ставки
-            new_balance += win_amount
             result_title = "Ничья"
             result_description = "Ничья! Ваша ставка возвращена."
             result_color = 0xFFD700  # Золотой
         
         elif game.outcome == GameOutcome.LOSS:
             result_title = "Вы проиграли"
-            result_description = f"Вы проиграли **{format_number(game.bet_amount)}** монет."
+            result_description = f"Вы проиграли **{format_number(total_bet - win_amount)}** монет."
             result_color = 0xED4245  # Красный
         
-        # Обновляем баланс пользователя
-        storage.update_user_balance(user_id, new_balance)
-        
-        # Добавляем запись в историю игр
-        storage.add_game_history(
-            user_id=user_id,
-            game_type=GameType.BLACKJACK,
-            bet_amount=game.bet_amount,
-            outcome=game.outcome,
-            win_amount=0 if win_amount == 0 else win_amount - game.bet_amount  # Записываем только чистый выигрыш
-        )
+        new_balance = user.balance
         
         # Создаем embed с результатом
         embed = create_embed(
             title=result_title,
             description=f"{result_description}\nВаш новый баланс: **{format_number(new_balance)}** монет.",
             color=result_color,
-            fields=[
-                {"name": "Рука дилера", "value": game.dealer.format(), "inline": False},
-                {"name": "Ваша рука", "value": game.player.format(), "inline": False}
-            ],
-            footer="PutinZov Casino | Блэкджек"
+            fields=blackjack_hand_fields(game, reveal_dealer=True),
+            footer=fair_footer("PutinZov Casino | Блэкджек", game.nonce)
         )
         
         # Отправляем результат
-        if interaction.response.is_done():
-            await interaction.edit_original_response(embed=embed, view=None)
+        if delay:
+            schedule_response_edit(interaction, embed, delay)
+        elif interaction.response.is_done():
+            queue_response_edit(interaction, embed=embed, view=None)
         else:
-            await interaction.response.send_message(embed=embed)
+            await send_response(interaction, embed=embed)
     
     except Exception as e:
-        print(f"Error in handle_blackjack_end: {e}")
-        await interaction.followup.send(
+        print(f"Error in show_blackjack_result: {e}")
+        queue_followup(
+            interaction,
             content="Произошла ошибка при обработке результатов игры!",
             ephemeral=True
         )
@@ -1151,27 +3849,143 @@ async def handle_blackjack_end(interaction: discord.Interaction, game: Blackjack
 # КОМАНДЫ СЛОТОВ
 #########################
 
-# Определение символов слотов и их значений
+# Определение символов слотов, их значений и веса на барабане
 SLOT_SYMBOLS = [
-    {"name": "🍒", "value": 1},   # Вишня
-    {"name": "🍋", "value": 2},   # Лимон
-    {"name": "🍊", "value": 3},   # Апельсин
-    {"name": "🍇", "value": 4},   # Виноград
-    {"name": "🔔", "value": 5},   # Колокольчик
-    {"name": "💎", "value": 6},   # Бриллиант
-    {"name": "7️⃣", "value": 7}    # Семерка
+    {"name": "🍒", "value": 1, "weight": 10},   # Вишня
+    {"name": "🍋", "value": 2, "weight": 9},    # Лимон
+    {"name": "🍊", "value": 3, "weight": 8},    # Апельсин
+    {"name": "🍇", "value": 4, "weight": 6},    # Виноград
+    {"name": "🔔", "value": 5, "weight": 4},    # Колокольчик
+    {"name": "💎", "value": 6, "weight": 2},    # Бриллиант
+    {"name": "7️⃣", "value": 7, "weight": 1}     # Семерка
 ]
+SLOT_JACKPOT_SYMBOL = 6                       # Индекс семерки
+SLOTS_SPIN_DELAY = 1.5                        # Длительность показа вращения (секунд)
 
-# Таблица выплат
-SLOTS_PAYOUTS = {
-    "🍒🍒🍒": {"multiplier": 5, "outcome": GameOutcome.SMALL_WIN},
-    "🍋🍋🍋": {"multiplier": 8, "outcome": GameOutcome.SMALL_WIN},
-    "🍊🍊🍊": {"multiplier": 10, "outcome": GameOutcome.MEDIUM_WIN},
-    "🍇🍇🍇": {"multiplier": 15, "outcome": GameOutcome.MEDIUM_WIN},
-    "🔔🔔🔔": {"multiplier": 20, "outcome": GameOutcome.BIG_WIN},
-    "💎💎💎": {"multiplier": 30, "outcome": GameOutcome.BIG_WIN},
-    "7️⃣7️⃣7️⃣": {"multiplier": 50, "outcome": GameOutcome.JACKPOT},
-}
+# Ленты барабанов: порядок символов (индексы SLOT_SYMBOLS) сверху вниз.
+# В окне видно три соседние позиции ленты, центральная выбирается по весу символа.
+SLOT_REEL_STRIPS = (
+    (0, 1, 2, 3, 4, 5, 6),
+    (0, 2, 4, 6, 1, 3, 5),
+    (0, 3, 6, 2, 5, 1, 4),
+)
+
+# Линии выплат: строка окна (0 - верх, 1 - центр, 2 - низ) для каждого барабана
+SLOT_PAYLINES = (
+    (1, 1, 1),                                # Центральная
+    (0, 0, 0),                                # Верхняя
+    (2, 2, 2),                                # Нижняя
+    (0, 1, 2),                                # Диагональ вниз
+    (2, 1, 0),                                # Диагональ вверх
+)
+SLOT_PAYLINE_NAMES = ("центр", "верх", "низ", "диагональ ↘", "диагональ ↗")
+
+# Таблица выплат в десятых долях ставки за линию:
+# (два одинаковых символа слева, три в линию) для каждого символа
+SLOT_PAY_UNIT = 10
+SLOT_PAYTABLE = (
+    (2, 12),                                  # 🍒
+    (1, 18),                                  # 🍋
+    (1, 25),                                  # 🍊
+    (2, 40),                                  # 🍇
+    (3, 60),                                  # 🔔
+    (5, 120),                                 # 💎
+    (10, 350),                                # 7️⃣
+)
+
+class AliasTable:
+    """Таблица псевдонимов (метод Воуза) для выборки по весам за O(1)"""
+    def __init__(self, weights: List[int]):
+        count = len(weights)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        self.prob = [1.0] * count
+        self.alias = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+    
+    def sample(self, source: random.Random) -> int:
+        """Выбрать индекс с вероятностью, пропорциональной весу"""
+        index = source.randrange(len(self.prob))
+        return index if source.random() < self.prob[index] else self.alias[index]
+
+def slot_stop_weights(reel: int) -> List[int]:
+    """Вес каждой позиции ленты барабана"""
+    return [SLOT_SYMBOLS[symbol]["weight"] for symbol in SLOT_REEL_STRIPS[reel]]
+
+def slot_line_pay(first: int, second: int, third: int) -> int:
+    """Выплата линии (в десятых долях ставки) по символам слева направо"""
+    two_pay, three_pay = SLOT_PAYTABLE[first]
+    if first == second == third:
+        return three_pay
+    if first == second:
+        return two_pay
+    return 0
+
+# Выплаты всех комбинаций линии, индекс - first * 49 + second * 7 + third
+SLOT_LINE_PAYS = tuple(
+    slot_line_pay(first, second, third)
+    for first in range(len(SLOT_SYMBOLS))
+    for second in range(len(SLOT_SYMBOLS))
+    for third in range(len(SLOT_SYMBOLS))
+)
+SLOT_REEL_ALIASES = tuple(AliasTable(slot_stop_weights(reel)) for reel in range(len(SLOT_REEL_STRIPS)))
+
+def spin_slot_reels() -> Tuple[int, ...]:
+    """Вращение барабанов: позиция остановки каждой ленты"""
+    source = rng.stream(GameType.SLOTS.value)
+    return tuple(alias.sample(source) for alias in SLOT_REEL_ALIASES)
+
+def get_slot_window(stops: Tuple[int, ...]) -> List[Tuple[int, int, int]]:
+    """Видимое окно: для каждого барабана символы верхней, центральной и нижней строк"""
+    window = []
+    for strip, stop in zip(SLOT_REEL_STRIPS, stops):
+        size = len(strip)
+        window.append((strip[(stop - 1) % size], strip[stop], strip[(stop + 1) % size]))
+    return window
+
+def get_slot_line_wins(stops: Tuple[int, ...]) -> List[Tuple[int, int]]:
+    """Выигрышные линии: [(номер линии, выплата в десятых долях ставки)]"""
+    first, second, third = get_slot_window(stops)
+    wins = []
+    for line, (row_1, row_2, row_3) in enumerate(SLOT_PAYLINES):
+        pay = SLOT_LINE_PAYS[first[row_1] * 49 + second[row_2] * 7 + third[row_3]]
+        if pay:
+            wins.append((line, pay))
+    return wins
+
+def get_slots_rtp() -> float:
+    """Точный RTP слотов: перебор всех остановок барабанов с их весами"""
+    reel_weights = [slot_stop_weights(reel) for reel in range(len(SLOT_REEL_STRIPS))]
+    total_weight = math.prod(sum(weights) for weights in reel_weights)
+    expected = 0
+    for stops in product(*(range(len(strip)) for strip in SLOT_REEL_STRIPS)):
+        weight = math.prod(weights[stop] for weights, stop in zip(reel_weights, stops))
+        expected += weight * sum(pay for _, pay in get_slot_line_wins(stops))
+    return expected / total_weight / SLOT_PAY_UNIT
+
+def get_slots_outcome(line_wins: List[Tuple[int, int]]) -> GameOutcome:
+    """Тип результата по выигрышным линиям (победа - только если выплата больше ставки)"""
+    pay_units = sum(pay for _, pay in line_wins)
+    if any(pay == SLOT_PAYTABLE[SLOT_JACKPOT_SYMBOL][1] for _, pay in line_wins):
+        return GameOutcome.JACKPOT
+    if pay_units >= 10 * SLOT_PAY_UNIT:
+        return GameOutcome.BIG_WIN
+    if pay_units >= 3 * SLOT_PAY_UNIT:
+        return GameOutcome.MEDIUM_WIN
+    if pay_units > SLOT_PAY_UNIT:
+        return GameOutcome.SMALL_WIN
+    if pay_units == SLOT_PAY_UNIT:
+        return GameOutcome.PUSH
+    if pay_units > 0:
+        return GameOutcome.PARTIAL_RETURN
+    return GameOutcome.NO_MATCH
 
 @bot.tree.command(name="slots", description="Сыграть в слоты")
 @app_commands.describe(amount="Размер ставки (мин. 10)")
@@ -1179,7 +3993,8 @@ async def slots(interaction: discord.Interaction, amount: int):
     """Команда для игры в слоты"""
     try:
         if amount < 10:
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 content="Минимальная ставка - 10 монет!",
                 ephemeral=True
             )
@@ -1200,48 +4015,34 @@ async def slots(interaction: discord.Interaction, amount: int):
                 is_admin=False
             )
         
-        # Проверяем, достаточно ли средств
-        if user.balance < amount:
-            await interaction.response.send_message(
-                embed=create_embed(
-                    title="Недостаточно средств",
-                    description=f"У вас только **{format_number(user.balance)}** монет, но вы ставите **{format_number(amount)}** монет.",
-                    color=0xED4245  # Красный
+        # Атомарно списываем ставку
+        if not storage.debit_user_balance(user_id, amount):
+            await send_response(
+                interaction,
+                embed=INSUFFICIENT_FUNDS_EMBED.render(
+                    balance=format_number(user.balance),
+                    amount=format_number(amount)
                 ),
                 ephemeral=True
             )
             return
         
-        # Откладываем ответ, чтобы показать "бот думает" во время вращения
-        await interaction.response.defer()
-        
-        # Имитируем вращение слотов
-        await asyncio.sleep(1.5)
-        
-        # Генерируем результат
-        reels = []
-        for _ in range(3):
-            symbol_index = get_random_int(0, len(SLOT_SYMBOLS) - 1)
-            reels.append(SLOT_SYMBOLS[symbol_index]["name"])
+        # Генерируем результат сразу, вращение только показывается
+        nonce = rng.position(GameType.SLOTS.value)
+        stops = spin_slot_reels()
         
-        # Проверяем выигрыш
-        reel_string = "".join(reels)
-        win_data = SLOTS_PAYOUTS.get(reel_string)
+        # Проверяем выигрыш по всем линиям
+        line_wins = get_slot_line_wins(stops)
+        pay_units = sum(pay for _, pay in line_wins)
+        win_amount = amount * pay_units // SLOT_PAY_UNIT
+        outcome = get_slots_outcome(line_wins)
+        is_win = outcome in (GameOutcome.SMALL_WIN, GameOutcome.MEDIUM_WIN, GameOutcome.BIG_WIN, GameOutcome.JACKPOT)
         
-        is_win = win_data is not None
-        win_amount = 0
-        outcome = GameOutcome.NO_MATCH
+        # Ставка уже списана, зачисляем выплату (в том числе частичный возврат)
+        if win_amount:
+            storage.credit_user_balance(user_id, win_amount)
         
-        # Вычитаем ставку из баланса
-        new_balance = user.balance - amount
-        
-        if is_win:
-            win_amount = amount * win_data["multiplier"]
-            outcome = win_data["outcome"]
-            new_balance += win_amount
-        
-        # Обновляем баланс пользователя
-        storage.update_user_balance(user_id, new_balance)
+        new_balance = user.balance
         
         # Добавляем запись в историю игр
         storage.add_game_history(
@@ -1249,14 +4050,18 @@ async def slots(interaction: discord.Interaction, amount: int):
             game_type=GameType.SLOTS,
             bet_amount=amount,
             outcome=outcome,
-            win_amount=win_amount - amount if is_win else 0  # Записываем только чистый выигрыш
+            payout=win_amount,
+            nonce=nonce
         )
         
         # Создаем визуальное отображение слотов
-        slot_display = f"""
-╔═════╦═════╦═════╗
-║  {reels[0]}  ║  {reels[1]}  ║  {reels[2]}  ║
-╚═════╩═════╩═════╝"""
+        window = get_slot_window(stops)
+        rows = [
+            "║" + "║".join(f"  {SLOT_SYMBOLS[reel[row]]['name']}  " for reel in window) + "║"
+            for row in range(3)
+        ]
+        slot_display = "\n╔═════╦═════╦═════╗\n" + "\n╠═════╬═════╬═════╣\n".join(rows) + "\n╚═════╩═════╩═════╝"
+        lines_display = ", ".join(f"{SLOT_PAYLINE_NAMES[line]} {pay / SLOT_PAY_UNIT:g}x" for line, pay in line_wins)
         
         # Определяем заголовок и цвет в зависимости от результата
         result_title = ""
@@ -1278,10 +4083,23 @@ async def slots(interaction: discord.Interaction, amount: int):
             else:
                 result_title = "Вы выиграли!"
                 result_color = 0x57F287  # Зеленый
+        elif outcome == GameOutcome.PUSH:
+            result_title = "Ставка возвращена"
+            result_color = 0xFFD700  # Золотой
+        elif outcome == GameOutcome.PARTIAL_RETURN:
+            result_title = "Частичный возврат"
+            result_color = 0xE67E22  # Оранжевый
         else:
             result_title = "Нет совпадений"
             result_color = 0xED4245  # Красный
         
+        if is_win:
+            result_text = f"🎉 Вы выиграли **{format_number(win_amount)}** монет! (линии: {lines_display})"
+        elif win_amount:
+            result_text = f"↩️ Возвращено **{format_number(win_amount)}** из **{format_number(amount)}** монет (линии: {lines_display})"
+        else:
+            result_text = f"❌ Вы проиграли **{format_number(amount)}** монет."
+        
         # Создаем embed с результатом
         embed = create_embed(
             title=f"Слоты - {result_title}",
@@ -1290,20 +4108,124 @@ async def slots(interaction: discord.Interaction, amount: int):
             fields=[
                 {
                     "name": "Результат",
-                    "value": "🎉 Вы выиграли " + f"**{format_number(win_amount)}** монет! ({win_data['multiplier']}x множитель)" if is_win else f"❌ Вы проиграли **{format_number(amount)}** монет.",
+                    "value": result_text,
                     "inline": False
                 },
                 {"name": "Новый баланс", "value": f"**{format_number(new_balance)}** монет", "inline": False}
             ],
-            footer="PutinZov Casino | Слоты"
+            footer=fair_footer("PutinZov Casino | Слоты", nonce)
         )
         
-        await interaction.followup.send(embed=embed)
+        # Показываем вращение, итог появится по расписанию
+        await send_response(
+            interaction,
+            embed=create_embed(
+                title="Слоты",
+                description=f"🎰 Барабаны вращаются...\n\nВы поставили **{format_number(amount)}** монет.",
+                color=0xFFD700,  # Золотой
+                footer="PutinZov Casino | Слоты"
+            )
+        )
+        schedule_response_edit(interaction, embed, SLOTS_SPIN_DELAY)
     
     except Exception as e:
         print(f"Error executing slots command: {e}")
-        await interaction.followup.send(
-            content="Произошла ошибка при обработке игры в слоты!",
+        command_metrics.record_error(interaction)
+        if interaction.response.is_done():
+            queue_followup(
+                interaction,
+                content="Произошла ошибка при обработке игры в слоты!",
+                ephemeral=True
+            )
+        else:
+            await send_response(
+                interaction,
+                content="Произошла ошибка при обработке игры в слоты!",
+                ephemeral=True
+            )
+
+#########################
+# ДОКАЗУЕМАЯ ЧЕСТНОСТЬ
+#########################
+
+def save_fair_seed(name: str, fair_seed: FairSeed):
+    """Сохранить нераскрытый серверный сид игры, чтобы его можно было раскрыть после перезапуска"""
+    if name in GAME_TYPES_BY_VALUE:
+        storage.set_setting(f"fair_seed:{name}", json.dumps([fair_seed.server_seed.hex(), fair_seed.client_seed]))
+
+def save_revealed_seed(name: str, server_seed: str, client_seed: str, consumed: Optional[int]):
+    """Сохранить последний раскрытый сид игры (consumed неизвестен, если сид раскрыт при запуске)"""
+    storage.set_setting(f"fair_revealed:{name}", json.dumps([server_seed, client_seed, consumed]))
+
+def restore_fair_seeds():
+    """Раскрыть серверные сиды прошлого запуска и сохранять все новые сиды
+    
+    Продолжить старый поток нельзя (позиция после сбоя неизвестна), поэтому
+    его сид раскрывается, а игры начинаются на новой паре сидов.
+    """
+    for game_type in GameType:
+        key = f"fair_seed:{game_type.value}"
+        saved = storage.get_setting(key)
+        if saved:
+            server_seed, client_seed = json.loads(saved)
+            save_revealed_seed(game_type.value, server_seed, client_seed, None)
+            storage.set_setting(key, "")
+            print(f"Revealed {game_type.value} server seed of the previous run")
+    
+    rng.on_new_seed = save_fair_seed
+    for name, fair_seed in rng.fair_seeds.items():
+        save_fair_seed(name, fair_seed)
+
+@bot.tree.command(name="fair", description="Проверить честность генератора случайных чисел")
+async def fair(interaction: discord.Interaction):
+    """Показать опубликованные хеши серверных сидов"""
+    try:
+        if rng.mode != "fair":
+            await send_response(
+                interaction,
+                content="Режим доказуемой честности сейчас выключен.",
+                ephemeral=True
+            )
+            return
+        
+        fields = []
+        for game_type in GameType:
+            server_seed_hash, client_seed, consumed = rng.commitment(game_type.value)
+            value = f"Хеш серверного сида: `{server_seed_hash}`\nКлиентский сид: `{client_seed}`\nИспользовано байтов: **{format_number(consumed)}**"
+            
+            revealed = storage.get_setting(f"fair_revealed:{game_type.value}")
+            if revealed:
+                old_server_seed, old_client_seed, old_consumed = json.loads(revealed)
+                value += f"\nПоследний раскрытый сид: `{old_server_seed}` (клиентский сид `{old_client_seed}`" + \
+                         (f", использовано байтов: {format_number(old_consumed)})" if old_consumed is not None else ", раскрыт при перезапуске)")
+            
+            fields.append({
+                "name": GAME_TYPE_NAMES[game_type],
+                "value": value,
+                "inline": False
+            })
+        
+        await send_response(
+            interaction,
+            embed=create_embed(
+                title="Доказуемая честность",
+                description="Результаты игр вычисляются как HMAC-SHA256(серверный сид, \"клиентский_сид:номер_блока\"). " +
+                            "Серверный сид раскрывается при смене пары сидов и при перезапуске бота - по нему можно воспроизвести все игры и сверить хеш.\n\n" +
+                            "В подписи результата каждой игры указана ее позиция в потоке: начало хеша серверного сида и число байтов, " +
+                            "использованных до игры (в блэкджеке - позиция перемешивания башмака и номер первой карты раздачи).",
+                color=0x5865F2,  # Синий Discord
+                fields=fields,
+                footer="PutinZov Casino | Честная игра"
+            ),
+            ephemeral=True
+        )
+    
+    except Exception as e:
+        print(f"Error executing fair command: {e}")
+        command_metrics.record_error(interaction)
+        await send_response(
+            interaction,
+            content="Произошла ошибка при получении данных о честности!",
             ephemeral=True
         )
 
@@ -1320,11 +4242,16 @@ async def slots(interaction: discord.Interaction, amount: int):
 async def leaderboard(interaction: discord.Interaction, scope: str = "server"):
     """Команда для отображения таблицы лидеров"""
     try:
-        # Получаем топ-10 пользователей
-        top_users = storage.get_users_by_balance_desc(10)
+        # Получаем топ-10 пользователей сервера или всего казино
+        if scope == "server" and interaction.guild_id:
+            top_users = storage.get_guild_users_by_balance_desc(str(interaction.guild_id), 10)
+        else:
+            scope = "global"
+            top_users = storage.get_users_by_balance_desc(10)
         
         if not top_users:
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Таблица лидеров пуста",
                     description="Еще никто не играл в игры.",
@@ -1335,9 +4262,6 @@ async def leaderboard(interaction: discord.Interaction, scope: str = "server"):
             )
             return
         
-        # В реальной имплементации здесь можно фильтровать пользователей по серверу
-        # для "server" scope, но в демо мы показываем всех пользователей
-        
         # Форматируем таблицу лидеров
         leaderboard_text = ""
         
@@ -1373,11 +4297,13 @@ async def leaderboard(interaction: discord.Interaction, scope: str = "server"):
             footer="PutinZov Casino | Таблица лидеров"
         )
         
-        await interaction.response.send_message(embed=embed)
+        await send_response(interaction, embed=embed)
     
     except Exception as e:
         print(f"Error executing leaderboard command: {e}")
-        await interaction.response.send_message(
+        command_metrics.record_error(interaction)
+        await send_response(
+            interaction,
             content="Произошла ошибка при отображении таблицы лидеров!",
             ephemeral=True
         )
@@ -1401,18 +4327,16 @@ class AdminCommands(discord.app_commands.Group):
         try:
             # Проверка прав администратора
             if not interaction.user.guild_permissions.administrator:
-                await interaction.response.send_message(
-                    embed=create_embed(
-                        title="Доступ запрещен",
-                        description="Для использования этой команды необходимы права администратора.",
-                        color=0xED4245  # Красный
-                    ),
+                await send_response(
+                    interaction,
+                    embed=ACCESS_DENIED_EMBED.render(),
                     ephemeral=True
                 )
                 return
             
             if amount < 1:
-                await interaction.response.send_message(
+                await send_response(
+                    interaction,
                     content="Количество монет должно быть больше 0!",
                     ephemeral=True
                 )
@@ -1433,10 +4357,10 @@ class AdminCommands(discord.app_commands.Group):
                 )
             
             # Обновляем баланс
-            new_balance = db_user.balance + amount
-            storage.update_user_balance(user_id, new_balance)
+            new_balance = storage.credit_user_balance(user_id, amount, LedgerEntryType.ADMIN_GIVE).balance
             
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Монеты добавлены",
                     description=f"Вы выдали **{format_number(amount)}** монет пользователю **{user.display_name}**.\nЕго новый баланс: **{format_number(new_balance)}** монет.",
@@ -1448,7 +4372,9 @@ class AdminCommands(discord.app_commands.Group):
         
         except Exception as e:
             print(f"Error executing admin give command: {e}")
-            await interaction.response.send_message(
+            command_metrics.record_error(interaction)
+            await send_response(
+                interaction,
                 content="Произошла ошибка при выдаче монет!",
                 ephemeral=True
             )
@@ -1462,18 +4388,16 @@ class AdminCommands(discord.app_commands.Group):
         try:
             # Проверка прав администратора
             if not interaction.user.guild_permissions.administrator:
-                await interaction.response.send_message(
-                    embed=create_embed(
-                        title="Доступ запрещен",
-                        description="Для использования этой команды необходимы права администратора.",
-                        color=0xED4245  # Красный
-                    ),
+                await send_response(
+                    interaction,
+                    embed=ACCESS_DENIED_EMBED.render(),
                     ephemeral=True
                 )
                 return
             
             if amount < 1:
-                await interaction.response.send_message(
+                await send_response(
+                    interaction,
                     content="Количество монет должно быть больше 0!",
                     ephemeral=True
                 )
@@ -1485,7 +4409,8 @@ class AdminCommands(discord.app_commands.Group):
             db_user = storage.get_user(user_id)
             
             if not db_user:
-                await interaction.response.send_message(
+                await send_response(
+                    interaction,
                     embed=create_embed(
                         title="Пользователь не найден",
                         description=f"**{user.display_name}** еще не имеет аккаунта.",
@@ -1496,24 +4421,23 @@ class AdminCommands(discord.app_commands.Group):
                 )
                 return
             
-            # Проверяем, достаточно ли монет у пользователя
-            if db_user.balance < amount:
-                await interaction.response.send_message(
-                    embed=create_embed(
-                        title="Недостаточно средств",
-                        description=f"У **{user.display_name}** только **{format_number(db_user.balance)}** монет, но вы пытаетесь забрать **{format_number(amount)}** монет.",
-                        color=0xED4245,  # Красный
-                        footer="PutinZov Casino | Админ-команда"
+            # Атомарно списываем монеты, если их достаточно
+            if not storage.debit_user_balance(user_id, amount, LedgerEntryType.ADMIN_TAKE):
+                await send_response(
+                    interaction,
+                    embed=INSUFFICIENT_FUNDS_TAKE_EMBED.render(
+                        name=user.display_name,
+                        balance=format_number(db_user.balance),
+                        amount=format_number(amount)
                     ),
                     ephemeral=True
                 )
                 return
             
-            # Обновляем баланс
-            new_balance = db_user.balance - amount
-            storage.update_user_balance(user_id, new_balance)
+            new_balance = db_user.balance
             
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Монеты изъяты",
                     description=f"Вы забрали **{format_number(amount)}** монет у пользователя **{user.display_name}**.\nЕго новый баланс: **{format_number(new_balance)}** монет.",
@@ -1525,7 +4449,9 @@ class AdminCommands(discord.app_commands.Group):
         
         except Exception as e:
             print(f"Error executing admin take command: {e}")
-            await interaction.response.send_message(
+            command_metrics.record_error(interaction)
+            await send_response(
+                interaction,
                 content="Произошла ошибка при изъятии монет!",
                 ephemeral=True
             )
@@ -1539,18 +4465,16 @@ class AdminCommands(discord.app_commands.Group):
         try:
             # Проверка прав администратора
             if not interaction.user.guild_permissions.administrator:
-                await interaction.response.send_message(
-                    embed=create_embed(
-                        title="Доступ запрещен",
-                        description="Для использования этой команды необходимы права администратора.",
-                        color=0xED4245  # Красный
-                    ),
+                await send_response(
+                    interaction,
+                    embed=ACCESS_DENIED_EMBED.render(),
                     ephemeral=True
                 )
                 return
             
             if amount < 0:
-                await interaction.response.send_message(
+                await send_response(
+                    interaction,
                     content="Сумма не может быть отрицательной!",
                     ephemeral=True
                 )
@@ -1571,7 +4495,8 @@ class AdminCommands(discord.app_commands.Group):
                     is_admin=False
                 )
             
-            await interaction.response.send_message(
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Баланс сброшен",
                     description=f"Баланс пользователя **{user.display_name}** был сброшен до **{format_number(amount)}** монет.",
@@ -1583,7 +4508,9 @@ class AdminCommands(discord.app_commands.Group):
         
         except Exception as e:
             print(f"Error executing admin reset command: {e}")
-            await interaction.response.send_message(
+            command_metrics.record_error(interaction)
+            await send_response(
+                interaction,
                 content="Произошла ошибка при сбросе баланса!",
                 ephemeral=True
             )
@@ -1595,12 +4522,9 @@ class AdminCommands(discord.app_commands.Group):
         try:
             # Проверка прав администратора
             if not interaction.user.guild_permissions.administrator:
-                await interaction.response.send_message(
-                    embed=create_embed(
-                        title="Доступ запрещен",
-                        description="Для использования этой команды необходимы права администратора.",
-                        color=0xED4245  # Красный
-                    ),
+                await send_response(
+                    interaction,
+                    embed=ACCESS_DENIED_EMBED.render(),
                     ephemeral=True
                 )
                 return
@@ -1609,6 +4533,7 @@ class AdminCommands(discord.app_commands.Group):
             total_users = storage.get_total_users()
             total_coins = storage.get_total_coins()
             games_played_today = storage.get_games_played_today()
+            game_totals = storage.get_game_type_totals()
             
             # Получаем топ-5 пользователей
             top_users = storage.get_users_by_balance_desc(5)
@@ -1622,7 +4547,14 @@ class AdminCommands(discord.app_commands.Group):
             if not top_users_list:
                 top_users_list = "Пользователей пока нет"
             
-            await interaction.response.send_message(
+            # Форматируем суммы по играм
+            game_totals_list = ""
+            for game_type, (wagered, paid_out) in game_totals.items():
+                rtp = f", RTP {paid_out / wagered:.1%}" if wagered else ""
+                game_totals_list += f"**{GAME_TYPE_NAMES[game_type]}**: поставлено {format_number(wagered)}, выплачено {format_number(paid_out)}{rtp}\n"
+            
+            await send_response(
+                interaction,
                 embed=create_embed(
                     title="Статистика экономики казино",
                     description="Текущая статистика экономики PutinZov Casino",
@@ -1631,6 +4563,7 @@ class AdminCommands(discord.app_commands.Group):
                         {"name": "Всего пользователей", "value": str(total_users), "inline": True},
                         {"name": "Всего монет", "value": format_number(total_coins), "inline": True},
                         {"name": "Игр сегодня", "value": str(games_played_today), "inline": True},
+                        {"name": "Ставки по играм", "value": game_totals_list, "inline": False},
                         {"name": "Топ-5 богатейших пользователей", "value": top_users_list, "inline": False}
                     ],
                     footer="PutinZov Casino | Админ-статистика"
@@ -1639,15 +4572,337 @@ class AdminCommands(discord.app_commands.Group):
         
         except Exception as e:
             print(f"Error executing admin stats command: {e}")
-            await interaction.response.send_message(
+            command_metrics.record_error(interaction)
+            await send_response(
+                interaction,
                 content="Произошла ошибка при получении статистики!",
                 ephemeral=True
             )
+    
+    @app_commands.command(name="audit", description="Восстановить баланс пользователя на момент времени")
+    @app_commands.describe(user="Пользователь для проверки",
+                         moment="Момент времени в формате ГГГГ-ММ-ДД ЧЧ:ММ")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def admin_audit(self, interaction: discord.Interaction, user: discord.User, moment: str):
+        """Команда для аудита баланса по журналу"""
+        try:
+            # Проверка прав администратора
+            if not interaction.user.guild_permissions.administrator:
+                await send_response(
+                    interaction,
+                    embed=ACCESS_DENIED_EMBED.render(),
+                    ephemeral=True
+                )
+                return
+            
+            try:
+                when = datetime.datetime.fromisoformat(moment)
+            except ValueError:
+                await send_response(
+                    interaction,
+                    content="Неверный формат времени! Используйте ГГГГ-ММ-ДД ЧЧ:ММ",
+                    ephemeral=True
+                )
+                return
+            
+            balance_then = await storage.get_balance_at(str(user.id), when)
+            
+            if balance_then is None:
+                description = f"У **{user.display_name}** не было аккаунта на **{when:%Y-%m-%d %H:%M}**."
+            else:
+                description = f"Баланс **{user.display_name}** на **{when:%Y-%m-%d %H:%M}**: **{format_number(balance_then)}** монет."
+            
+            await send_response(
+                interaction,
+                embed=create_embed(
+                    title="Аудит баланса",
+                    description=description,
+                    color=0x5865F2,  # Синий Discord
+                    footer="PutinZov Casino | Админ-команда"
+                ),
+                ephemeral=True
+            )
+        
+        except Exception as e:
+            print(f"Error executing admin audit command: {e}")
+            command_metrics.record_error(interaction)
+            await send_response(
+                interaction,
+                content="Произошла ошибка при аудите баланса!",
+                ephemeral=True
+            )
+
+    @app_commands.command(name="fair", description="Раскрыть серверный сид игры и начать новую пару сидов")
+    @app_commands.describe(game="Игра", client_seed="Новый клиентский сид (необязательно)")
+    @app_commands.choices(game=[
+        app_commands.Choice(name=GAME_TYPE_NAMES[game_type], value=game_type.value) for game_type in GameType
+    ])
+    @app_commands.checks.has_permissions(administrator=True)
+    async def admin_fair(self, interaction: discord.Interaction, game: str, client_seed: Optional[str] = None):
+        """Команда для смены пары сидов честного режима"""
+        try:
+            # Проверка прав администратора
+            if not interaction.user.guild_permissions.administrator:
+                await send_response(
+                    interaction,
+                    embed=ACCESS_DENIED_EMBED.render(),
+                    ephemeral=True
+                )
+                return
+            
+            revealed = rng.rotate(game, client_seed)
+            if revealed is None:
+                await send_response(
+                    interaction,
+                    content="Режим доказуемой честности сейчас выключен.",
+                    ephemeral=True
+                )
+                return
+            
+            server_seed, old_client_seed, consumed = revealed
+            save_revealed_seed(game, server_seed, old_client_seed, consumed)
+            
+            if game == GameType.BLACKJACK.value:
+                reseed_blackjack_shoes()
+
+            server_seed_hash, new_client_seed, _ = rng.commitment(game)
+            
+            await send_response(
+                interaction,
+                embed=create_embed(
+                    title="Смена сидов",
+                    description=f"Игра: **{GAME_TYPE_NAMES[GameType(game)]}**",
+                    color=0x5865F2,  # Синий Discord
+                    fields=[
+                        {"name": "Раскрытый серверный сид", "value": f"`{server_seed}`", "inline": False},
+                        {"name": "Клиентский сид", "value": f"`{old_client_seed}`", "inline": True},
+                        {"name": "Использовано байтов", "value": format_number(consumed), "inline": True},
+                        {"name": "Новый хеш серверного сида", "value": f"`{server_seed_hash}`", "inline": False},
+                        {"name": "Новый клиентский сид", "value": f"`{new_client_seed}`", "inline": False}
+                    ],
+                    footer="PutinZov Casino | Админ-команда"
+                )
+            )
+        
+        except Exception as e:
+            print(f"Error executing admin fair command: {e}")
+            command_metrics.record_error(interaction)
+            await send_response(
+                interaction,
+                content="Произошла ошибка при смене сидов!",
+                ephemeral=True
+            )
+
+    @app_commands.command(name="metrics", description="Посмотреть нагрузку и задержки команд")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def admin_metrics(self, interaction: discord.Interaction):
+        """Команда для просмотра метрик команд"""
+        try:
+            # Проверка прав администратора
+            if not interaction.user.guild_permissions.administrator:
+                await send_response(
+                    interaction,
+                    embed=ACCESS_DENIED_EMBED.render(),
+                    ephemeral=True
+                )
+                return
+            
+            uptime = time.time() - command_metrics.started
+            total_calls = sum(stats.calls for stats in command_metrics.commands.values())
+            
+            fields = []
+            for name, stats in command_metrics.hot_commands():
+                fields.append({
+                    "name": f"/{name}",
+                    "value": f"Вызовов: **{format_number(stats.calls)}**, ошибок: **{format_number(stats.errors)}**\n" +
+                             f"Всего: {format_latency(stats.latency)} мс\n" +
+                             f"Свой код: {format_latency(stats.own)} мс\n" +
+                             f"Discord API: {format_latency(stats.api)} мс",
+                    "inline": False
+                })
+            
+            fields.append({
+                "name": "Очередь исходящих сообщений",
+                "value": f"В очереди: **{len(outbound)}**, отправляется: **{outbound.in_flight}**\n" +
+                         f"Отправлено: **{format_number(outbound.sent)}**, объединено правок: **{format_number(outbound.coalesced)}**, " +
+                         f"ошибок: **{format_number(outbound.errors)}**\n" +
+                         f"Время до отправки: {format_latency(outbound.send_latency)} мс",
+                "inline": False
+            })
+            
+            await send_response(
+                interaction,
+                embed=create_embed(
+                    title="Метрики команд",
+                    description=f"Вызовов за **{uptime / 3600:.1f} ч**: **{format_number(total_calls)}** " +
+                                f"({total_calls / max(uptime, 1):.2f}/с). Задержки p50 / p95 / p99, самые затратные команды:" +
+                                ("" if command_metrics.commands else "\n\nКоманды еще не вызывались."),
+                    color=0x5865F2,  # Синий Discord
+                    fields=fields,
+                    footer="PutinZov Casino | Админ-команда"
+                ),
+                ephemeral=True
+            )
+        
+        except Exception as e:
+            print(f"Error executing admin metrics command: {e}")
+            command_metrics.record_error(interaction)
+            await send_response(
+                interaction,
+                content="Произошла ошибка при получении метрик!",
+                ephemeral=True
+            )
 
 #########################
 # КОМАНДЫ ПОМОЩИ
 #########################
 
+# Справка собирается один раз при запуске
+HELP_EMBEDS = {
+    None: EmbedTemplate(  # Общая помощь
+        title="PutinZov Casino - Помощь",
+        description="Добро пожаловать в PutinZov Casino! Доступные категории команд:",
+        color=0x5865F2,  # Синий Discord
+        fields=[
+            {
+                "name": "Команды экономики",
+                "value": "Команды для управления монетами и экономикой\nИспользуйте `/help economy` для подробностей",
+                "inline": False
+            },
+            {
+                "name": "Игровые команды",
+                "value": "Играйте в казино-игры и выигрывайте монеты\nИспользуйте `/help games` для подробностей",
+                "inline": False
+            },
+            {
+                "name": "Административные команды",
+                "value": "Команды для администраторов сервера\nИспользуйте `/help admin` для подробностей",
+                "inline": False
+            },
+            {
+                "name": "Начало работы",
+                "value": "Каждый пользователь начинает с 10,000 монет! Используйте их для игры и попробуйте стать самым богатым игроком.",
+                "inline": False
+            }
+        ],
+        footer="PutinZov Casino | Помощь"
+    ),
+    "economy": EmbedTemplate(  # Помощь по экономике
+        title="Команды экономики",
+        description="Команды для управления монетами и экономикой:",
+        color=0xFFD700,  # Золотой
+        fields=[
+            {
+                "name": "/balance [пользователь]",
+                "value": "Проверить свой баланс или баланс другого пользователя",
+                "inline": False
+            },
+            {
+                "name": "/daily",
+                "value": "Получить ежедневный бонус в 1,000 монет (раз в день)",
+                "inline": False
+            },
+            {
+                "name": "/transfer <пользователь> <сумма>",
+                "value": "Перевести монеты другому пользователю",
+                "inline": False
+            },
+            {
+                "name": "/leaderboard [global|server]",
+                "value": "Посмотреть самых богатых игроков на сервере или глобально",
+                "inline": False
+            }
+        ],
+        footer="PutinZov Casino | Команды экономики"
+    ),
+    "games": EmbedTemplate(  # Помощь по играм
+        title="Игровые команды",
+        description="Попробуйте свою удачу в этих захватывающих казино-играх:",
+        color=0x57F287,  # Зеленый
+        fields=[
+            {
+                "name": "Рулетка",
+                "value":
+                    "`/roulette bet <сумма> <тип_ставки> [номер]` - Сделать ставку в рулетке\n" +
+                    "`/roulette help` - Узнать правила рулетки",
+                "inline": False
+            },
+            {
+                "name": "Блэкджек",
+                "value": "`/blackjack <сумма>` - Сыграть в блэкджек",
+                "inline": False
+            },
+            {
+                "name": "Слоты",
+                "value": "`/slots <сумма>` - Сыграть в слоты",
+                "inline": False
+            },
+            {
+                "name": "Честная игра",
+                "value": "`/fair` - Хеши серверных сидов для проверки результатов",
+                "inline": False
+            },
+            {
+                "name": "Выплаты",
+                "value":
+                    "**Рулетка**: До 35:1 (ставка на точное число)\n" +
+                    "**Блэкджек**: 1:1 (победа), 3:2 (блэкджек), 2:1 (страховка)\n" +
+                    "**Слоты**: 5 линий, до 35x за линию (джекпот 7️⃣7️⃣7️⃣)",
+                "inline": False
+            }
+        ],
+        footer="PutinZov Casino | Игровые команды"
+    ),
+    "admin": EmbedTemplate(  # Помощь по админ-командам
+        title="Административные команды",
+        description="Команды для администраторов сервера по управлению экономикой казино:",
+        color=0xED4245,  # Красный
+        fields=[
+            {
+                "name": "/admin give <пользователь> <сумма>",
+                "value": "Выдать монеты пользователю",
+                "inline": False
+            },
+            {
+                "name": "/admin take <пользователь> <сумма>",
+                "value": "Забрать монеты у пользователя",
+                "inline": False
+            },
+            {
+                "name": "/admin reset <пользователь> [сумма]",
+                "value": "Сбросить баланс пользователя до 10,000 монет (или указанной суммы)",
+                "inline": False
+            },
+            {
+                "name": "/admin stats",
+                "value": "Просмотреть статистику экономики сервера",
+                "inline": False
+            },
+            {
+                "name": "/admin audit <пользователь> <ГГГГ-ММ-ДД ЧЧ:ММ>",
+                "value": "Восстановить баланс пользователя на момент времени по журналу",
+                "inline": False
+            },
+            {
+                "name": "/admin fair <игра> [клиентский_сид]",
+                "value": "Раскрыть серверный сид игры и начать новую пару сидов",
+                "inline": False
+            },
+            {
+                "name": "/admin metrics",
+                "value": "Посмотреть число вызовов, ошибки и задержки команд",
+                "inline": False
+            }
+        ],
+        footer="PutinZov Casino | Административные команды"
+    ),
+}
+ADMIN_HELP_DENIED_EMBED = EmbedTemplate(
+    title="Доступ запрещен",
+    description="Для просмотра административных команд необходимы права администратора.",
+    color=0xED4245  # Красный
+)
+
 @bot.tree.command(name="help", description="Получить помощь по командам казино")
 @app_commands.describe(category="Категория команд")
 @app_commands.choices(category=[
@@ -1658,158 +4913,22 @@ class AdminCommands(discord.app_commands.Group):
 async def help_command(interaction: discord.Interaction, category: str = None):
     """Команда помощи"""
     try:
-        if not category:
-            # Общая помощь
-            embed = create_embed(
-                title="PutinZov Casino - Помощь",
-                description="Добро пожаловать в PutinZov Casino! Доступные категории команд:",
-                color=0x5865F2,  # Синий Discord
-                fields=[
-                    {
-                        "name": "Команды экономики",
-                        "value": "Команды для управления монетами и экономикой\nИспользуйте `/help economy` для подробностей",
-                        "inline": False
-                    },
-                    {
-                        "name": "Игровые команды",
-                        "value": "Играйте в казино-игры и выигрывайте монеты\nИспользуйте `/help games` для подробностей",
-                        "inline": False
-                    },
-                    {
-                        "name": "Административные команды",
-                        "value": "Команды для администраторов сервера\nИспользуйте `/help admin` для подробностей",
-                        "inline": False
-                    },
-                    {
-                        "name": "Начало работы",
-                        "value": "Каждый пользователь начинает с 10,000 монет! Используйте их для игры и попробуйте стать самым богатым игроком.",
-                        "inline": False
-                    }
-                ],
-                footer="PutinZov Casino | Помощь"
-            )
-            
-            await interaction.response.send_message(embed=embed)
-        
-        elif category == "economy":
-            # Помощь по экономике
-            embed = create_embed(
-                title="Команды экономики",
-                description="Команды для управления монетами и экономикой:",
-                color=0xFFD700,  # Золотой
-                fields=[
-                    {
-                        "name": "/balance [пользователь]",
-                        "value": "Проверить свой баланс или баланс другого пользователя",
-                        "inline": False
-                    },
-                    {
-                        "name": "/daily",
-                        "value": "Получить ежедневный бонус в 1,000 монет (раз в день)",
-                        "inline": False
-                    },
-                    {
-                        "name": "/transfer <пользователь> <сумма>",
-                        "value": "Перевести монеты другому пользователю",
-                        "inline": False
-                    },
-                    {
-                        "name": "/leaderboard [global|server]",
-                        "value": "Посмотреть самых богатых игроков на сервере или глобально",
-                        "inline": False
-                    }
-                ],
-                footer="PutinZov Casino | Команды экономики"
-            )
-            
-            await interaction.response.send_message(embed=embed)
-        
-        elif category == "games":
-            # Помощь по играм
-            embed = create_embed(
-                title="Игровые команды",
-                description="Попробуйте свою удачу в этих захватывающих казино-играх:",
-                color=0x57F287,  # Зеленый
-                fields=[
-                    {
-                        "name": "Рулетка",
-                        "value":
-                            "`/roulette bet <сумма> <тип_ставки> [номер]` - Сделать ставку в рулетке\n" +
-                            "`/roulette help` - Узнать правила рулетки",
-                        "inline": False
-                    },
-                    {
-                        "name": "Блэкджек",
-                        "value": "`/blackjack <сумма>` - Сыграть в блэкджек",
-                        "inline": False
-                    },
-                    {
-                        "name": "Слоты",
-                        "value": "`/slots <сумма>` - Сыграть в слоты",
-                        "inline": False
-                    },
-                    {
-                        "name": "Выплаты",
-                        "value":
-                            "**Рулетка**: До 35:1 (ставка на точное число)\n" +
-                            "**Блэкджек**: 1:1 (победа), 3:2 (блэкджек)\n" +
-                            "**Слоты**: До 50:1 (джекпот)",
-                        "inline": False
-                    }
-                ],
-                footer="PutinZov Casino | Игровые команды"
+        # Проверяем, является ли пользователь администратором
+        if category == "admin" and not interaction.user.guild_permissions.administrator:
+            await send_response(
+                interaction,
+                embed=ADMIN_HELP_DENIED_EMBED.render(),
+                ephemeral=True
             )
-            
-            await interaction.response.send_message(embed=embed)
+            return
         
-        elif category == "admin":
-            # Помощь по админ-командам
-            # Проверяем, является ли пользователь администратором
-            if not interaction.user.guild_permissions.administrator:
-                await interaction.response.send_message(
-                    embed=create_embed(
-                        title="Доступ запрещен",
-                        description="Для просмотра административных команд необходимы права администратора.",
-                        color=0xED4245  # Красный
-                    ),
-                    ephemeral=True
-                )
-                return
-            
-            embed = create_embed(
-                title="Административные команды",
-                description="Команды для администраторов сервера по управлению экономикой казино:",
-                color=0xED4245,  # Красный
-                fields=[
-                    {
-                        "name": "/admin give <пользователь> <сумма>",
-                        "value": "Выдать монеты пользователю",
-                        "inline": False
-                    },
-                    {
-                        "name": "/admin take <пользователь> <сумма>",
-                        "value": "Забрать монеты у пользователя",
-                        "inline": False
-                    },
-                    {
-                        "name": "/admin reset <пользователь> [сумма]",
-                        "value": "Сбросить баланс пользователя до 10,000 монет (или указанной суммы)",
-                        "inline": False
-                    },
-                    {
-                        "name": "/admin stats",
-                        "value": "Просмотреть статистику экономики сервера",
-                        "inline": False
-                    }
-                ],
-                footer="PutinZov Casino | Административные команды"
-            )
-            
-            await interaction.response.send_message(embed=embed)
+        await send_response(interaction, embed=HELP_EMBEDS[category].render())
     
     except Exception as e:
         print(f"Error executing help command: {e}")
-        await interaction.response.send_message(
+        command_metrics.record_error(interaction)
+        await send_response(
+            interaction,
             content="Произошла ошибка при отображении справки!",
             ephemeral=True
         )
@@ -1833,4 +4952,10 @@ if __name__ == "__main__":
         exit(1)
     
     # Запуск бота
-    bot.run(TOKEN)
\ No newline at end of file
+    try:
+        bot.run(TOKEN)
+    finally:
+        # Возвращаем ставки с невращавшихся столов и записываем оставшиеся изменения
+        if storage is not None:
+            refund_roulette_tables()
+            storage.close()
\ No newline at end of file
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Симулятор игр казино без Discord
+
+Прогоняет рулетку, слоты и блэкджек на логике из casino_bot и выводит
+RTP (возврат игроку на единицу ставки), дисперсию и доверительный интервал.
+Раунды делятся на пакеты и считаются параллельно на всех ядрах. Если
+установлен NumPy, числа для рулетки и слотов генерируются векторно.
+
+Запуск: python -m casino_sim [--rounds N] [--games roulette slots blackjack]
+                              [--workers N] [--seed N]
+"""
+
+import os
+import math
+import time
+import random
+import argparse
+import itertools
+import multiprocessing
+from typing import Dict, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from casino_bot import (
+    ROULETTE_PAYOUTS, roulette_win_mask,
+    SLOT_REEL_STRIPS, SLOT_PAY_UNIT, slot_stop_weights, get_slot_line_wins, get_slots_rtp,
+    BlackjackGame, Shoe, CARD_POINTS,
+)
+
+GAMES = ("roulette", "slots", "blackjack")
+BATCH_SIZE = 1_000_000                        # Раундов за одну векторную выборку
+BLACKJACK_BET = 100                           # Ставка в симуляции блэкджека
+ROULETTE_NUMBER = 17                          # Число для ставки на число, улицу и угол
+ROULETTE_SECOND = 20                          # Второе число для сплита
+Z_95 = 1.959964                               # Квантиль для 95% доверительного интервала
+
+# Накопленная статистика: {ключ: [раундов, сумма результата, сумма квадратов]}
+Stats = Dict[str, List[float]]
+
+def add_sample(stats: Stats, key: str, rounds: int, value: float):
+    """Учесть rounds раундов с одинаковым результатом value"""
+    entry = stats.setdefault(key, [0, 0.0, 0.0])
+    entry[0] += rounds
+    entry[1] += rounds * value
+    entry[2] += rounds * value * value
+
+def merge_stats(target: Stats, source: Stats):
+    """Сложить статистику двух пакетов"""
+    for key, (rounds, total, squares) in source.items():
+        entry = target.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += rounds
+        entry[1] += total
+        entry[2] += squares
+
+def sample_counts(reel_weights: List[List[int]], rounds: int, seed: int) -> List[int]:
+    """Гистограмма исходов за rounds раундов
+    
+    Каждый барабан (или колесо) выбирает позицию по своим весам; индекс
+    исхода - позиции всех барабанов, записанные в смешанной системе счисления.
+    """
+    sizes = [len(weights) for weights in reel_weights]
+    counts = [0] * math.prod(sizes)
+    if np is not None:
+        rng = np.random.default_rng(seed)
+        while rounds > 0:
+            batch = min(rounds, BATCH_SIZE)
+            outcome = np.zeros(batch, dtype=np.int64)
+            for size, weights in zip(sizes, reel_weights):
+                p = np.asarray(weights, dtype=float) / sum(weights)
+                outcome = outcome * size + rng.choice(size, size=batch, p=p)
+            for index, count in enumerate(np.bincount(outcome, minlength=len(counts)).tolist()):
+                counts[index] += count
+            rounds -= batch
+    else:
+        rng = random.Random(seed)
+        outcome = [0] * rounds
+        for size, weights in zip(sizes, reel_weights):
+            draws = rng.choices(range(size), weights=weights, k=rounds)
+            outcome = [index * size + draw for index, draw in zip(outcome, draws)]
+        for index in outcome:
+            counts[index] += 1
+    return counts
+
+#########################
+# ТАБЛИЦЫ ВЫПЛАТ
+#########################
+
+def roulette_return_tables() -> Dict[str, List[int]]:
+    """Возврат на единицу ставки для каждого числа колеса по типам ставок"""
+    tables = {}
+    for bet_type, multiplier in ROULETTE_PAYOUTS.items():
+        mask = roulette_win_mask(bet_type, ROULETTE_NUMBER, ROULETTE_SECOND)
+        tables[bet_type.value] = [multiplier + 1 if mask >> pocket & 1 else 0 for pocket in range(37)]
+    return tables
+
+def slots_return_table() -> List[float]:
+    """Возврат на единицу ставки для каждой комбинации остановок барабанов"""
+    return [
+        sum(pay for _, pay in get_slot_line_wins(stops)) / SLOT_PAY_UNIT
+        for stops in itertools.product(*(range(len(strip)) for strip in SLOT_REEL_STRIPS))
+    ]
+
+#########################
+# СТРАТЕГИЯ БЛЭКДЖЕКА
+#########################
+
+def basic_strategy(game: BlackjackGame) -> str:
+    """Базовая стратегия (6 колод, дилер стоит на 17, удвоение после сплита, поздняя сдача)"""
+    hand = game.current_hand
+    total = hand.value
+    upcard = CARD_POINTS[game.dealer.cards[1]]
+
+    # Пары
+    if game.can_split():
+        pair = CARD_POINTS[hand.cards[0]]
+        if (pair in (11, 8)
+                or (pair == 9 and upcard in (2, 3, 4, 5, 6, 8, 9))
+                or (pair == 7 and upcard <= 7)
+                or (pair == 6 and upcard <= 6)
+                or (pair == 4 and upcard in (5, 6))
+                or (pair in (2, 3) and upcard <= 7)):
+            return "split"
+
+    # Поздняя сдача
+    if game.can_surrender() and not hand.is_soft:
+        if (total == 16 and upcard in (9, 10, 11)) or (total == 15 and upcard == 10):
+            return "surrender"
+
+    # Мягкие суммы
+    if hand.is_soft:
+        if total >= 20:
+            return "stand"
+        if total == 19:
+            return "double" if upcard == 6 and game.can_double() else "stand"
+        if total == 18:
+            if upcard <= 6:
+                return "double" if game.can_double() else "stand"
+            return "stand" if upcard <= 8 else "hit"
+        doubles = {17: (3, 6), 16: (4, 6), 15: (4, 6), 14: (5, 6), 13: (5, 6)}[total]
+        if doubles[0] <= upcard <= doubles[1] and game.can_double():
+            return "double"
+        return "hit"
+
+    # Жесткие суммы
+    if total >= 17:
+        return "stand"
+    if total >= 13:
+        return "stand" if upcard <= 6 else "hit"
+    if total == 12:
+        return "stand" if 4 <= upcard <= 6 else "hit"
+    if total == 11:
+        return "double" if upcard != 11 and game.can_double() else "hit"
+    if total == 10:
+        return "double" if upcard <= 9 and game.can_double() else "hit"
+    if total == 9:
+        return "double" if 3 <= upcard <= 6 and game.can_double() else "hit"
+    return "hit"
+
+#########################
+# СИМУЛЯЦИЯ ПАКЕТОВ
+#########################
+
+def simulate_roulette(rounds: int, seed: int) -> Stats:
+    """Симулировать вращения рулетки для всех типов ставок"""
+    counts = sample_counts([[1] * 37], rounds, seed)
+    stats = {}
+    for name, table in roulette_return_tables().items():
+        for pocket, count in enumerate(counts):
+            if count:
+                add_sample(stats, f"roulette/{name}", count, table[pocket] - 1)
+    return stats
+
+def simulate_slots(rounds: int, seed: int) -> Stats:
+    """Симулировать вращения слотов"""
+    reel_weights = [slot_stop_weights(reel) for reel in range(len(SLOT_REEL_STRIPS))]
+    counts = sample_counts(reel_weights, rounds, seed)
+    stats = {}
+    for combination, multiplier in enumerate(slots_return_table()):
+        if counts[combination]:
+            add_sample(stats, "slots", counts[combination], multiplier - 1)
+    return stats
+
+def simulate_blackjack(rounds: int, seed: int) -> Stats:
+    """Сыграть раунды блэкджека по базовой стратегии"""
+    shoe = Shoe(random_source=random.Random(seed))
+    stats = {}
+    actions = {
+        "hit": BlackjackGame.player_hit,
+        "stand": BlackjackGame.player_stand,
+        "double": BlackjackGame.player_double,
+        "split": BlackjackGame.player_split,
+        "surrender": BlackjackGame.player_surrender,
+    }
+
+    for _ in range(rounds):
+        game = BlackjackGame("sim", BLACKJACK_BET, shoe)
+        game.deal_initial_cards()
+        if game.can_insure():
+            # Базовая стратегия не берет страховку
+            game.decline_insurance()
+        while not game.game_over and not game.dealer_turn:
+            actions[basic_strategy(game)](game)
+        if not game.game_over:
+            game.dealer_play()
+        add_sample(stats, "blackjack", 1, (game.payout - game.total_bet) / BLACKJACK_BET)
+    return stats
+
+SIMULATORS = {
+    "roulette": simulate_roulette,
+    "slots": simulate_slots,
+    "blackjack": simulate_blackjack,
+}
+
+def run_batch(game: str, rounds: int, seed: int) -> Stats:
+    """Точка входа рабочего процесса"""
+    return SIMULATORS[game](rounds, seed)
+
+#########################
+# ОТЧЕТ
+#########################
+
+def summarize(rounds: int, total: float, squares: float) -> Tuple[float, float, float]:
+    """RTP, дисперсия результата и полуширина 95% интервала для RTP"""
+    mean = total / rounds
+    variance = max(squares / rounds - mean * mean, 0.0)
+    if rounds > 1:
+        variance *= rounds / (rounds - 1)
+    return 1 + mean, variance, Z_95 * math.sqrt(variance / rounds)
+
+def report(stats: Stats):
+    """Вывести результаты симуляции"""
+    print(f"{'Игра':<24} {'Раундов':>12} {'RTP':>9} {'±95%':>8} {'Дисперсия':>10}")
+    for key in sorted(stats):
+        rounds, total, squares = stats[key]
+        rtp, variance, margin = summarize(rounds, total, squares)
+        print(f"{key:<24} {rounds:>12,} {rtp:>8.3%} {margin:>7.3%} {variance:>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Монте-Карло симуляция игр казино")
+    parser.add_argument("--rounds", type=int, default=1_000_000, help="Раундов на игру")
+    parser.add_argument("--games", nargs="+", choices=GAMES, default=list(GAMES), help="Какие игры симулировать")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Количество процессов")
+    parser.add_argument("--seed", type=int, default=None, help="Зерно генератора (для воспроизводимости)")
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    batches = args.workers * 4
+    jobs = []
+    for game in args.games:
+        for index in range(batches):
+            rounds = args.rounds // batches + (1 if index < args.rounds % batches else 0)
+            if rounds:
+                jobs.append((game, rounds, seed + len(jobs)))
+
+    print(f"Зерно: {seed}, процессов: {args.workers}, NumPy: {'да' if np is not None else 'нет'}")
+    started = time.perf_counter()
+    stats = {}
+    with multiprocessing.Pool(args.workers) as pool:
+        for batch_stats in pool.starmap(run_batch, jobs):
+            merge_stats(stats, batch_stats)
+
+    report(stats)
+    if "slots" in args.games:
+        print(f"Точный RTP слотов по конфигурации барабанов: {get_slots_rtp():.3%}")
+    print(f"Время: {time.perf_counter() - started:.1f} с")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import asyncio
+
+import casino_bot
+from casino_bot import BlackjackGame, GameOutcome, Shoe, Storage
+
+ACE, EIGHT, KING = 0, 7, 12
+
+def deal(player, dealer, rest=()):
+    """Игра с заранее заданным порядком карт (игрок, дилер, игрок, дилер, ...)"""
+    cards = bytes((player[0], dealer[0], player[1], dealer[1], *rest)) * 8
+    game = BlackjackGame("test", 100, Shoe(cards=cards))
+    game.deal_initial_cards()
+    return game
+
+def test_only_insurance_decision_while_dealer_peek_pending():
+    game = deal((EIGHT, EIGHT + 13), (KING, ACE))
+    assert game.can_insure()
+    assert not game.can_hit()
+    assert not game.can_double()
+    assert not game.can_split()
+    assert not game.can_surrender()
+
+def test_declined_insurance_against_dealer_blackjack_loses_only_original_bet():
+    game = deal((EIGHT, EIGHT + 13), (KING, ACE))
+    assert game.decline_insurance()
+    assert game.outcome == GameOutcome.LOSS
+    assert game.total_bet == 100
+    assert game.payout == 0
+
+def test_insurance_against_dealer_blackjack_pays_two_to_one():
+    game = deal((EIGHT, EIGHT + 13), (KING, ACE))
+    assert game.take_insurance()
+    assert game.total_bet == 150
+    assert game.payout == 150
+    assert game.outcome == GameOutcome.PUSH
+
+def test_play_continues_after_declining_when_dealer_has_no_blackjack():
+    game = deal((EIGHT, EIGHT + 13), (EIGHT + 26, ACE), rest=(KING,))
+    assert not game.decline_insurance()
+    assert game.can_double()
+    assert game.can_split()
+
+class FailingResponse:
+    """Ответ на взаимодействие, который Discord уже не принимает"""
+    async def edit_message(self, **kwargs):
+        raise RuntimeError("interaction expired")
+
+class FakeInteraction:
+    id = 1
+    message = None
+    response = FailingResponse()
+
+def test_dealer_turn_settles_before_rendering(monkeypatch):
+    monkeypatch.setattr(casino_bot, "storage", Storage())
+    casino_bot.storage.create_user("test", "test", balance=1000)
+    casino_bot.storage.debit_user_balance("test", 100)
+    game = deal((KING, KING + 13), (EIGHT, KING))
+    casino_bot.active_blackjack_games["test"] = game
+    game.player_stand()
+    
+    asyncio.run(casino_bot.handle_blackjack_dealer_turn(FakeInteraction(), game))
+    
+    assert "test" not in casino_bot.active_blackjack_games
+    assert game.outcome == GameOutcome.WIN
+    assert casino_bot.storage.get_user("test").balance == 1100
+    assert len(list(casino_bot.storage.iter_game_history("test"))) == 1